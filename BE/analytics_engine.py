@@ -0,0 +1,251 @@
+"""
+Engine switch for the heavy analytics aggregations.
+
+Every aggregation here can run on one of two engines:
+
+- "sqlite": the default. SQL runs on the read-only SQLite pool and
+  per-merchant transaction totals come from the in-process transaction store.
+- "duckdb": an embedded DuckDB connection that attaches grablet.db (read only)
+  and, when ANALYTICS_PARQUET_DIR is set, reads the tables found there as
+  hive-partitioned Parquet instead. Grouping, quantiles and pair counting run
+  vectorized inside DuckDB. Requires `pip install duckdb`.
+
+The engine is chosen per query: ANALYTICS_ENGINE sets the default and
+ANALYTICS_ENGINE_<QUERY NAME> (e.g. ANALYTICS_ENGINE_ITEM_PAIRS=duckdb)
+overrides it for one query. Callers can also pass engine= explicitly. When
+DuckDB is not installed every query falls back to SQLite.
+"""
+import os
+import re
+import threading
+import pandas as pd
+from database import DATABASE_URL, query_to_dataframe
+from transaction_store import get_transaction_store
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+ENGINES = ("sqlite", "duckdb")
+DEFAULT_ENGINE = os.getenv("ANALYTICS_ENGINE", "sqlite").lower()
+PARQUET_DIR = os.getenv("ANALYTICS_PARQUET_DIR")
+
+# Tables DuckDB exposes as views, read from Parquet when a snapshot exists
+ANALYTICS_TABLES = ["merchants", "transactions", "transaction_items", "items", "keywords"]
+
+CITY_MERCHANTS_QUERY = """
+SELECT merchant_id FROM merchants WHERE city_id = :city_id
+"""
+
+# Per-merchant totals are aggregated first, then averaged and ranked across the city
+CITY_REVENUE_STATS_QUERY = """
+WITH totals AS (
+    SELECT
+        t.merchant_id,
+        SUM(t.order_value) AS revenue,
+        COUNT(*) AS orders,
+        SUM(epoch(CAST(t.delivery_time AS TIMESTAMP)) - epoch(CAST(t.order_time AS TIMESTAMP))) / 60.0 AS delivery_mins_sum,
+        COUNT(t.delivery_time) AS delivery_count
+    FROM transactions t
+    JOIN merchants m ON m.merchant_id = t.merchant_id
+    WHERE m.city_id = :city_id
+    GROUP BY t.merchant_id
+)
+SELECT
+    COUNT(*) AS merchants,
+    AVG(revenue) AS revenue_avg,
+    quantile_cont(revenue, 0.75) AS revenue_p75,
+    AVG(orders) AS orders_avg,
+    quantile_cont(orders, 0.75) AS orders_p75,
+    SUM(delivery_mins_sum) / NULLIF(SUM(delivery_count), 0) AS delivery_avg_mins
+FROM totals
+"""
+
+PLATFORM_REVENUE_STATS_QUERY = """
+SELECT
+    COUNT(DISTINCT merchant_id) AS merchants,
+    COUNT(*) AS orders,
+    SUM(order_value) AS revenue,
+    SUM(order_value) / NULLIF(COUNT(*), 0) AS avg_order_value
+FROM transactions
+"""
+
+# Same SQL on both engines
+CATEGORY_COUNTS_QUERY = """
+SELECT i.cuisine_tag, COUNT(*) AS count
+FROM transaction_items ti
+JOIN items i ON ti.item_id = i.item_id
+WHERE ti.merchant_id = :merchant_id
+GROUP BY i.cuisine_tag
+ORDER BY count DESC
+"""
+
+# Distinct (order, item) rows of the merchant's own items, self-joined once
+# per unordered pair (a.item_id < b.item_id) and counted per pair
+ITEM_PAIRS_QUERY = """
+WITH order_items AS (
+    SELECT DISTINCT ti.order_id, ti.item_id
+    FROM transactions t
+    JOIN transaction_items ti ON ti.order_id = t.order_id
+    JOIN items i ON i.item_id = ti.item_id AND i.merchant_id = :merchant_id
+    WHERE t.merchant_id = :merchant_id
+)
+SELECT a.item_id AS item1, b.item_id AS item2, COUNT(*) AS count
+FROM order_items a
+JOIN order_items b ON a.order_id = b.order_id AND a.item_id < b.item_id
+GROUP BY a.item_id, b.item_id
+ORDER BY count DESC, item1, item2
+LIMIT :limit
+"""
+
+_NAMED_PARAM = re.compile(r"(?<![:\w]):(\w+)")
+
+_duck_lock = threading.Lock()
+_duck_conn = None
+
+
+def get_engine(query_name: str, engine: str = None) -> str:
+    """
+    Resolve the engine for a query: explicit argument, then the per-query
+    ANALYTICS_ENGINE_<NAME> variable, then ANALYTICS_ENGINE.
+    """
+    choice = (engine or os.getenv(f"ANALYTICS_ENGINE_{query_name.upper()}") or DEFAULT_ENGINE).lower()
+    if choice not in ENGINES:
+        raise ValueError(f"Unknown analytics engine '{choice}', expected one of {ENGINES}")
+    if choice == "duckdb" and duckdb is None:
+        return "sqlite"
+    return choice
+
+
+def _duckdb_connection():
+    """Open the process-wide DuckDB connection on first use"""
+    global _duck_conn
+    if _duck_conn is None:
+        with _duck_lock:
+            if _duck_conn is None:
+                conn = duckdb.connect(":memory:")
+                conn.execute("INSTALL sqlite")
+                conn.execute("LOAD sqlite")
+                db_path = DATABASE_URL.replace("sqlite:///", "", 1)
+                conn.execute(f"ATTACH '{db_path}' AS grablet (TYPE sqlite, READ_ONLY)")
+                for table in ANALYTICS_TABLES:
+                    table_dir = os.path.join(PARQUET_DIR, table) if PARQUET_DIR else None
+                    if table_dir and os.path.isdir(table_dir):
+                        source = f"read_parquet('{table_dir}/**/*.parquet', hive_partitioning = true, hive_types_autocast = false)"
+                    else:
+                        source = f"grablet.{table}"
+                    conn.execute(f"CREATE OR REPLACE VIEW {table} AS SELECT * FROM {source}")
+                _duck_conn = conn
+    return _duck_conn
+
+
+def reset_duckdb():
+    """Close the DuckDB connection so the next query re-attaches the current files"""
+    global _duck_conn
+    with _duck_lock:
+        if _duck_conn is not None:
+            _duck_conn.close()
+            _duck_conn = None
+
+
+def run_query(query_name: str, query: str, params: dict = None, engine: str = None) -> pd.DataFrame:
+    """
+    Run an analytics query on the engine selected for query_name.
+
+    Args:
+        query_name: Name used to look up the per-query engine override
+        query: SQL with :named parameters
+        params: Parameter values
+        engine: Optional explicit engine ("sqlite" or "duckdb")
+
+    Returns:
+        pd.DataFrame: Query result
+    """
+    if get_engine(query_name, engine) == "duckdb":
+        # Every thread gets its own cursor on the shared database
+        cursor = _duckdb_connection().cursor()
+        try:
+            return cursor.execute(_NAMED_PARAM.sub(r"$\1", query), params or {}).df()
+        finally:
+            cursor.close()
+    return query_to_dataframe(query, params)
+
+
+def _none_if_nan(value):
+    return None if pd.isna(value) else float(value)
+
+
+def city_revenue_stats(city_id, engine: str = None) -> dict:
+    """
+    Get revenue, order volume and delivery speed statistics across the
+    merchants of a city that have transactions.
+
+    Args:
+        city_id: The city to aggregate
+        engine: Optional explicit engine
+
+    Returns:
+        dict: merchants, revenue_avg, revenue_p75, orders_avg, orders_p75 and
+        delivery_avg_mins (None when there is no delivery data)
+    """
+    if get_engine("city_revenue_stats", engine) == "duckdb":
+        row = run_query("city_revenue_stats", CITY_REVENUE_STATS_QUERY, {"city_id": city_id}, "duckdb").iloc[0]
+        return {
+            "merchants": int(row["merchants"]),
+            "revenue_avg": _none_if_nan(row["revenue_avg"]),
+            "revenue_p75": _none_if_nan(row["revenue_p75"]),
+            "orders_avg": _none_if_nan(row["orders_avg"]),
+            "orders_p75": _none_if_nan(row["orders_p75"]),
+            "delivery_avg_mins": _none_if_nan(row["delivery_avg_mins"]),
+        }
+
+    city_merchants = query_to_dataframe(CITY_MERCHANTS_QUERY, {"city_id": city_id})
+    totals = get_transaction_store().merchant_totals(city_merchants["merchant_id"].tolist())
+    delivery_avg_mins = None
+    if "delivery_count" in totals.columns and totals["delivery_count"].sum() > 0:
+        delivery_avg_mins = float(totals["delivery_mins_sum"].sum() / totals["delivery_count"].sum())
+    return {
+        "merchants": len(totals),
+        "revenue_avg": _none_if_nan(totals["revenue"].mean()),
+        "revenue_p75": _none_if_nan(totals["revenue"].quantile(0.75)),
+        "orders_avg": _none_if_nan(totals["orders"].mean()),
+        "orders_p75": _none_if_nan(totals["orders"].quantile(0.75)),
+        "delivery_avg_mins": delivery_avg_mins,
+    }
+
+
+def platform_revenue_stats(engine: str = None) -> dict:
+    """
+    Get platform-wide merchant count, order count, revenue and average order value.
+
+    Returns:
+        dict: merchants, orders, revenue, avg_order_value
+    """
+    row = run_query("platform_revenue_stats", PLATFORM_REVENUE_STATS_QUERY, engine=engine).iloc[0]
+    return {
+        "merchants": int(row["merchants"]),
+        "orders": int(row["orders"]),
+        "revenue": _none_if_nan(row["revenue"]) or 0.0,
+        "avg_order_value": _none_if_nan(row["avg_order_value"]),
+    }
+
+
+def category_counts(merchant_id: str, engine: str = None) -> pd.DataFrame:
+    """
+    Count a merchant's sold transaction items per cuisine tag.
+
+    Returns:
+        pd.DataFrame: cuisine_tag, count - most sold first
+    """
+    return run_query("category_counts", CATEGORY_COUNTS_QUERY, {"merchant_id": merchant_id}, engine)
+
+
+def item_pair_counts(merchant_id: str, limit: int = 3, engine: str = None) -> pd.DataFrame:
+    """
+    Count how many orders contain each pair of the merchant's items.
+
+    Returns:
+        pd.DataFrame: item1, item2 (item1 < item2), count - most frequent first
+    """
+    return run_query("item_pairs", ITEM_PAIRS_QUERY, {"merchant_id": merchant_id, "limit": limit}, engine)
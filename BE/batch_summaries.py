@@ -0,0 +1,179 @@
+"""
+Generate the profile and summary of every merchant in one batch.
+
+The merchant-level figures (order totals, customer loyalty, peak hours) are
+computed for all merchants at once from a few grouped queries. The
+remaining per-merchant work (menu, item sales, pairs, rendering) is spread
+over a process pool. Profiles are stored in merchant_profiles, and the
+rendered summaries can be written to a JSON-lines file.
+
+Usage:
+    python batch_summaries.py [--workers 8] [--output summaries.jsonl]
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+from database import engine, read_engine, query_to_dataframe
+from city_benchmarks import rebuild_city_benchmarks
+from customer_analytics import customer_loyalty_all
+from merchant_profiles import (
+    compute_merchant_profile, current_profile_version, save_merchant_profiles
+)
+from rag import render_merchant_summary
+
+BATCH_MERCHANTS_QUERY = """
+SELECT merchant_id, merchant_name, join_date, city_id FROM merchants
+"""
+
+# The last 7 days end on each merchant's latest sales day, as in load_profile_base
+BATCH_ORDER_STATS_QUERY = """
+WITH latest AS (
+    SELECT merchant_id, date(MAX(order_time)) AS latest_date
+    FROM transactions
+    GROUP BY merchant_id
+)
+SELECT
+    t.merchant_id,
+    l.latest_date,
+    COUNT(*) AS tx_count,
+    SUM(t.order_value) AS total_revenue,
+    MIN(t.order_time) AS first_order_time,
+    SUM(CASE WHEN t.order_time >= date(l.latest_date, '-6 days') THEN t.order_value ELSE 0 END) AS weekly_revenue,
+    AVG((julianday(t.delivery_time) - julianday(t.order_time)) * 1440) AS avg_delivery_mins
+FROM transactions t
+JOIN latest l ON l.merchant_id = t.merchant_id
+GROUP BY t.merchant_id
+"""
+
+BATCH_PEAK_HOURS_QUERY = """
+SELECT merchant_id, CAST(strftime('%H', order_time) AS INTEGER) AS hour, COUNT(*) AS orders
+FROM transactions
+WHERE order_time IS NOT NULL
+GROUP BY merchant_id, hour
+"""
+
+
+def load_profile_bases() -> dict:
+    """
+    Compute the load_profile_base figures of every merchant with transactions
+    in one grouped pass.
+
+    Returns:
+        dict: {merchant_id: base}
+    """
+    merchants = query_to_dataframe(BATCH_MERCHANTS_QUERY).set_index("merchant_id")
+    order_stats = query_to_dataframe(BATCH_ORDER_STATS_QUERY).set_index("merchant_id")
+    loyalty = customer_loyalty_all()
+    peak = query_to_dataframe(BATCH_PEAK_HOURS_QUERY)
+
+    # Two busiest hours per merchant, ties broken by hour like the single-merchant query
+    peak = peak.sort_values(["merchant_id", "orders", "hour"], ascending=[True, False, True])
+    peak_hours = peak.groupby("merchant_id").head(2).groupby("merchant_id")["hour"].agg(list)
+
+    bases = {}
+    for merchant_id, stats in order_stats.iterrows():
+        if merchant_id not in merchants.index:
+            continue
+        merchant = merchants.loc[merchant_id]
+        base = {
+            "merchant_name": merchant["merchant_name"],
+            "join_date": merchant["join_date"],
+            "city_id": merchant["city_id"],
+            **stats.to_dict(),
+        }
+        base["customers"] = loyalty.get(merchant_id, {
+            "returning_customers": 0, "total_customers": 0, "retention_rate": 0,
+            "most_loyal_orders": None, "inactive_returning": 0,
+        })
+        base["peak_hours"] = peak_hours.get(merchant_id, [])
+        bases[merchant_id] = base
+    return bases
+
+
+def _init_worker():
+    # Connections inherited from the parent process must not be reused here
+    engine.dispose(close=False)
+    read_engine.dispose(close=False)
+
+
+def _build_summary(task):
+    """Compute and render one merchant's profile (runs in a worker process)"""
+    merchant_id, base = task
+    try:
+        profile = compute_merchant_profile(merchant_id, base)
+        summary = render_merchant_summary(merchant_id, profile) if profile else None
+        return merchant_id, profile, summary, None
+    except Exception as e:
+        return merchant_id, None, None, str(e)
+
+
+def generate_all_summaries(workers: int = None, output: str = None, chunksize: int = 4,
+                           save_every: int = 200) -> dict:
+    """
+    Compute, store and render the profile of every merchant with transactions.
+
+    Args:
+        workers: Worker processes, defaults to the number of CPUs
+        output: Optional JSON-lines file receiving {merchant_id, summary}
+        chunksize: Merchants handed to a worker at a time
+        save_every: Profiles stored per database transaction
+
+    Returns:
+        dict: merchants, failed, seconds and merchants_per_sec
+    """
+    started = time.perf_counter()
+    version = current_profile_version()
+
+    # City benchmarks and the transaction store are loaded before the pool
+    # starts, so forked workers share them instead of loading their own
+    rebuild_city_benchmarks()
+    bases = load_profile_bases()
+    base_seconds = time.perf_counter() - started
+    print(f"Grouped pass over {len(bases)} merchants in {base_seconds:.2f}s")
+
+    failed = 0
+    pending = {}
+    out = open(output, "w") if output else None
+    try:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker) as pool:
+            results = pool.map(_build_summary, bases.items(), chunksize=chunksize)
+            for merchant_id, profile, summary, error in tqdm(results, total=len(bases), unit="merchant"):
+                if error:
+                    failed += 1
+                    print(f"Error building summary of {merchant_id}: {error}")
+                    continue
+                if profile is None:
+                    continue
+                pending[merchant_id] = profile
+                if len(pending) >= save_every:
+                    save_merchant_profiles(pending, version)
+                    pending = {}
+                if out:
+                    out.write(json.dumps({"merchant_id": merchant_id, "summary": summary}) + "\n")
+        save_merchant_profiles(pending, version)
+    finally:
+        if out:
+            out.close()
+
+    seconds = time.perf_counter() - started
+    stats = {
+        "merchants": len(bases),
+        "failed": failed,
+        "seconds": round(seconds, 3),
+        "merchants_per_sec": round(len(bases) / seconds, 1) if seconds > 0 else 0
+    }
+    print(f"{stats['merchants']} merchant summaries in {seconds:.2f}s "
+          f"({stats['merchants_per_sec']} merchants/sec, {failed} failed)")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--output", default=None, help="JSON-lines file for the rendered summaries")
+    parser.add_argument("--chunksize", type=int, default=4, help="Merchants per worker task")
+    args = parser.parse_args()
+    generate_all_summaries(args.workers, args.output, args.chunksize)
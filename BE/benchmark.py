@@ -0,0 +1,99 @@
+"""
+Benchmark the SQL -> DataFrame result path.
+
+Builds a synthetic transactions table in a temporary SQLite file and compares
+the old query_to_dataframe (SQLAlchemy rows -> fetchall -> DataFrame) with the
+batched, typed path in database.py. Reports wall time and peak Python memory
+(tracemalloc) for each.
+
+Usage:
+    python benchmark.py --rows 5000000
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+import database
+
+BENCH_QUERY = "SELECT order_id, merchant_id, eater_id, order_time, order_value FROM transactions"
+
+
+def build_table(path: str, rows: int, batch: int = 500_000):
+    """Fill a transactions table with rows synthetic orders"""
+    rng = np.random.default_rng(0)
+    start = pd.Timestamp("2023-01-01").value
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE transactions (order_id TEXT, merchant_id TEXT, eater_id TEXT, "
+        "order_time DATETIME, order_value FLOAT)"
+    )
+    for offset in range(0, rows, batch):
+        n = min(batch, rows - offset)
+        times = pd.to_datetime(start + rng.integers(0, 365 * 86_400, n) * 1_000_000_000)
+        df = pd.DataFrame({
+            "order_id": [f"o{i}" for i in range(offset, offset + n)],
+            "merchant_id": [f"m{i:04d}" for i in rng.integers(0, 1000, n)],
+            "eater_id": [f"e{i}" for i in rng.integers(0, 200_000, n)],
+            "order_time": times.strftime("%Y-%m-%d %H:%M:%S.%f"),
+            "order_value": rng.uniform(2, 60, n).round(2),
+        })
+        conn.executemany("INSERT INTO transactions VALUES (?, ?, ?, ?, ?)", df.itertuples(index=False))
+        conn.commit()
+    conn.close()
+
+
+def legacy_query_to_dataframe(engine, query):
+    """The previous implementation: SQLAlchemy Row objects materialized with fetchall()"""
+    with engine.connect() as conn:
+        result = conn.execute(text(query))
+        columns = result.keys()
+        data = result.fetchall()
+    df = pd.DataFrame(data, columns=columns)
+    df["order_time"] = pd.to_datetime(df["order_time"])
+    return df
+
+
+def measure(label: str, fn):
+    """Run fn once and print its wall time and peak traced memory"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    df = fn()
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<10} {seconds:8.2f}s  peak {peak / 2**20:8.1f} MiB  rows {len(df):,}")
+    return seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=5_000_000, help="Rows in the synthetic table")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        print(f"Building {args.rows:,} synthetic transactions...")
+        build_table(path, args.rows)
+
+        url = f"sqlite:///{path}"
+        legacy_engine = create_engine(url)
+        database.DATABASE_URL = url
+        database.read_engine = database.create_sqlite_engine(url, read_only=True)
+
+        old = measure("legacy", lambda: legacy_query_to_dataframe(legacy_engine, BENCH_QUERY))
+        new = measure("batched", lambda: database.query_to_dataframe(
+            BENCH_QUERY, dtypes={"order_value": "float64"}, parse_dates=["order_time"]
+        ))
+        print(f"speedup {old[0] / new[0]:.2f}x, peak memory {new[1] / old[1]:.0%} of legacy")
+
+        legacy_engine.dispose()
+        database.read_engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
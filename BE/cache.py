@@ -0,0 +1,144 @@
+"""
+Query-result cache keyed by (function, arguments, data version).
+
+Every cached function declares the data scopes it reads (see
+database.DATA_SCOPES). The current version of those scopes is part of the
+cache key, so after an ingest bumps a scope the old entries simply stop
+matching and age out of the LRU. Entries are also bounded by size and TTL.
+"""
+import os
+import time
+import inspect
+import threading
+import functools
+from collections import OrderedDict
+from database import get_data_version
+
+DEFAULT_TTL = float(os.getenv("CACHE_TTL_SECONDS", 3600))
+
+_MISSING = object()
+
+# Every cache created through this module, by name, for the stats endpoint
+_caches = {}
+
+
+class VersionedCache:
+    """Thread-safe LRU cache with an optional per-entry TTL and hit/miss counters"""
+
+    def __init__(self, name: str, maxsize: int = 256, ttl: float = DEFAULT_TTL):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        _caches[name] = self
+
+    def get(self, key):
+        """Return the cached value for key, or _MISSING"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return _MISSING
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return _MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+def _is_cacheable(result) -> bool:
+    """Error and "still loading" responses are recomputed on the next call"""
+    return not (isinstance(result, dict) and result.get("status") in ("error", "loading"))
+
+
+def cached(scopes, maxsize: int = 256, ttl: float = DEFAULT_TTL, name: str = None):
+    """
+    Cache a function's results until the data scopes it reads change.
+
+    Args:
+        scopes: Data scopes the function reads, e.g. ("transactions", "catalog")
+        maxsize: Maximum number of cached results
+        ttl: Seconds an entry stays valid, None for no expiry
+        name: Cache name in the stats, defaults to the function's module.name
+
+    Coroutine functions are cached the same way, storing the awaited result.
+    The wrapped function gets a cache attribute holding its VersionedCache.
+    """
+    scopes = tuple(scopes)
+
+    def decorator(func):
+        cache = VersionedCache(name or f"{func.__module__}.{func.__name__}", maxsize, ttl)
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                key = (args, tuple(sorted(kwargs.items())), get_data_version(*scopes))
+                value = cache.get(key)
+                if value is not _MISSING:
+                    return value
+                value = await func(*args, **kwargs)
+                if _is_cacheable(value):
+                    cache.set(key, value)
+                return value
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                key = (args, tuple(sorted(kwargs.items())), get_data_version(*scopes))
+                value = cache.get(key)
+                if value is not _MISSING:
+                    return value
+                value = func(*args, **kwargs)
+                if _is_cacheable(value):
+                    cache.set(key, value)
+                return value
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
+
+
+def get_cache_stats() -> dict:
+    """Stats of every cache, by name"""
+    return {name: cache.stats() for name, cache in _caches.items()}
+
+
+def clear_caches():
+    for cache in _caches.values():
+        cache.clear()
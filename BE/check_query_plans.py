@@ -0,0 +1,79 @@
+"""
+Check that the hot analytics queries are served by an index.
+
+Runs EXPLAIN QUERY PLAN for every query used by top_items.py, sales.py (via
+rollups.py), analytics_engine.py and item_funnel.py and fails if SQLite has to scan a whole table.
+
+Usage:
+    python check_query_plans.py
+"""
+import sys
+from sqlalchemy import text
+from database import engine, migrate_schema
+from analytics_engine import CATEGORY_COUNTS_QUERY, ITEM_PAIRS_QUERY
+from item_funnel import LOW_CONVERSION_ITEMS_QUERY
+from rollups import DAILY_SALES_QUERY, HOURLY_SALES_QUERY
+from top_items import MERCHANT_ITEMS_QUERY
+
+SAMPLE_PARAMS = {
+    "merchant_id": "m0000",
+    "start_date": "2024-01-01",
+    "end_date": "2024-01-31",
+    "limit": 3,
+    "threshold": 0.1,
+}
+
+QUERIES = {
+    "top_items.merchant_items": MERCHANT_ITEMS_QUERY,
+    "sales.daily_sales": DAILY_SALES_QUERY,
+    "sales.hourly_sales": HOURLY_SALES_QUERY,
+    "analytics.category_counts": CATEGORY_COUNTS_QUERY,
+    "analytics.item_pairs": ITEM_PAIRS_QUERY,
+    "item_funnel.low_conversion": LOW_CONVERSION_ITEMS_QUERY,
+}
+
+# Scans that are expected because they read an already merchant-scoped
+# intermediate result rather than a base table
+ALLOWED_SCANS = {
+    "analytics.item_pairs": {"SCAN a"},  # the materialized order_items CTE
+}
+
+
+def explain(query: str, params: dict = None) -> list:
+    """Return the detail column of EXPLAIN QUERY PLAN for a query"""
+    with engine.connect() as conn:
+        rows = conn.execute(text("EXPLAIN QUERY PLAN " + query), params or SAMPLE_PARAMS).fetchall()
+    return [row[-1] for row in rows]
+
+
+def full_table_scans(plan: list) -> list:
+    """
+    Pick the plan steps that read a whole table.
+
+    "SEARCH t USING INDEX ..." is an index lookup. "SCAN t" without an index
+    (or a covering-index scan that is not limited by any key) means every row
+    is visited.
+    """
+    return [
+        step for step in plan
+        if step.startswith("SCAN ") and "CONSTANT ROW" not in step
+    ]
+
+
+def check_query_plans() -> bool:
+    """Print the plan of every query and return False if any of them scans a table"""
+    migrate_schema()
+    ok = True
+    for name, query in QUERIES.items():
+        plan = explain(query)
+        scans = [step for step in full_table_scans(plan) if step not in ALLOWED_SCANS.get(name, ())]
+        status = "OK" if not scans else "FULL SCAN"
+        print(f"[{status}] {name}")
+        for step in plan:
+            print(f"    {step}")
+        ok = ok and not scans
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if check_query_plans() else 1)
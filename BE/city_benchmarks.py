@@ -0,0 +1,173 @@
+"""
+Per-city benchmark statistics.
+
+The city_benchmarks table holds, for every city, the distribution of
+per-merchant revenue and order counts as a 101-point quantile grid, the
+average order value, delivery time and mean join date. All cities are
+computed in one pass whenever the data version changes, so a merchant
+comparison is a single row lookup plus a percentile rank on the grid.
+
+Distinct customers and order value quantiles come from the sketches in
+stat_sketches, which the ingest paths keep per merchant, city and platform.
+"""
+import json
+import threading
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from sqlalchemy import text
+from database import engine, query_to_dataframe, get_data_version, fill_if_empty, rebuild_stat_sketches
+from cache import cached
+from sketches import HyperLogLog, TDigest
+from transaction_store import get_transaction_store
+
+# Data the benchmarks are computed from
+BENCHMARK_SCOPES = ("transactions", "merchants")
+
+QUANTILE_GRID = np.linspace(0, 1, 101)
+
+CITY_MERCHANTS_QUERY = """
+SELECT merchant_id, city_id, join_date FROM merchants
+"""
+
+CITY_BENCHMARK_QUERY = """
+SELECT * FROM city_benchmarks WHERE city_id = :city_id
+"""
+
+SKETCH_QUERY = """
+SELECT eaters, order_values FROM stat_sketches WHERE scope = :scope AND key = :key
+"""
+
+_rebuild_lock = threading.Lock()
+
+
+def _current_version() -> str:
+    return json.dumps(list(get_data_version(*BENCHMARK_SCOPES)))
+
+
+def rebuild_city_benchmarks() -> int:
+    """
+    Recompute the benchmark row of every city.
+
+    Returns:
+        int: Number of cities written
+    """
+    version = _current_version()
+    merchants = query_to_dataframe(CITY_MERCHANTS_QUERY)
+    merchants["city_id"] = merchants["city_id"].astype(str)
+    merchants["join_date"] = pd.to_datetime(merchants["join_date"], format="%d%m%Y", errors="coerce")
+
+    totals = get_transaction_store().merchant_totals(merchants["merchant_id"].tolist())
+    totals = totals.merge(merchants[["merchant_id", "city_id"]], on="merchant_id")
+
+    rows = []
+    now = datetime.now()
+    for city_id, city_merchants in merchants.groupby("city_id"):
+        city_totals = totals[totals["city_id"] == city_id]
+        has_totals = not city_totals.empty
+        delivery_avg_mins = None
+        if "delivery_count" in city_totals.columns and city_totals["delivery_count"].sum() > 0:
+            delivery_avg_mins = float(city_totals["delivery_mins_sum"].sum() / city_totals["delivery_count"].sum())
+        join_date_mean = city_merchants["join_date"].mean()
+        rows.append({
+            "city_id": city_id,
+            "data_version": version,
+            "merchants": len(city_totals),
+            "revenue_avg": float(city_totals["revenue"].mean()) if has_totals else None,
+            "revenue_quantiles": json.dumps(city_totals["revenue"].quantile(QUANTILE_GRID).tolist() if has_totals else []),
+            "orders_avg": float(city_totals["orders"].mean()) if has_totals else None,
+            "orders_quantiles": json.dumps(city_totals["orders"].quantile(QUANTILE_GRID).tolist() if has_totals else []),
+            "avg_order_value": float(city_totals["revenue"].sum() / city_totals["orders"].sum()) if has_totals else None,
+            "delivery_avg_mins": delivery_avg_mins,
+            "join_date_mean": None if pd.isna(join_date_mean) else join_date_mean.to_pydatetime(),
+            "computed_at": now,
+        })
+
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM city_benchmarks"))
+        if rows:
+            conn.execute(text("""
+                INSERT INTO city_benchmarks (
+                    city_id, data_version, merchants, revenue_avg, revenue_quantiles, orders_avg,
+                    orders_quantiles, avg_order_value, delivery_avg_mins, join_date_mean, computed_at
+                ) VALUES (
+                    :city_id, :data_version, :merchants, :revenue_avg, :revenue_quantiles, :orders_avg,
+                    :orders_quantiles, :avg_order_value, :delivery_avg_mins, :join_date_mean, :computed_at
+                )
+            """), rows)
+    print(f"City benchmarks rebuilt for {len(rows)} cities")
+    return len(rows)
+
+
+def get_city_benchmark(city_id):
+    """
+    Get the benchmark statistics of a city, rebuilding all cities first when
+    the stored rows are older than the current data.
+
+    Returns:
+        dict: Benchmark row with the quantile grids decoded and the average
+        business age in years, or None for an unknown city
+    """
+    params = {"city_id": str(city_id)}
+    version = _current_version()
+    row = query_to_dataframe(CITY_BENCHMARK_QUERY, params)
+    if row.empty or row["data_version"].iloc[0] != version:
+        with _rebuild_lock:
+            row = query_to_dataframe(CITY_BENCHMARK_QUERY, params)
+            if row.empty or row["data_version"].iloc[0] != version:
+                rebuild_city_benchmarks()
+                row = query_to_dataframe(CITY_BENCHMARK_QUERY, params)
+    if row.empty:
+        return None
+
+    benchmark = row.iloc[0].to_dict()
+    benchmark["revenue_quantiles"] = json.loads(benchmark["revenue_quantiles"])
+    benchmark["orders_quantiles"] = json.loads(benchmark["orders_quantiles"])
+    benchmark["business_age_avg"] = None
+    if benchmark["join_date_mean"] is not None:
+        join_date_mean = pd.to_datetime(benchmark["join_date_mean"])
+        benchmark["business_age_avg"] = (datetime.now() - join_date_mean).days / 365
+    return benchmark
+
+
+def quantile(grid: list, q: float):
+    """Read quantile q (0-1) from a 101-point quantile grid"""
+    if not grid:
+        return float("nan")
+    return grid[int(round(q * 100))]
+
+
+def percentile_rank(grid: list, value: float) -> float:
+    """
+    Estimate the percentage of the city's merchants below value by
+    interpolating on the quantile grid.
+    """
+    if not grid or value is None or pd.isna(value):
+        return float("nan")
+    return float(np.interp(value, grid, QUANTILE_GRID * 100))
+
+
+@cached(BENCHMARK_SCOPES)
+def sketch_stats(scope: str, key: str = "all"):
+    """
+    Approximate customer and order value statistics from the stored sketches.
+    
+    Args:
+        scope: "merchant", "city" or "platform"
+        key: merchant_id, city_id, or "all" for the platform
+    
+    Returns:
+        dict: distinct_eaters, orders and order_value_quantiles (101-point
+        grid), or None when nothing was sketched for the key
+    """
+    fill_if_empty("stat_sketches", "transactions", rebuild_stat_sketches)
+    row = query_to_dataframe(SKETCH_QUERY, {"scope": scope, "key": str(key)})
+    if row.empty:
+        return None
+    eaters = HyperLogLog.from_bytes(row["eaters"].iloc[0])
+    order_values = TDigest.from_bytes(row["order_values"].iloc[0])
+    return {
+        "distinct_eaters": eaters.count(),
+        "orders": int(order_values.count),
+        "order_value_quantiles": [order_values.quantile(q) for q in QUANTILE_GRID] if order_values.count else [],
+    }
@@ -0,0 +1,164 @@
+"""
+Customer analytics over the merchant_customers table.
+
+merchant_customers holds one row per (merchant, eater) with the eater's
+order count (frequency), total spent (monetary) and first and last order
+time (recency). The ingest paths keep it up to date, so retention, lapsed
+loyal customers and segment sizes are single aggregate queries on a
+merchant's customer rows instead of a pass over its transactions.
+"""
+import pandas as pd
+from datetime import datetime, timedelta
+from database import query_to_dataframe, fill_if_empty, rebuild_merchant_customers
+
+# A returning customer whose last order is more than this many days old is lapsed
+INACTIVE_DAYS = 30
+
+# Active customers with at least this many orders are champions
+CHAMPION_ORDERS = 5
+
+SEGMENTS = ("champions", "loyal", "new", "lapsed_loyal", "lapsed_one_time")
+
+CUSTOMER_LOYALTY_QUERY = """
+SELECT
+    {group_column}
+    COUNT(*) AS total_customers,
+    SUM(CASE WHEN orders > 1 THEN 1 ELSE 0 END) AS returning_customers,
+    MAX(orders) AS most_loyal_orders,
+    SUM(CASE WHEN orders > 1 AND last_order_time <= :inactive_before THEN 1 ELSE 0 END) AS inactive_returning
+FROM merchant_customers
+{where}
+"""
+
+LAPSED_LOYAL_QUERY = """
+SELECT eater_id, orders, monetary, first_order_time, last_order_time
+FROM merchant_customers
+WHERE merchant_id = :merchant_id AND orders > 1 AND last_order_time <= :inactive_before
+ORDER BY orders DESC, monetary DESC, eater_id
+LIMIT :limit
+"""
+
+SEGMENT_SIZES_QUERY = """
+SELECT
+    CASE
+        WHEN last_order_time > :inactive_before AND orders >= :champion_orders THEN 'champions'
+        WHEN last_order_time > :inactive_before AND orders > 1 THEN 'loyal'
+        WHEN last_order_time > :inactive_before THEN 'new'
+        WHEN orders > 1 THEN 'lapsed_loyal'
+        ELSE 'lapsed_one_time'
+    END AS segment,
+    COUNT(*) AS customers,
+    SUM(monetary) AS revenue
+FROM merchant_customers
+WHERE merchant_id = :merchant_id
+GROUP BY segment
+"""
+
+
+def ensure_merchant_customers():
+    fill_if_empty("merchant_customers", "transactions", rebuild_merchant_customers)
+
+
+def _inactive_before(inactive_days: int, now: datetime = None) -> str:
+    # (now - last_order).days > inactive_days means at least inactive_days + 1 full days
+    cutoff = (now or datetime.now()) - timedelta(days=inactive_days + 1)
+    return cutoff.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def _count(value) -> int:
+    # SUM over no rows is NULL
+    return int(value) if pd.notna(value) else 0
+
+
+def _loyalty_dict(row) -> dict:
+    total = _count(row["total_customers"])
+    returning = _count(row["returning_customers"])
+    return {
+        "returning_customers": returning,
+        "total_customers": total,
+        "retention_rate": round((returning / total) * 100, 1) if total else 0,
+        "most_loyal_orders": int(row["most_loyal_orders"]) if total else None,
+        "inactive_returning": _count(row["inactive_returning"]),
+    }
+
+
+def customer_loyalty(merchant_id: str, inactive_days: int = INACTIVE_DAYS) -> dict:
+    """
+    Customer loyalty figures of a merchant.
+
+    Returns:
+        dict: returning_customers, total_customers, retention_rate (percent),
+        most_loyal_orders and inactive_returning (returning customers whose
+        last order is more than inactive_days old)
+    """
+    ensure_merchant_customers()
+    df = query_to_dataframe(
+        CUSTOMER_LOYALTY_QUERY.format(group_column="", where="WHERE merchant_id = :merchant_id"),
+        {"merchant_id": merchant_id, "inactive_before": _inactive_before(inactive_days)}
+    )
+    return _loyalty_dict(df.iloc[0])
+
+
+def customer_loyalty_all(inactive_days: int = INACTIVE_DAYS) -> dict:
+    """
+    Customer loyalty figures of every merchant in one grouped query.
+
+    Returns:
+        dict: {merchant_id: loyalty dict as returned by customer_loyalty}
+    """
+    ensure_merchant_customers()
+    df = query_to_dataframe(
+        CUSTOMER_LOYALTY_QUERY.format(group_column="merchant_id,", where="GROUP BY merchant_id"),
+        {"inactive_before": _inactive_before(inactive_days)}
+    )
+    return {merchant_id: _loyalty_dict(row) for merchant_id, row in df.set_index("merchant_id").iterrows()}
+
+
+def retention_rate(merchant_id: str) -> float:
+    """Percentage of a merchant's customers with more than one order"""
+    return customer_loyalty(merchant_id)["retention_rate"]
+
+
+def lapsed_loyal_customers(merchant_id: str, inactive_days: int = INACTIVE_DAYS, limit: int = 100) -> pd.DataFrame:
+    """
+    Returning customers of a merchant who have not ordered for more than
+    inactive_days, most frequent first.
+
+    Returns:
+        pd.DataFrame: eater_id, orders, monetary, first_order_time, last_order_time
+    """
+    ensure_merchant_customers()
+    return query_to_dataframe(LAPSED_LOYAL_QUERY, {
+        "merchant_id": merchant_id,
+        "inactive_before": _inactive_before(inactive_days),
+        "limit": limit,
+    }, parse_dates=["first_order_time", "last_order_time"])
+
+
+def segment_sizes(merchant_id: str, inactive_days: int = INACTIVE_DAYS) -> dict:
+    """
+    Split a merchant's customers into recency/frequency segments.
+
+    Active customers (last order within inactive_days) are champions
+    (CHAMPION_ORDERS or more orders), loyal (2 or more) or new (1). Inactive
+    ones are lapsed_loyal (2 or more orders) or lapsed_one_time.
+
+    Returns:
+        dict: {segment: {"customers": int, "revenue": float}} for every segment
+    """
+    ensure_merchant_customers()
+    df = query_to_dataframe(SEGMENT_SIZES_QUERY, {
+        "merchant_id": merchant_id,
+        "inactive_before": _inactive_before(inactive_days),
+        "champion_orders": CHAMPION_ORDERS,
+    }).set_index("segment")
+    sizes = {}
+    for segment in SEGMENTS:
+        if segment in df.index:
+            sizes[segment] = {
+                "customers": int(df.loc[segment, "customers"]),
+                "revenue": float(df.loc[segment, "revenue"]) if pd.notna(df.loc[segment, "revenue"]) else 0.0,
+            }
+        else:
+            sizes[segment] = {"customers": 0, "revenue": 0.0}
+    return sizes
@@ -1,8 +1,21 @@
+import io
 import os
+import re
+import csv
+import contextlib
+import time
+import hashlib
+import itertools
+import threading
 import pandas as pd
-from sqlalchemy import Date, create_engine, text, Column, Integer, String, Float, DateTime, ForeignKey
+from datetime import datetime, timedelta
+from sqlalchemy import Date, create_engine, event, text, inspect, Column, Integer, String, Float, DateTime, ForeignKey, Index, LargeBinary
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.declarative import declarative_base
+from sketches import HyperLogLog, TDigest
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import QueuePool
 from dotenv import load_dotenv
 
 
@@ -12,58 +25,180 @@ load_dotenv()
 # Create SQLite database in project directory
 DATABASE_URL = "sqlite:///./data/grablet.db"
 
-# Create SQLAlchemy engine
-engine = create_engine(DATABASE_URL)
+# SQLite tuning, overridable from .env
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))  # bytes
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", 64 * 1024))  # per connection
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", 8))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+
+class _TimedQueuePool(QueuePool):
+    """QueuePool that records how long callers wait for a connection"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            "checkouts": 0,
+            "wait_ms_total": 0.0,
+            "wait_ms_max": 0.0,
+            "timeouts": 0,
+            "busy_errors": 0,
+        }
+    
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self.stats_lock:
+                self.stats["timeouts"] += 1
+            raise
+        finally:
+            waited = (time.perf_counter() - started) * 1000
+            with self.stats_lock:
+                self.stats["checkouts"] += 1
+                self.stats["wait_ms_total"] += waited
+                self.stats["wait_ms_max"] = max(self.stats["wait_ms_max"], waited)
+
+def create_sqlite_engine(url: str = DATABASE_URL, pool_size: int = 1, read_only: bool = False):
+    """
+    Create a tuned SQLite engine.
+    
+    Every connection runs in WAL mode (readers never block the writer and vice
+    versa) with a memory-mapped file and a larger page cache. Read-only engines
+    additionally set query_only so a stray write fails fast instead of taking
+    the write lock.
+    
+    Args:
+        url: SQLite database URL
+        pool_size: Number of pooled connections (no overflow)
+        read_only: Open connections with PRAGMA query_only
+    """
+    new_engine = create_engine(
+        url,
+        poolclass=_TimedQueuePool,
+        pool_size=pool_size,
+        max_overflow=0,
+        pool_timeout=DB_POOL_TIMEOUT,
+        connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+    )
+    
+    @event.listens_for(new_engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+    
+    @event.listens_for(new_engine, "handle_error")
+    def _count_busy(context):
+        if "database is locked" in str(context.original_exception):
+            with new_engine.pool.stats_lock:
+                new_engine.pool.stats["busy_errors"] += 1
+    
+    return new_engine
+
+def get_pool_stats() -> dict:
+    """Connection pool and busy-wait statistics of the read and write engines"""
+    stats = {}
+    for name, pool_engine in (("read", read_engine), ("write", engine)):
+        pool = pool_engine.pool
+        with pool.stats_lock:
+            pool_stats = dict(pool.stats)
+        pool_stats["wait_ms_avg"] = (
+            pool_stats["wait_ms_total"] / pool_stats["checkouts"] if pool_stats["checkouts"] else 0.0
+        )
+        pool_stats.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "status": pool.status()
+        })
+        stats[name] = pool_stats
+    return stats
+
+# Single serialized writer for sessions, imports and rollup maintenance
+engine = create_sqlite_engine(DATABASE_URL, pool_size=1)
+
+# Pool of read-only connections for the analytics queries
+read_engine = create_sqlite_engine(DATABASE_URL, pool_size=DB_READ_POOL_SIZE, read_only=True)
 
 # Create base class for models
 Base = declarative_base()
 
 # Define database models
+# Columns mirror the CSV exports in data/. The composite indexes match the
+# WHERE/JOIN shapes of the analytics queries (see check_query_plans.py).
 class Merchant(Base):
     __tablename__ = "merchants"
+    __table_args__ = (
+        Index("ix_merchants_city_id", "city_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     merchant_id = Column(String, unique=True, index=True)
-    name = Column(String)
-    city = Column(String)
-    category = Column(String)
+    merchant_name = Column(String)
+    join_date = Column(String)  # DDMMYYYY as exported
+    city_id = Column(String)
     
 class Transaction(Base):
     __tablename__ = "transactions"
+    __table_args__ = (
+        Index("ix_transactions_merchant_time", "merchant_id", "order_time"),
+        Index("ix_transactions_merchant_eater", "merchant_id", "eater_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     order_id = Column(String, unique=True, index=True)
-    merchant_id = Column(String, index=True)
+    merchant_id = Column(String)
     eater_id = Column(String, index=True)
     order_time = Column(DateTime)
+    driver_arrival_time = Column(DateTime)
+    driver_pickup_time = Column(DateTime)
+    delivery_time = Column(DateTime)
     order_value = Column(Float)
     
 class TransactionItem(Base):
     __tablename__ = "transaction_items"
+    __table_args__ = (
+        Index("ix_transaction_items_order_item", "order_id", "item_id"),
+        Index("ix_transaction_items_merchant_item", "merchant_id", "item_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(String, index=True)
-    item_id = Column(String, index=True)
+    order_id = Column(String)
+    item_id = Column(String)
+    merchant_id = Column(String)
     quantity = Column(Integer)
     price = Column(Float)
     
 class Item(Base):
     __tablename__ = "items"
+    __table_args__ = (
+        Index("ix_items_merchant_item", "merchant_id", "item_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     item_id = Column(String, unique=True, index=True)
-    merchant_id = Column(String, index=True)
-    name = Column(String)
-    price = Column(Float)
-    category = Column(String)
+    merchant_id = Column(String)
+    item_name = Column(String)
+    item_price = Column(Float)
+    cuisine_tag = Column(String)
 
 class Keyword(Base):
     __tablename__ = "keywords"
     
     id = Column(Integer, primary_key=True, index=True)
-    merchant_id = Column(String, index=True)
-    keyword = Column(String)
-    count = Column(Integer)
+    keyword = Column(String, index=True)
+    view = Column(String, index=True)
+    menu = Column(Integer)
+    checkout = Column(Integer)
+    order = Column(Integer)
     
 class Ingredient(Base):
     __tablename__ = "ingredients"
@@ -83,6 +218,130 @@ class IngredientUsage(Base):
     date = Column(Date)
     usage = Column(Integer)
 
+class MerchantDailySales(Base):
+    __tablename__ = "merchant_daily_sales"
+    
+    merchant_id = Column(String, primary_key=True)
+    date = Column(String, primary_key=True)  # YYYY-MM-DD
+    revenue = Column(Float)
+    orders = Column(Integer)
+
+class MerchantHourlySales(Base):
+    __tablename__ = "merchant_hourly_sales"
+    
+    merchant_id = Column(String, primary_key=True)
+    date = Column(String, primary_key=True)  # YYYY-MM-DD
+    hour = Column(Integer, primary_key=True)
+    revenue = Column(Float)
+    orders = Column(Integer)
+
+class IngestWatermark(Base):
+    __tablename__ = "ingest_watermarks"
+    
+    table_name = Column(String, primary_key=True)
+    source = Column(String)
+    rows_loaded = Column(Integer)
+    source_size = Column(Integer)
+    byte_offset = Column(Integer)  # End of the last loaded row in the source file
+    source_fingerprint = Column(String)  # Hash of the loaded part, detects a replaced file
+    updated_at = Column(DateTime)
+
+class MerchantCustomer(Base):
+    __tablename__ = "merchant_customers"
+    
+    merchant_id = Column(String, primary_key=True)
+    eater_id = Column(String, primary_key=True)
+    orders = Column(Integer)  # Frequency
+    monetary = Column(Float)  # Total spent
+    first_order_time = Column(DateTime)
+    last_order_time = Column(DateTime)  # Recency
+
+class ItemFunnel(Base):
+    __tablename__ = "item_funnel"
+    
+    merchant_id = Column(String, primary_key=True)  # Merchant whose orders/menu the item is in
+    item_id = Column(String, primary_key=True)
+    views = Column(Integer)  # Keyword searches that led to the item
+    purchases = Column(Integer)  # Times sold in the merchant's orders
+    conversion = Column(Float)  # purchases / views, NULL without views
+
+class KeywordIndex(Base):
+    __tablename__ = "keyword_index"
+    
+    keyword = Column(String, primary_key=True)
+    item_id = Column(String, primary_key=True)
+    merchant_id = Column(String, index=True)  # Owner of the item
+    views = Column(Integer)
+    orders = Column(Integer)
+
+class StatSketch(Base):
+    __tablename__ = "stat_sketches"
+    
+    scope = Column(String, primary_key=True)  # merchant, city or platform
+    key = Column(String, primary_key=True)  # merchant_id, city_id or "all"
+    eaters = Column(LargeBinary)  # HyperLogLog of distinct eater IDs
+    order_values = Column(LargeBinary)  # TDigest of order values
+    updated_at = Column(DateTime)
+
+class MerchantWatermark(Base):
+    __tablename__ = "merchant_watermarks"
+    
+    merchant_id = Column(String, primary_key=True)
+    latest_order_time = Column(DateTime)
+
+class MerchantProfile(Base):
+    __tablename__ = "merchant_profiles"
+    
+    merchant_id = Column(String, primary_key=True)
+    data_version = Column(String)  # Data versions the profile was computed from
+    profile = Column(String)  # JSON, grouped by summary section
+    computed_at = Column(DateTime)
+
+class CityBenchmark(Base):
+    __tablename__ = "city_benchmarks"
+    
+    city_id = Column(String, primary_key=True)
+    data_version = Column(String)  # Data versions the row was computed from
+    merchants = Column(Integer)  # Merchants of the city with transactions
+    revenue_avg = Column(Float)
+    revenue_quantiles = Column(String)  # JSON, 101 values for q = 0.00 ... 1.00
+    orders_avg = Column(Float)
+    orders_quantiles = Column(String)  # JSON, same grid
+    avg_order_value = Column(Float)
+    delivery_avg_mins = Column(Float)
+    join_date_mean = Column(DateTime)  # Business age is derived at read time
+    computed_at = Column(DateTime)
+
+class LLMResponse(Base):
+    __tablename__ = "llm_responses"
+
+    key = Column(String, primary_key=True)  # sha256 of endpoint, model, parameters, prompt and data version
+    endpoint = Column(String, index=True)
+    model = Column(String)
+    data_version = Column(String)  # Data versions the prompt was built from
+    response = Column(String)
+    size = Column(Integer)  # Bytes of the response
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime)
+    expires_at = Column(DateTime, index=True)
+    last_used_at = Column(DateTime, index=True)  # Least recently used entries are evicted first
+
+class PrecomputedResult(Base):
+    __tablename__ = "precomputed_results"
+
+    job = Column(String, primary_key=True)  # e.g. advice, insights:weekly
+    merchant_id = Column(String, primary_key=True)
+    data_version = Column(String)  # Data versions the result was computed from
+    result = Column(String)  # JSON, last good result of the job
+    computed_at = Column(DateTime, index=True)
+
+class DataVersion(Base):
+    __tablename__ = "data_versions"
+    
+    scope = Column(String, primary_key=True)
+    version = Column(Integer, default=0)
+    updated_at = Column(DateTime)
+
 # Create tables
 Base.metadata.create_all(bind=engine)
 
@@ -97,64 +356,1076 @@ def get_db():
     finally:
         db.close()
 
+# Data versions: every write path bumps the scopes it touched so caches
+# keyed on the version never serve results computed from older data
+DATA_SCOPES = ("transactions", "catalog", "keywords", "merchants", "ingredients")
+
+# Which data scope each table belongs to
+TABLE_SCOPES = {
+    "merchants": "merchants",
+    "transactions": "transactions",
+    "transaction_items": "transactions",
+    "items": "catalog",
+    "keywords": "keywords",
+    "ingredients": "ingredients",
+    "ingredient_usage": "ingredients",
+}
+
+def bump_data_version(*scopes):
+    """Increment the version of each given data scope"""
+    if not scopes:
+        return
+    for scope in scopes:
+        if scope not in DATA_SCOPES:
+            raise ValueError(f"Unknown data scope '{scope}'")
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO data_versions (scope, version, updated_at)
+            VALUES (:scope, 1, :updated_at)
+            ON CONFLICT(scope) DO UPDATE SET
+                version = version + 1,
+                updated_at = excluded.updated_at
+        """), [{"scope": scope, "updated_at": datetime.now()} for scope in set(scopes)])
+
+def get_data_version(*scopes) -> tuple:
+    """
+    Get the current version of the given data scopes (all scopes when none given).
+    
+    Returns:
+        tuple: One version number per scope, 0 for scopes never bumped
+    """
+    scopes = scopes or DATA_SCOPES
+    with read_engine.connect() as conn:
+        versions = dict(conn.execute(text("SELECT scope, version FROM data_versions")).fetchall())
+    return tuple(versions.get(scope, 0) for scope in scopes)
+
+# Rows fetched from the cursor per batch. Each batch is turned into typed
+# columns right away, so the Python tuples of only one batch are alive at once.
+QUERY_BATCH_SIZE = int(os.getenv("QUERY_BATCH_SIZE", 100_000))
+
+# Opt-in Arrow result path through the ADBC SQLite driver (pip install adbc-driver-sqlite pyarrow)
+DB_ARROW_RESULTS = os.getenv("DB_ARROW_RESULTS", "0") == "1"
+try:
+    import adbc_driver_sqlite.dbapi as adbc_sqlite
+except ImportError:
+    adbc_sqlite = None
+
+_NAMED_PARAM = re.compile(r"(?<![:\w]):(\w+)")
+
+def _typed_frame(rows, columns, dtypes=None, parse_dates=None) -> pd.DataFrame:
+    """Build a DataFrame from raw cursor tuples and apply the requested column types"""
+    return _apply_types(pd.DataFrame.from_records(rows, columns=columns, coerce_float=True), dtypes, parse_dates)
+
+def _apply_types(df: pd.DataFrame, dtypes=None, parse_dates=None) -> pd.DataFrame:
+    """Parse the parse_dates columns as datetime64 and cast the dtypes columns"""
+    for column in parse_dates or []:
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column], errors="coerce", format="ISO8601")
+    for column, dtype in (dtypes or {}).items():
+        if column in df.columns:
+            df[column] = df[column].astype(dtype)
+    return df
+
+def _arrow_query(query, params=None) -> pd.DataFrame:
+    """Run a query through ADBC and return the Arrow result as a DataFrame"""
+    names = _NAMED_PARAM.findall(query)
+    positional = _NAMED_PARAM.sub("?", query)
+    path = DATABASE_URL.replace("sqlite:///", "", 1)
+    with adbc_sqlite.connect(path) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(positional, [params[name] for name in names] if names else None)
+            return cursor.fetch_arrow_table().to_pandas()
+
+def iter_query_chunks(query, params=None, chunksize=QUERY_BATCH_SIZE, dtypes=None, parse_dates=None):
+    """
+    Execute SQL query on a read-only connection and yield the result in
+    DataFrame chunks of at most chunksize rows.
+    
+    Rows are read straight from the DBAPI cursor (no SQLAlchemy Row objects)
+    and converted to typed columns chunk by chunk.
+    
+    Args:
+        query: SQL with :named parameters
+        params: Parameter values
+        chunksize: Maximum rows per chunk
+        dtypes: Optional {column: dtype} to cast to
+        parse_dates: Optional list of columns to parse as datetime64
+    """
+    with read_engine.connect() as conn:
+        cursor = conn.connection.driver_connection.cursor()
+        try:
+            cursor.execute(query, params or {})
+            columns = [description[0] for description in cursor.description]
+            while True:
+                rows = cursor.fetchmany(chunksize)
+                if not rows:
+                    break
+                yield _typed_frame(rows, columns, dtypes, parse_dates)
+        finally:
+            cursor.close()
+
 # Function to convert query results to dataframe
-def query_to_dataframe(query, params=None):
-    """Execute SQL query and return results as pandas DataFrame"""
-    with engine.connect() as conn:
-        if params:
-            result = conn.execute(text(query), params)
+def query_to_dataframe(query, params=None, dtypes=None, parse_dates=None):
+    """
+    Execute SQL query on a read-only connection and return results as pandas DataFrame.
+    
+    Results are converted batch by batch into typed columns instead of first
+    materializing every row as a Python object. Pass dtypes/parse_dates to get
+    numeric and datetime64 columns directly.
+    """
+    if DB_ARROW_RESULTS and adbc_sqlite is not None:
+        return _apply_types(_arrow_query(query, params), dtypes, parse_dates)
+    
+    with read_engine.connect() as conn:
+        cursor = conn.connection.driver_connection.cursor()
+        try:
+            cursor.execute(query, params or {})
+            columns = [description[0] for description in cursor.description]
+            chunks = []
+            while True:
+                rows = cursor.fetchmany(QUERY_BATCH_SIZE)
+                if not rows:
+                    break
+                chunks.append(_typed_frame(rows, columns, dtypes, parse_dates))
+        finally:
+            cursor.close()
+    
+    if not chunks:
+        return _typed_frame([], columns, dtypes, parse_dates)
+    if len(chunks) == 1:
+        return chunks[0]
+    return pd.concat(chunks, ignore_index=True)
+
+# Rollup maintenance
+DAILY_ROLLUP_SELECT = """
+    SELECT merchant_id, DATE(order_time) AS date, SUM(order_value) AS revenue, COUNT(*) AS orders
+    FROM transactions
+    WHERE order_time IS NOT NULL {where}
+    GROUP BY merchant_id, DATE(order_time)
+"""
+
+HOURLY_ROLLUP_SELECT = """
+    SELECT merchant_id, DATE(order_time) AS date, CAST(strftime('%H', order_time) AS INTEGER) AS hour,
+           SUM(order_value) AS revenue, COUNT(*) AS orders
+    FROM transactions
+    WHERE order_time IS NOT NULL {where}
+    GROUP BY merchant_id, DATE(order_time), strftime('%H', order_time)
+"""
+
+def rebuild_sales_rollups():
+    """Rebuild merchant_daily_sales and merchant_hourly_sales from the transactions table"""
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM merchant_daily_sales"))
+        conn.execute(text("DELETE FROM merchant_hourly_sales"))
+        conn.execute(text("INSERT INTO merchant_daily_sales " + DAILY_ROLLUP_SELECT.format(where="")))
+        conn.execute(text("INSERT INTO merchant_hourly_sales " + HOURLY_ROLLUP_SELECT.format(where="")))
+    print("Sales rollups rebuilt")
+
+def refresh_sales_rollups(merchant_dates):
+    """
+    Recompute the rollup rows for specific (merchant_id, date) pairs.
+    Ingest paths call this with the keys touched by newly written transactions
+    so the rollups stay in step without a full rebuild.
+    
+    Args:
+        merchant_dates: Iterable of (merchant_id, date) pairs, date as date or YYYY-MM-DD string
+    """
+    keys = []
+    for merchant_id, day in set((str(m), str(d)[:10]) for m, d in merchant_dates):
+        next_day = (datetime.strptime(day, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+        keys.append({"merchant_id": merchant_id, "date": day, "next_date": next_day})
+    if not keys:
+        return
+    # Range on order_time rather than DATE(order_time) so an index can be used
+    where = "AND merchant_id = :merchant_id AND order_time >= :date AND order_time < :next_date"
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM merchant_daily_sales WHERE merchant_id = :merchant_id AND date = :date"), keys)
+        conn.execute(text("DELETE FROM merchant_hourly_sales WHERE merchant_id = :merchant_id AND date = :date"), keys)
+        conn.execute(text("INSERT INTO merchant_daily_sales " + DAILY_ROLLUP_SELECT.format(where=where)), keys)
+        conn.execute(text("INSERT INTO merchant_hourly_sales " + HOURLY_ROLLUP_SELECT.format(where=where)), keys)
+
+_filled_tables = set()
+_fill_lock = threading.Lock()
+
+def fill_if_empty(table: str, source_table: str, rebuild):
+    """
+    Run a derived table's rebuild once per process when the table is empty
+    but its source table is not, i.e. for databases imported before the
+    derived table existed. Later imports keep the table up to date themselves.
+    """
+    if table in _filled_tables:
+        return
+    with _fill_lock:
+        if table in _filled_tables:
+            return
+        with read_engine.connect() as conn:
+            empty = conn.execute(text(f'SELECT 1 FROM "{table}" LIMIT 1')).first() is None
+            has_source = conn.execute(text(f'SELECT 1 FROM "{source_table}" LIMIT 1')).first() is not None
+        if empty and has_source:
+            rebuild()
+        _filled_tables.add(table)
+
+# Per-(merchant, eater) recency, frequency and monetary aggregates
+CUSTOMER_ROLLUP_SELECT = """
+    SELECT merchant_id, eater_id, COUNT(*) AS orders, SUM(order_value) AS monetary,
+           MIN(order_time) AS first_order_time, MAX(order_time) AS last_order_time
+    FROM transactions
+    WHERE eater_id IS NOT NULL {where}
+    GROUP BY merchant_id, eater_id
+"""
+
+def rebuild_merchant_customers():
+    """Rebuild merchant_customers from the transactions table"""
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM merchant_customers"))
+        conn.execute(text("INSERT INTO merchant_customers " + CUSTOMER_ROLLUP_SELECT.format(where="")))
+    print("Merchant customers rebuilt")
+
+def refresh_merchant_customers(merchant_eaters):
+    """
+    Recompute the merchant_customers rows of specific (merchant_id, eater_id)
+    pairs, e.g. the pairs touched by newly imported transactions.
+    """
+    keys = [{"merchant_id": str(m), "eater_id": str(e)} for m, e in set(merchant_eaters)]
+    if not keys:
+        return
+    where = "AND merchant_id = :merchant_id AND eater_id = :eater_id"
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM merchant_customers WHERE merchant_id = :merchant_id AND eater_id = :eater_id"), keys)
+        conn.execute(text("INSERT INTO merchant_customers " + CUSTOMER_ROLLUP_SELECT.format(where=where)), keys)
+
+# Views, purchases and conversion of every item in a merchant's orders or menu
+ITEM_FUNNEL_SELECT = """
+    WITH sales AS (
+        SELECT t.merchant_id, ti.item_id, COUNT(*) AS purchases
+        FROM transactions t
+        JOIN transaction_items ti ON ti.order_id = t.order_id
+        WHERE ti.item_id IS NOT NULL {where_orders}
+        GROUP BY t.merchant_id, ti.item_id
+    ),
+    funnel_items AS (
+        SELECT merchant_id, item_id FROM sales
+        UNION
+        SELECT merchant_id, item_id FROM items WHERE item_id IS NOT NULL {where_menu}
+    ),
+    funnel AS (
+        SELECT f.merchant_id, f.item_id,
+               (SELECT COUNT(*) FROM keywords k WHERE k.view = f.item_id) AS views,
+               COALESCE(s.purchases, 0) AS purchases
+        FROM funnel_items f
+        LEFT JOIN sales s ON s.merchant_id = f.merchant_id AND s.item_id = f.item_id
+    )
+    SELECT merchant_id, item_id, views, purchases,
+           CASE WHEN views > 0 THEN CAST(purchases AS FLOAT) / views END AS conversion
+    FROM funnel
+"""
+
+# Keyword -> item inverted index
+KEYWORD_INDEX_SELECT = """
+    SELECT k.keyword, k.view AS item_id, MAX(i.merchant_id) AS merchant_id,
+           COUNT(*) AS views, SUM(k."order") AS orders
+    FROM keywords k
+    LEFT JOIN items i ON i.item_id = k.view
+    WHERE k.keyword IS NOT NULL AND k.view IS NOT NULL {where}
+    GROUP BY k.keyword, k.view
+"""
+
+def rebuild_item_funnel():
+    """Rebuild item_funnel from the transactions, items and keywords tables"""
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM item_funnel"))
+        conn.execute(text("INSERT INTO item_funnel " + ITEM_FUNNEL_SELECT.format(where_orders="", where_menu="")))
+    print("Item funnel rebuilt")
+
+def refresh_item_funnel(merchant_ids=(), viewed_item_ids=()):
+    """
+    Recompute the funnel rows of specific merchants (new orders or menu
+    changes) and the view counts of specific items (new keyword rows).
+    """
+    merchants = [{"merchant_id": str(m)} for m in set(merchant_ids)]
+    items = [{"item_id": str(i)} for i in set(viewed_item_ids)]
+    with engine.begin() as conn:
+        if merchants:
+            conn.execute(text("DELETE FROM item_funnel WHERE merchant_id = :merchant_id"), merchants)
+            conn.execute(text("INSERT INTO item_funnel " + ITEM_FUNNEL_SELECT.format(
+                where_orders="AND t.merchant_id = :merchant_id", where_menu="AND merchant_id = :merchant_id"
+            )), merchants)
+        if items:
+            conn.execute(text("""
+                UPDATE item_funnel
+                SET views = (SELECT COUNT(*) FROM keywords k WHERE k.view = item_funnel.item_id)
+                WHERE item_id = :item_id
+            """), items)
+            conn.execute(text("""
+                UPDATE item_funnel
+                SET conversion = CASE WHEN views > 0 THEN CAST(purchases AS FLOAT) / views END
+                WHERE item_id = :item_id
+            """), items)
+
+def rebuild_keyword_index():
+    """Rebuild keyword_index from the keywords and items tables"""
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM keyword_index"))
+        conn.execute(text("INSERT INTO keyword_index " + KEYWORD_INDEX_SELECT.format(where="")))
+    print("Keyword index rebuilt")
+
+def refresh_keyword_index(keywords=(), item_ids=()):
+    """
+    Recompute the index entries of specific keywords (new keyword rows) and
+    the owner of specific items (catalog changes).
+    """
+    keyword_keys = [{"keyword": str(k)} for k in set(keywords)]
+    item_keys = [{"item_id": str(i)} for i in set(item_ids)]
+    with engine.begin() as conn:
+        if keyword_keys:
+            conn.execute(text("DELETE FROM keyword_index WHERE keyword = :keyword"), keyword_keys)
+            conn.execute(text("INSERT INTO keyword_index " + KEYWORD_INDEX_SELECT.format(
+                where="AND k.keyword = :keyword"
+            )), keyword_keys)
+        if item_keys:
+            conn.execute(text("""
+                UPDATE keyword_index
+                SET merchant_id = (SELECT MAX(merchant_id) FROM items WHERE item_id = keyword_index.item_id)
+                WHERE item_id = :item_id
+            """), item_keys)
+
+# Approximate distinct eaters and order value quantiles per merchant, city
+# and platform. Merchant sketches are built from transactions, city sketches
+# are merges of their merchants' sketches and the platform sketch merges the cities.
+SKETCH_SOURCE_QUERY = """
+    SELECT merchant_id, eater_id, order_value FROM transactions
+    WHERE merchant_id IS NOT NULL
+    ORDER BY merchant_id
+"""
+
+PLATFORM_SKETCH_KEY = "all"
+
+def sketch_transactions(chunk: pd.DataFrame) -> dict:
+    """
+    Sketch a chunk of transactions per merchant.
+    
+    Returns:
+        dict: {merchant_id: (HyperLogLog of eater IDs, TDigest of order values)}
+    """
+    sketches = {}
+    for merchant_id, rows in chunk.dropna(subset=["merchant_id"]).groupby("merchant_id"):
+        eaters, order_values = HyperLogLog(), TDigest()
+        eaters.add_many(rows["eater_id"])
+        order_values.add_many(rows["order_value"])
+        sketches[str(merchant_id)] = (eaters, order_values)
+    return sketches
+
+def _merge_sketch_pairs(pending: dict, sketches: dict):
+    for key, (eaters, order_values) in sketches.items():
+        if key in pending:
+            pending[key][0].merge(eaters)
+            pending[key][1].merge(order_values)
         else:
-            result = conn.execute(text(query))
-        columns = result.keys()
-        data = result.fetchall()
+            pending[key] = (eaters, order_values)
+
+def _save_sketches(scope: str, sketches: dict):
+    if not sketches:
+        return
+    updated_at = datetime.now()
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO stat_sketches (scope, key, eaters, order_values, updated_at)
+            VALUES (:scope, :key, :eaters, :order_values, :updated_at)
+            ON CONFLICT(scope, key) DO UPDATE SET
+                eaters = excluded.eaters,
+                order_values = excluded.order_values,
+                updated_at = excluded.updated_at
+        """), [
+            {
+                "scope": scope, "key": key, "eaters": eaters.to_bytes(),
+                "order_values": order_values.to_bytes(), "updated_at": updated_at
+            }
+            for key, (eaters, order_values) in sketches.items()
+        ])
+
+def _decode_sketches(df: pd.DataFrame, key_column: str = "key") -> dict:
+    return {
+        str(key): (HyperLogLog.from_bytes(eaters), TDigest.from_bytes(order_values))
+        for key, eaters, order_values in zip(df[key_column], df["eaters"], df["order_values"])
+    }
+
+def rebuild_stat_sketches():
+    """
+    Rebuild every sketch from the transactions table. Rows are streamed in
+    merchant order, so only the sketches of one chunk are held at a time.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM stat_sketches"))
+    carry = {}
+    for chunk in iter_query_chunks(SKETCH_SOURCE_QUERY, chunksize=IMPORT_CHUNKSIZE):
+        sketches = sketch_transactions(chunk)
+        _merge_sketch_pairs(sketches, carry)
+        # The last merchant of the chunk may continue in the next one
+        last = str(chunk["merchant_id"].iloc[-1])
+        carry = {last: sketches.pop(last)} if last in sketches else {}
+        _save_sketches("merchant", sketches)
+    _save_sketches("merchant", carry)
+    refresh_city_sketches()
+    print("Statistics sketches rebuilt")
+
+def merge_merchant_sketches(sketches: dict):
+    """Merge sketches of newly imported transactions into the stored merchant sketches"""
+    if not sketches:
+        return
+    params = {f"key_{i}": key for i, key in enumerate(sketches)}
+    placeholders = ", ".join(f":{name}" for name in params)
+    stored = _decode_sketches(query_to_dataframe(
+        f"SELECT key, eaters, order_values FROM stat_sketches WHERE scope = 'merchant' AND key IN ({placeholders})",
+        params
+    ))
+    _merge_sketch_pairs(stored, sketches)
+    _save_sketches("merchant", {key: stored[key] for key in sketches})
+
+def refresh_city_sketches(merchant_ids=None):
+    """
+    Re-merge the city sketches of the given merchants' cities (all cities
+    when None) from the merchant sketches, then the platform sketch from the
+    city sketches.
+    """
+    where, params = "", {}
+    if merchant_ids is not None:
+        merchant_params = {f"merchant_{i}": str(m) for i, m in enumerate(set(merchant_ids))}
+        if not merchant_params:
+            return
+        placeholders = ", ".join(f":{name}" for name in merchant_params)
+        where = f"WHERE m.city_id IN (SELECT city_id FROM merchants WHERE merchant_id IN ({placeholders}))"
+        params = merchant_params
+    
+    cities = {}
+    query = f"""
+        SELECT m.city_id, s.eaters, s.order_values
+        FROM stat_sketches s
+        JOIN merchants m ON m.merchant_id = s.key AND s.scope = 'merchant'
+        {where}
+    """
+    for chunk in iter_query_chunks(query, params, chunksize=1000):
+        chunk = chunk.dropna(subset=["city_id"])
+        for city_id, eaters, order_values in zip(chunk["city_id"], chunk["eaters"], chunk["order_values"]):
+            _merge_sketch_pairs(cities, {str(city_id): (HyperLogLog.from_bytes(eaters), TDigest.from_bytes(order_values))})
+    if merchant_ids is None:
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM stat_sketches WHERE scope = 'city'"))
+    _save_sketches("city", cities)
+    
+    platform = {}
+    city_rows = query_to_dataframe("SELECT key, eaters, order_values FROM stat_sketches WHERE scope = 'city'")
+    for sketches in _decode_sketches(city_rows).values():
+        _merge_sketch_pairs(platform, {PLATFORM_SKETCH_KEY: sketches})
+    _save_sketches("platform", platform)
+
+# Latest order time per merchant, maintained on ingest
+ORDER_WATERMARKS_SELECT = """
+    SELECT merchant_id, MAX(order_time) AS latest_order_time
+    FROM transactions
+    WHERE order_time IS NOT NULL
+    GROUP BY merchant_id
+"""
+
+def rebuild_order_watermarks():
+    """Recompute merchant_watermarks from the transactions table"""
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM merchant_watermarks"))
+        conn.execute(text("INSERT INTO merchant_watermarks " + ORDER_WATERMARKS_SELECT))
+
+def advance_order_watermarks(latest_by_merchant: dict):
+    """
+    Move merchant watermarks forward to newly ingested order times.
+    
+    Args:
+        latest_by_merchant: {merchant_id: latest order_time in the new rows}
+    """
+    rows = [
+        # Same text format SQLAlchemy uses for DateTime columns, so MAX() compares like for like
+        {"merchant_id": str(merchant_id), "latest_order_time": pd.Timestamp(latest).strftime("%Y-%m-%d %H:%M:%S.%f")}
+        for merchant_id, latest in latest_by_merchant.items() if pd.notna(latest)
+    ]
+    if not rows:
+        return
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO merchant_watermarks (merchant_id, latest_order_time)
+            VALUES (:merchant_id, :latest_order_time)
+            ON CONFLICT(merchant_id) DO UPDATE SET
+                latest_order_time = MAX(latest_order_time, excluded.latest_order_time)
+        """), rows)
+
+# CSV ingestion
+IMPORT_CHUNKSIZE = 50_000
+
+# (CSV path, table, natural key used for upserts - None means append-only)
+CSV_SOURCES = [
+    ("data/merchant.csv", "merchants", "merchant_id"),
+    ("data/transaction_data.csv", "transactions", "order_id"),
+    ("data/transaction_items.csv", "transaction_items", None),
+    ("data/items.csv", "items", "item_id"),
+    ("data/keywords.csv", "keywords", None),
+    ("data/ingredient.csv", "ingredients", "ingredient_id"),
+    ("data/ingredient_usage.csv", "ingredient_usage", None),
+]
+
+# Read ID columns as text so values like "01234" keep their leading zeros
+# and every chunk gets the same dtype
+CSV_ID_DTYPES = {"merchant_id": str, "order_id": str, "eater_id": str, "item_id": str, "join_date": str}
+
+# Columns parsed before writing so they land in their typed DateTime/Date columns
+CSV_DATETIME_COLUMNS = {
+    "transactions": ["order_time", "driver_arrival_time", "driver_pickup_time", "delivery_time"],
+}
+CSV_DATE_COLUMNS = {
+    "ingredients": ["last_restock"],
+    "ingredient_usage": ["date"],
+}
+
+def _column_type(dtype) -> str:
+    if pd.api.types.is_integer_dtype(dtype) or pd.api.types.is_bool_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "FLOAT"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "DATETIME"
+    return "VARCHAR"
+
+def _rebuild_table(table, legacy_columns: dict):
+    """Recreate a table with its declared schema, keeping its rows and any extra columns"""
+    legacy = f"{table.name}__legacy"
+    with engine.begin() as conn:
+        conn.execute(text(f'ALTER TABLE "{table.name}" RENAME TO "{legacy}"'))
+        table.create(bind=conn)
+        for name, column_type in legacy_columns.items():
+            if name not in table.columns:
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{name}" {column_type}'))
+        columns = ", ".join(f'"{name}"' for name in legacy_columns if name != "id")
+        conn.execute(text(f'INSERT OR REPLACE INTO "{table.name}" ({columns}) SELECT {columns} FROM "{legacy}"'))
+        conn.execute(text(f'DROP TABLE "{legacy}"'))
+    print(f"Rebuilt {table.name} with its declared schema")
+
+def migrate_schema():
+    """
+    Bring the existing tables in line with the ORM models.
+    
+    Tables written by the old to_sql(if_exists="replace") import have no id
+    column, loosely typed columns and no indexes, so they are rebuilt with the
+    declared schema (rows are kept). Other tables only get their missing
+    columns and indexes added.
+    """
+    inspector = inspect(engine)
+    existing = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing:
+            continue
+        columns = {c["name"]: str(c["type"]) for c in inspector.get_columns(table.name)}
+        if "id" in table.columns and "id" not in columns:
+            _rebuild_table(table, columns)
+            continue
+        with engine.begin() as conn:
+            for column in table.columns:
+                if column.name not in columns:
+                    conn.execute(text(
+                        f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column.type.compile(engine.dialect)}'
+                    ))
+    
+    Base.metadata.create_all(bind=engine)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+def _ensure_columns(conn, table: str, chunk: pd.DataFrame):
+    """Add CSV columns the table does not know yet instead of failing the insert, on the caller's connection"""
+    existing = {c["name"] for c in inspect(conn).get_columns(table)}
+    for name, dtype in chunk.dtypes.items():
+        if name not in existing:
+            conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN "{name}" {_column_type(dtype)}'))
+
+def _get_watermark(table: str):
+    """Get (rows_loaded, source_size) recorded for a table, or (0, 0) if never loaded"""
+    with engine.connect() as conn:
+        row = conn.execute(
+            text("SELECT rows_loaded, source_size FROM ingest_watermarks WHERE table_name = :table"),
+            {"table": table}
+        ).fetchone()
+    return (row[0], row[1]) if row else (0, 0)
+
+def _get_import_position(table: str):
+    """Get (byte_offset, source_fingerprint) recorded for a table, or (0, None) if never loaded"""
+    with engine.connect() as conn:
+        row = conn.execute(
+            text("SELECT byte_offset, source_fingerprint FROM ingest_watermarks WHERE table_name = :table"),
+            {"table": table}
+        ).fetchone()
+    return (row[0] or 0, row[1]) if row else (0, None)
+
+def _set_watermark(conn, table: str, source: str, rows_loaded: int, source_size: int,
+                   byte_offset: int, fingerprint: str):
+    """Record the import position, inside the transaction that wrote the rows up to it"""
+    conn.execute(text("""
+        INSERT INTO ingest_watermarks
+            (table_name, source, rows_loaded, source_size, byte_offset, source_fingerprint, updated_at)
+        VALUES (:table, :source, :rows_loaded, :source_size, :byte_offset, :fingerprint, :updated_at)
+        ON CONFLICT(table_name) DO UPDATE SET
+            source = excluded.source,
+            rows_loaded = excluded.rows_loaded,
+            source_size = excluded.source_size,
+            byte_offset = excluded.byte_offset,
+            source_fingerprint = excluded.source_fingerprint,
+            updated_at = excluded.updated_at
+    """), {
+        "table": table,
+        "source": source,
+        "rows_loaded": rows_loaded,
+        "source_size": source_size,
+        "byte_offset": byte_offset,
+        "fingerprint": fingerprint,
+        "updated_at": datetime.now()
+    })
+
+def _upsert_on(key: str):
+    """Build a DataFrame.to_sql method that upserts rows on a natural key"""
+    def method(table, conn, keys, data_iter):
+        rows = [dict(zip(keys, row)) for row in data_iter]
+        stmt = sqlite_insert(table.table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[key],
+            set_={column: stmt.excluded[column] for column in keys if column != key}
+        )
+        conn.execute(stmt, rows)
+    return method
+
+def _prepare_chunk(table: str, chunk: pd.DataFrame, key: str = None) -> pd.DataFrame:
+    for column in CSV_DATETIME_COLUMNS.get(table, []):
+        if column in chunk.columns:
+            chunk[column] = pd.to_datetime(chunk[column], errors="coerce")
+    for column in CSV_DATE_COLUMNS.get(table, []):
+        if column in chunk.columns:
+            chunk[column] = pd.to_datetime(chunk[column], errors="coerce").dt.date
+    if key:
+        # A key repeated inside one chunk would hit the same row twice in one statement
+        chunk = chunk.drop_duplicates(subset=[key], keep="last")
+    return chunk
+
+# Bytes hashed at the start and at the end of the loaded part of a source file
+FINGERPRINT_BYTES = 64 * 1024
+
+def _source_fingerprint(path: str, byte_offset: int) -> str:
+    """Hash of the first and last FINGERPRINT_BYTES before byte_offset"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        digest.update(f.read(min(FINGERPRINT_BYTES, byte_offset)))
+        f.seek(max(0, byte_offset - FINGERPRINT_BYTES))
+        digest.update(f.read(byte_offset - f.tell()))
+    return digest.hexdigest()
+
+def _resume_offset(path: str, table: str, full_refresh: bool = False) -> int:
+    """
+    Byte offset a new import can continue from: 0 for a full load, otherwise
+    the end of the rows already loaded.
+    
+    The file counts as replaced, and is reloaded from the start, when it is
+    shorter than the loaded part or that part no longer hashes the same.
+    """
+    byte_offset, fingerprint = _get_import_position(table)
+    if full_refresh or not byte_offset or os.path.getsize(path) < byte_offset:
+        return 0
+    if _source_fingerprint(path, byte_offset) != fingerprint:
+        return 0
+    return byte_offset
+
+def _read_csv_chunks(path: str, byte_offset: int, chunksize: int):
+    """
+    Read a CSV from byte_offset (or right after the header) in chunks of chunksize lines.
+    
+    The rows before the offset are never read, so resuming costs nothing per
+    row already loaded. Rows must not span lines (no quoted newlines), as in
+    the exports.
+    
+    Yields:
+        tuple: (chunk DataFrame, byte offset after its last line)
+    """
+    with open(path, "rb") as f:
+        header = f.readline()
+        columns = next(csv.reader([header.decode("utf-8-sig")]))
+        position = max(byte_offset, len(header))
+        f.seek(position)
+        while True:
+            lines = list(itertools.islice(f, chunksize))
+            if not lines:
+                break
+            position += sum(len(line) for line in lines)
+            block = b"".join(lines)
+            if not block.strip():
+                continue
+            chunk = pd.read_csv(io.BytesIO(block), header=None, names=columns, dtype=CSV_ID_DTYPES)
+            yield chunk, position
+
+def import_csv_file(path: str, table: str, key: str = None, full_refresh: bool = False,
+                    chunksize: int = IMPORT_CHUNKSIZE, on_chunk=None, byte_offset: int = None) -> dict:
+    """
+    Stream one CSV file into a table in chunks.
     
-    return pd.DataFrame(data, columns=columns)
+    Reading resumes at the byte offset where the previous run stopped (the
+    table's high-water mark). Keyed tables are upserted on their natural key,
+    the others are appended. A file that shrank or whose loaded part changed
+    since the last run is treated as replaced and reloaded from the start.
+    Every chunk is written in the same transaction as the watermark that
+    moves past it, so a crash never loads a chunk twice. A full load clears
+    the table and writes every chunk in one transaction, so readers keep
+    seeing the old rows until the new ones are complete and a failed load
+    leaves the table as it was. The table itself is never dropped, so its
+    declared column types and indexes survive every import.
+    
+    Args:
+        path: CSV file path
+        table: Target table name
+        key: Natural key column for upserts, None for append-only tables
+        full_refresh: Ignore the high-water mark and rebuild the table
+        chunksize: Rows per chunk
+        on_chunk: Optional callback receiving every written chunk
+        byte_offset: Offset from _resume_offset if the caller already computed it
+        
+    Returns:
+        dict: rows, seconds, rows_per_sec and whether it was a full load
+    """
+    started = time.perf_counter()
+    source_size = os.path.getsize(path)
+    if byte_offset is None:
+        byte_offset = _resume_offset(path, table, full_refresh)
+    full_load = byte_offset == 0
+    rows_loaded = 0 if full_load else _get_watermark(table)[0]
+    
+    def load_chunks(begin):
+        """Write every chunk, with its watermark, in the transaction begin() returns"""
+        rows = 0
+        for chunk, chunk_end in _read_csv_chunks(path, byte_offset, chunksize):
+            # The watermark counts CSV rows, not rows left after de-duplication
+            chunk_rows = len(chunk)
+            chunk = _prepare_chunk(table, chunk, key)
+            fingerprint = _source_fingerprint(path, chunk_end)
+            with begin() as conn:
+                if rows == 0:
+                    _ensure_columns(conn, table, chunk)
+                if key:
+                    chunk.to_sql(table, conn, if_exists="append", index=False, method=_upsert_on(key))
+                else:
+                    chunk.to_sql(table, conn, if_exists="append", index=False)
+                rows += chunk_rows
+                _set_watermark(conn, table, path, rows_loaded + rows, source_size, chunk_end, fingerprint)
+            if on_chunk:
+                on_chunk(chunk)
+        return rows
+    
+    if full_load:
+        with engine.begin() as conn:
+            # Reset the watermark with the rows it described
+            conn.execute(text(f'DELETE FROM "{table}"'))
+            _set_watermark(conn, table, path, 0, source_size, 0, None)
+            rows = load_chunks(lambda: contextlib.nullcontext(conn))
+    else:
+        rows = load_chunks(engine.begin)
+    
+    seconds = time.perf_counter() - started
+    stats = {
+        "rows": rows,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(rows / seconds) if seconds > 0 else 0,
+        "full_load": full_load
+    }
+    print(f"{table}: {rows} rows in {seconds:.2f}s ({stats['rows_per_sec']:,} rows/sec)")
+    return stats
 
 # Function to import CSV files into database
-def import_csv_to_db():
-    """Import all CSV files into the database tables"""
-    # Import merchants
-    if os.path.exists("data/merchant.csv"):
-        merchants_df = pd.read_csv("data/merchant.csv")
-        merchants_df.to_sql("merchants", engine, if_exists="replace", index=False)
-        print("Merchants data imported")
-    
-    # Import transactions
-    if os.path.exists("data/transaction_data.csv"):
-        transactions_df = pd.read_csv("data/transaction_data.csv")
-        transactions_df["order_time"] = pd.to_datetime(transactions_df["order_time"], errors="coerce")
-        transactions_df.to_sql("transactions", engine, if_exists="replace", index=False)
-        print("Transactions data imported")
-    
-    # Import transaction items
-    if os.path.exists("data/transaction_items.csv"):
-        transaction_items_df = pd.read_csv("data/transaction_items.csv")
-        transaction_items_df.to_sql("transaction_items", engine, if_exists="replace", index=False)
-        print("Transaction items data imported")
-    
-    # Import items
-    if os.path.exists("data/items.csv"):
-        items_df = pd.read_csv("data/items.csv")
-        items_df.to_sql("items", engine, if_exists="replace", index=False)
-        print("Items data imported")
+def import_csv_to_db(full_refresh: bool = False) -> dict:
+    """
+    Import all CSV files into the database tables.
+    
+    Re-runs only load rows appended to the CSVs since the previous run unless
+    full_refresh is set.
+    
+    Returns:
+        dict: Per-table import statistics
+    """
+    migrate_schema()
+    
+    # Keys whose item funnel / keyword index rows an incremental import must refresh
+    funnel_merchants, viewed_items, touched_keywords, catalog_items = set(), set(), set(), set()
+    new_sketches = {}
+    
+    stats = {}
+    for path, table, key in CSV_SOURCES:
+        if not os.path.exists(path):
+            continue
+        
+        # Computed once, so the callbacks below and the import agree on a full load
+        byte_offset = _resume_offset(path, table, full_refresh)
+        touched_days = set()
+        touched_customers = set()
+        latest_by_merchant = {}
+        on_chunk = None
+        if table == "transactions":
+            # A full load rebuilds the sketches afterwards, an incremental one merges these
+            sketch_chunks = byte_offset > 0
+            def on_chunk(chunk):
+                if sketch_chunks:
+                    _merge_sketch_pairs(new_sketches, sketch_transactions(chunk))
+                funnel_merchants.update(chunk["merchant_id"].dropna())
+                eaters = chunk.dropna(subset=["eater_id"])
+                touched_customers.update(zip(eaters["merchant_id"], eaters["eater_id"]))
+                days = chunk.dropna(subset=["order_time"])
+                touched_days.update(zip(days["merchant_id"], days["order_time"].dt.strftime("%Y-%m-%d")))
+                for merchant_id, latest in days.groupby("merchant_id")["order_time"].max().items():
+                    if merchant_id not in latest_by_merchant or latest > latest_by_merchant[merchant_id]:
+                        latest_by_merchant[merchant_id] = latest
+        elif table in ("transaction_items", "items"):
+            def on_chunk(chunk):
+                funnel_merchants.update(chunk["merchant_id"].dropna())
+                if table == "items":
+                    catalog_items.update(chunk["item_id"].dropna())
+        elif table == "keywords":
+            def on_chunk(chunk):
+                viewed_items.update(chunk["view"].dropna())
+                touched_keywords.update(chunk["keyword"].dropna())
+        
+        stats[table] = import_csv_file(path, table, key, on_chunk=on_chunk, byte_offset=byte_offset)
+        
+        if table == "transactions" and stats[table]["rows"]:
+            if stats[table]["full_load"]:
+                rebuild_sales_rollups()
+                rebuild_order_watermarks()
+                rebuild_merchant_customers()
+                rebuild_stat_sketches()
+            else:
+                refresh_sales_rollups(touched_days)
+                advance_order_watermarks(latest_by_merchant)
+                refresh_merchant_customers(touched_customers)
+                merge_merchant_sketches(new_sketches)
+                refresh_city_sketches(new_sketches.keys())
+        elif table == "merchants" and (stats[table]["rows"] or stats[table]["full_load"]):
+            # Merchants may have moved city
+            refresh_city_sketches()
+    
+    funnel_stats = [stats[t] for t in ("transactions", "transaction_items", "items", "keywords") if t in stats]
+    if any(s["full_load"] for s in funnel_stats):
+        rebuild_item_funnel()
+        rebuild_keyword_index()
+    elif any(s["rows"] for s in funnel_stats):
+        refresh_item_funnel(funnel_merchants, viewed_items)
+        refresh_keyword_index(touched_keywords, catalog_items)
+    
+    changed = {TABLE_SCOPES[table] for table, table_stats in stats.items()
+               if table_stats["rows"] or table_stats["full_load"]}
+    if changed:
+        bump_data_version(*changed)
+    return stats
+
+# Parquet snapshots (optional, needs pyarrow)
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as pa_dataset
+except ImportError:
+    pa = pa_dataset = None
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "./data/snapshot")
+SNAPSHOT_MANIFEST = "_manifest.json"
+
+# table -> (export query, hive partition columns). Transactions and their items
+# are split by merchant and month so a reader only opens the files it needs.
+SNAPSHOT_TABLES = {
+    "merchants": ("SELECT * FROM merchants", []),
+    "transactions": (
+        "SELECT *, COALESCE(strftime('%Y-%m', order_time), 'unknown') AS month FROM transactions",
+        ["merchant_id", "month"]
+    ),
+    "transaction_items": (
+        """SELECT ti.*, COALESCE(strftime('%Y-%m', t.order_time), 'unknown') AS month
+        FROM transaction_items ti LEFT JOIN transactions t ON t.order_id = ti.order_id""",
+        ["merchant_id", "month"]
+    ),
+    "items": ("SELECT * FROM items", ["merchant_id"]),
+    "keywords": ("SELECT * FROM keywords", []),
+    "ingredients": ("SELECT * FROM ingredients", []),
+    "ingredient_usage": ("SELECT * FROM ingredient_usage", []),
+    "ingest_watermarks": ("SELECT * FROM ingest_watermarks", []),
+}
+
+def _require_pyarrow():
+    if pa_dataset is None:
+        raise RuntimeError("Parquet snapshots need pyarrow (pip install pyarrow)")
+
+def _snapshot_partitioning(table: str):
+    """Hive partitioning with string keys, so IDs like "0123" are not read back as numbers"""
+    partition_cols = SNAPSHOT_TABLES[table][1]
+    if not partition_cols:
+        return None
+    return pa_dataset.partitioning(pa.schema([(c, pa.string()) for c in partition_cols]), flavor="hive")
+
+def _snapshot_dtypes(table: str, df: pd.DataFrame) -> pd.DataFrame:
+    """Give a snapshot frame the same dtypes as a CSV import chunk"""
+    for column in CSV_ID_DTYPES:
+        if column in df.columns:
+            df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+    for column in CSV_DATETIME_COLUMNS.get(table, []):
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column], errors="coerce")
+    for column in CSV_DATE_COLUMNS.get(table, []):
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column], errors="coerce").dt.date
+    return df
+
+def export_parquet_snapshot(snapshot_dir: str = SNAPSHOT_DIR) -> dict:
+    """
+    Export every table to a Parquet dataset, partitioned by merchant and month
+    where the table has them (<snapshot_dir>/<table>/merchant_id=.../month=.../).
+    
+    The snapshot is written next to the old one and swapped in when complete,
+    so readers never see a half-written snapshot.
+    
+    Returns:
+        dict: Rows written per table
+    """
+    _require_pyarrow()
+    import json
+    import shutil
+    
+    started = time.perf_counter()
+    staging = snapshot_dir.rstrip("/") + ".tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    
+    manifest = {"created_at": datetime.now().isoformat(), "tables": {}}
+    for table, (query, partition_cols) in SNAPSHOT_TABLES.items():
+        table_dir = os.path.join(staging, table)
+        os.makedirs(table_dir, exist_ok=True)
+        rows = 0
+        for i, chunk in enumerate(iter_query_chunks(query, chunksize=IMPORT_CHUNKSIZE)):
+            chunk = _snapshot_dtypes(table, chunk.drop(columns=["id"], errors="ignore"))
+            if partition_cols:
+                chunk.to_parquet(
+                    table_dir, engine="pyarrow", index=False,
+                    partition_cols=partition_cols, basename_template=f"part-{i}-{{i}}.parquet"
+                )
+            else:
+                chunk.to_parquet(os.path.join(table_dir, f"part-{i}.parquet"), engine="pyarrow", index=False)
+            rows += len(chunk)
+        manifest["tables"][table] = {"rows": rows, "watermark": list(_get_watermark(table))}
+    
+    with open(os.path.join(staging, SNAPSHOT_MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    shutil.rmtree(snapshot_dir, ignore_errors=True)
+    os.replace(staging, snapshot_dir)
+    
+    print(f"Parquet snapshot written to {snapshot_dir} in {time.perf_counter() - started:.2f}s")
+    return {table: info["rows"] for table, info in manifest["tables"].items()}
+
+def read_snapshot_manifest(snapshot_dir: str = SNAPSHOT_DIR):
+    """Get the manifest of the current snapshot, or None if there is none"""
+    import json
+    path = os.path.join(snapshot_dir, SNAPSHOT_MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def snapshot_is_current(table: str, snapshot_dir: str = SNAPSHOT_DIR) -> bool:
+    """True when a snapshot of the table exists and nothing was ingested into it since"""
+    if pa_dataset is None:
+        return False
+    manifest = read_snapshot_manifest(snapshot_dir)
+    if not manifest or table not in manifest["tables"]:
+        return False
+    return tuple(manifest["tables"][table]["watermark"]) == _get_watermark(table)
+
+def read_snapshot(table: str, merchant_id: str = None, months=None, columns=None,
+                  snapshot_dir: str = SNAPSHOT_DIR) -> pd.DataFrame:
+    """
+    Read a table from the Parquet snapshot with memory-mapped files.
+    
+    Filters on the partition columns prune whole directories, so reading one
+    merchant (and optionally a few months) only opens that merchant's files.
+    
+    Args:
+        table: Snapshot table name
+        merchant_id: Optional merchant to read
+        months: Optional list of YYYY-MM months to read
+        columns: Optional list of columns to read
+        snapshot_dir: Snapshot root directory
         
-    # Import keywords
-    if os.path.exists("data/keywords.csv"):
-        keywords_df = pd.read_csv("data/keywords.csv")
-        keywords_df.to_sql("keywords", engine, if_exists="replace", index=False)
-        print("Keywords data imported")
+    Returns:
+        pd.DataFrame: Rows with the same dtypes as a CSV import
+    """
+    _require_pyarrow()
+    partition_cols = SNAPSHOT_TABLES[table][1]
+    filters = []
+    if merchant_id is not None and "merchant_id" in partition_cols:
+        filters.append(("merchant_id", "=", str(merchant_id)))
+    if months and "month" in partition_cols:
+        filters.append(("month", "in", list(months)))
+    
+    df = pd.read_parquet(
+        os.path.join(snapshot_dir, table),
+        engine="pyarrow",
+        columns=columns,
+        filters=filters or None,
+        partitioning=_snapshot_partitioning(table),
+        memory_map=True
+    )
+    return _snapshot_dtypes(table, df.drop(columns=["month"], errors="ignore"))
+
+def import_parquet_snapshot(snapshot_dir: str = SNAPSHOT_DIR) -> dict:
+    """
+    Replace the table contents with a Parquet snapshot instead of re-parsing the CSVs.
+    
+    Batches are streamed from the memory-mapped files straight into the tables.
+    Each table is cleared and refilled in one transaction, so readers see the
+    old rows until the new ones are complete and a failed restore leaves the
+    table as it was.
+    The ingest watermarks come with the snapshot, so a later import_csv_to_db
+    only loads CSV rows appended after the snapshot was taken.
+    
+    Returns:
+        dict: Per-table rows, seconds and rows_per_sec
+    """
+    _require_pyarrow()
+    if read_snapshot_manifest(snapshot_dir) is None:
+        raise FileNotFoundError(f"No Parquet snapshot found in {snapshot_dir}")
+    migrate_schema()
+    
+    stats = {}
+    for table in SNAPSHOT_TABLES:
+        table_dir = os.path.join(snapshot_dir, table)
+        if not os.path.isdir(table_dir):
+            continue
+        started = time.perf_counter()
+        dataset = pa_dataset.dataset(table_dir, format="parquet", partitioning=_snapshot_partitioning(table))
+        rows = 0
+        with engine.begin() as conn:
+            conn.execute(text(f'DELETE FROM "{table}"'))
+            for batch in dataset.to_batches(batch_size=IMPORT_CHUNKSIZE):
+                chunk = _snapshot_dtypes(table, batch.to_pandas().drop(columns=["month"], errors="ignore"))
+                if rows == 0:
+                    _ensure_columns(conn, table, chunk)
+                chunk.to_sql(table, conn, if_exists="append", index=False)
+                rows += len(chunk)
         
-    # Import ingredients
-    if os.path.exists("data/ingredient.csv"):
-        ingredients_df = pd.read_csv("data/ingredient.csv")
-        ingredients_df.to_sql("ingredients", engine, if_exists="replace", index=False)
-        print("Ingredients data imported")
-    
-    # Import ingredient usage
-    if os.path.exists("data/ingredient_usage.csv"):
-        ingredient_usage_df = pd.read_csv("data/ingredient_usage.csv")
-        ingredient_usage_df.to_sql("ingredient_usage", engine, if_exists="replace", index=False)
-        print("Ingredient usage data imported")
+        seconds = time.perf_counter() - started
+        stats[table] = {
+            "rows": rows,
+            "seconds": round(seconds, 3),
+            "rows_per_sec": round(rows / seconds) if seconds > 0 else 0
+        }
+        print(f"{table}: {rows} rows from snapshot in {seconds:.2f}s")
+    
+    if "transactions" in stats:
+        rebuild_sales_rollups()
+        rebuild_order_watermarks()
+        rebuild_merchant_customers()
+        rebuild_stat_sketches()
+    if any(table in stats for table in ("transactions", "transaction_items", "items", "keywords")):
+        rebuild_item_funnel()
+        rebuild_keyword_index()
+    bump_data_version(*{TABLE_SCOPES[table] for table in stats if table in TABLE_SCOPES})
+    return stats
 
 # Only run this when directly executing this file
 if __name__ == "__main__":
@@ -1,31 +1,21 @@
-import pandas as pd
-from database import query_to_dataframe
-from functools import lru_cache
-from datetime import datetime, timedelta
+from datetime import datetime
+from watermarks import get_watermarks
 
-@lru_cache(maxsize=1)
 def get_latest_transaction_date():
     """
-    Get the latest transaction date from the database.
-    Cached for better performance.
+    Get the latest transaction date across all merchants.
+    Read from the watermark service, which follows every ingest.
     
     Returns:
         datetime.date: The latest transaction date
     """
     try:
-        query = """
-        SELECT MAX(DATE(order_time)) as latest_date
-        FROM transactions
-        """
-        
-        df = query_to_dataframe(query)
-        
-        if not df.empty and df['latest_date'].iloc[0] is not None:
-            return pd.to_datetime(df['latest_date'].iloc[0]).date()
-        else:
-            # Fallback to current date if no transactions
-            return datetime.now().date()
+        latest_date = get_watermarks().latest_date()
+        if latest_date is not None:
+            return latest_date
+        # Fallback to current date if no transactions
+        return datetime.now().date()
             
     except Exception as e:
         print(f"Error getting latest transaction date: {str(e)}")
-        return datetime.now().date()
\ No newline at end of file
+        return datetime.now().date()
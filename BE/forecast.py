@@ -1,22 +1,16 @@
 import pandas as pd
 from prophet import Prophet
-from database import query_to_dataframe
+from datetime import date
+from rollups import get_latest_sales_date, get_daily_sales
 
 def load_merchant_sales_series(merchant_id: str):
-    query = """
-    SELECT order_time, order_value 
-    FROM transactions 
-    WHERE merchant_id = :merchant_id
-    """
+    latest_date = get_latest_sales_date(merchant_id)
     
-    df = query_to_dataframe(query, {"merchant_id": merchant_id})
-    
-    if df.empty:
+    if latest_date is None:
         return pd.DataFrame()
 
-    df["order_time"] = pd.to_datetime(df["order_time"], errors="coerce")
-    df["order_date"] = df["order_time"].dt.date
-    daily_sales = df.groupby("order_date")["order_value"].sum().reset_index()
+    # The daily rollup already holds one row per day with sales
+    daily_sales = get_daily_sales(merchant_id, date.min, latest_date)[["date", "revenue"]]
     daily_sales.columns = ["ds", "y"]
     return daily_sales
 
@@ -1,4 +1,4 @@
-from database import query_to_dataframe
+from analytics_engine import category_counts
 
 def get_category_distribution(merchant_id: str):
     """
@@ -12,18 +12,7 @@ def get_category_distribution(merchant_id: str):
         dict: Category distribution data with names, percentages, and colors
     """
     try:
-        # Direct join between transaction_items and items tables
-        # to get cuisine distribution for the merchant
-        query = """
-            SELECT i.cuisine_tag, COUNT(*) as count
-            FROM transaction_items ti
-            JOIN items i ON ti.item_id = i.item_id
-            WHERE ti.merchant_id = :merchant_id
-            GROUP BY i.cuisine_tag
-            ORDER BY count DESC
-        """
-        
-        category_df = query_to_dataframe(query, {"merchant_id": merchant_id})
+        category_df = category_counts(merchant_id)
         
         if category_df.empty:
             return {"status": "error", "message": "No category data found for this merchant"}
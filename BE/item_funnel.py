@@ -0,0 +1,105 @@
+"""
+Keyword view-to-purchase funnel.
+
+item_funnel holds, for every item in a merchant's orders or menu, how often
+keyword searches led to it (views), how often it was sold in the merchant's
+orders (purchases) and the conversion between the two. keyword_index maps
+every search keyword to the items it led to and their merchants. Both are
+maintained by the ingest paths, so low-conversion items and keyword
+recommendations are index lookups instead of a pass over the keywords table.
+"""
+import re
+from database import (
+    query_to_dataframe, fill_if_empty, rebuild_item_funnel, rebuild_keyword_index
+)
+
+# Items converting less than this share of their views are underperforming
+LOW_CONVERSION = 0.1
+
+LOW_CONVERSION_ITEMS_QUERY = """
+SELECT f.item_id, i.item_name, f.views, f.purchases, f.conversion
+FROM item_funnel f
+JOIN items i ON i.item_id = f.item_id
+WHERE f.merchant_id = :merchant_id
+  AND f.views > 0 AND f.purchases > 0 AND f.conversion < :threshold
+ORDER BY i.id
+"""
+
+MERCHANT_FUNNEL_QUERY = """
+SELECT f.item_id, i.item_name, f.views, f.purchases, f.conversion
+FROM item_funnel f
+JOIN items i ON i.item_id = f.item_id AND i.merchant_id = f.merchant_id
+WHERE f.merchant_id = :merchant_id
+ORDER BY f.views DESC, f.item_id
+"""
+
+RECOMMEND_ITEMS_QUERY = """
+SELECT ki.item_id, i.item_name, ki.merchant_id, SUM(ki.views) AS views, SUM(ki.orders) AS orders
+FROM keyword_index ki
+JOIN items i ON i.item_id = ki.item_id
+WHERE ki.keyword IN ({placeholders}) {where}
+GROUP BY ki.item_id
+ORDER BY views DESC, orders DESC, ki.item_id
+LIMIT :limit
+"""
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def ensure_funnel_tables():
+    fill_if_empty("item_funnel", "transactions", rebuild_item_funnel)
+    fill_if_empty("keyword_index", "keywords", rebuild_keyword_index)
+
+
+def low_conversion_items(merchant_id: str, threshold: float = LOW_CONVERSION) -> list:
+    """
+    Names of the items that sell in a merchant's orders but convert less
+    than threshold of their keyword views, in menu order.
+    """
+    ensure_funnel_tables()
+    df = query_to_dataframe(LOW_CONVERSION_ITEMS_QUERY, {"merchant_id": merchant_id, "threshold": threshold})
+    return df["item_name"].tolist()
+
+
+def get_item_funnel(merchant_id: str) -> list:
+    """
+    Views, purchases and conversion of every item on a merchant's menu,
+    most viewed first.
+
+    Returns:
+        list: Dicts with item_id, item_name, views, purchases and conversion
+        (None for items without views)
+    """
+    ensure_funnel_tables()
+    df = query_to_dataframe(MERCHANT_FUNNEL_QUERY, {"merchant_id": merchant_id})
+    df["conversion"] = df["conversion"].astype(object).where(df["conversion"].notna(), None)
+    return df.to_dict(orient="records")
+
+
+def recommend_items(query: str, merchant_id: str = None, limit: int = 5) -> list:
+    """
+    Recommend items for a search query from the keyword index.
+
+    Items are ranked by how often the query's keywords led to them.
+
+    Args:
+        query: Free text, matched word by word against the search keywords
+        merchant_id: Only recommend this merchant's items when given
+        limit: Maximum number of items
+
+    Returns:
+        list: Dicts with item_id, item_name, merchant_id, views and orders
+    """
+    keywords = sorted({word.lower() for word in _WORD.findall(query)})
+    if not keywords:
+        return []
+    ensure_funnel_tables()
+    params = {f"keyword_{i}": keyword for i, keyword in enumerate(keywords)}
+    placeholders = ", ".join(f":{name}" for name in params)
+    where = ""
+    if merchant_id is not None:
+        where = "AND ki.merchant_id = :merchant_id"
+        params["merchant_id"] = merchant_id
+    params["limit"] = limit
+    df = query_to_dataframe(RECOMMEND_ITEMS_QUERY.format(placeholders=placeholders, where=where), params)
+    return df.to_dict(orient="records")
@@ -1,6 +1,5 @@
 from database import query_to_dataframe
-from collections import Counter
-from itertools import combinations
+from analytics_engine import item_pair_counts
 import pandas as pd
 
 def get_items_by_merchant(merchant_id: str):
@@ -57,59 +56,17 @@ def get_frequently_bought_together(merchant_id: str, limit: int = 3):
         # Get merchant's item IDs from database
         merchant_item_ids = set(df_items["item_id"].tolist())
         
-        # Get merchant's transactions
-        tx_query = """SELECT order_id FROM transactions WHERE merchant_id = :merchant_id"""
-        df_tx = query_to_dataframe(tx_query, {"merchant_id": merchant_id})
+        # Count item pairs bought in the same order on the analytics engine
+        df_pairs = item_pair_counts(merchant_id, limit)
         
-        if df_tx.empty:
-            return {
-                "status": "error",
-                "message": "No transactions found for this merchant"
-            }
-            
-        # Get order IDs to filter transaction items
-        order_ids = df_tx["order_id"].tolist()
-        if not order_ids:
-            return {
-                "status": "error",
-                "message": "No order IDs found for this merchant"
-            }
-            
-        # Build placeholders for SQL query
-        placeholders = ', '.join(f"'{oid}'" for oid in order_ids)
-        
-        # Get transaction items for these orders
-        tx_items_query = f"""SELECT * FROM transaction_items WHERE order_id IN ({placeholders})"""
-        df_tx_items = query_to_dataframe(tx_items_query)
-        
-        if df_tx_items.empty:
-            return {
-                "status": "error",
-                "message": "No transaction items found for this merchant's orders"
-            }
-            
-        # Filter to only include the merchant's items
-        merchant_tx_items = df_tx_items[df_tx_items["item_id"].isin(merchant_item_ids)]
-        
-        if merchant_tx_items.empty:
+        if df_pairs.empty:
             return {
                 "status": "error",
                 "message": "No transaction items match this merchant's inventory"
             }
         
-        # Build a list of all item combinations per order
-        merchant_orders = merchant_tx_items.groupby("order_id")["item_id"].apply(list)
-        
-        pair_counter = Counter()
-        
-        for items in merchant_orders:
-            unique_items = list(set(items))  # Avoid duplicate items in the same order
-            if len(unique_items) > 1:
-                pairs = combinations(sorted(unique_items), 2)
-                pair_counter.update(pairs)
-        
         # Get top N most common item pairs
-        top_pairs = pair_counter.most_common(limit)
+        top_pairs = [((row.item1, row.item2), int(row.count)) for row in df_pairs.itertuples(index=False)]
         
         # Convert item IDs to item names and use frontend IDs
         pair_results = []
@@ -0,0 +1,213 @@
+"""
+Persistent cache of LLM responses.
+
+Responses are stored in the llm_responses table, keyed by a hash of the
+endpoint, model and call parameters, the whitespace-normalized prompt and
+the current version of the data scopes the prompt was built from. The
+table lives in the application database, so every worker shares it and it
+survives restarts. Entries expire after a TTL, and once the stored
+responses exceed LLM_CACHE_MAX_BYTES the least recently used are evicted.
+
+Lookups only read. Hits are counted in memory and written to the table in
+one batch with the next store or eviction, and eviction runs at most every
+LLM_CACHE_EVICT_INTERVAL_SECONDS rather than on every store.
+"""
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from database import engine, read_engine, get_data_version
+from llm_client import get_llm_client, LLM_MODEL
+
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", 24 * 3600))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", 20 * 1024 * 1024))
+LLM_CACHE_EVICT_INTERVAL_SECONDS = float(os.getenv("LLM_CACHE_EVICT_INTERVAL_SECONDS", 300))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse whitespace so indentation changes do not miss the cache"""
+    return _WHITESPACE.sub(" ", prompt).strip()
+
+
+def response_key(endpoint: str, model: str, prompt: str, data_version: str, params: dict = None) -> str:
+    payload = json.dumps([endpoint, model, params or {}, data_version, normalize_prompt(prompt)], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """Get/put of stored responses with per-endpoint hit/miss counters of this process"""
+
+    def __init__(self, max_bytes: int = LLM_CACHE_MAX_BYTES,
+                 evict_interval: float = LLM_CACHE_EVICT_INTERVAL_SECONDS):
+        self.max_bytes = max_bytes
+        self.evict_interval = evict_interval
+        self._lock = threading.Lock()
+        self._counters = {}  # endpoint -> {"hits", "misses", "stores"}
+        self._touched = {}  # key -> [hits, last used] not yet written to the table
+        self._last_evicted = 0.0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _count(self, endpoint: str, counter: str):
+        with self._lock:
+            counters = self._counters.setdefault(endpoint, {"hits": 0, "misses": 0, "stores": 0})
+            counters[counter] += 1
+
+    def get(self, key: str, endpoint: str):
+        """Return the stored response for key, or None if it is missing or expired"""
+        now = datetime.now()
+        with read_engine.connect() as conn:
+            row = conn.execute(text("""
+                SELECT response FROM llm_responses
+                WHERE key = :key AND (expires_at IS NULL OR expires_at >= :now)
+            """), {"key": key, "now": now}).fetchone()
+        if row is None:
+            self._count(endpoint, "misses")
+            return None
+        with self._lock:
+            touched = self._touched.setdefault(key, [0, now])
+            touched[0] += 1
+            touched[1] = now
+        self._count(endpoint, "hits")
+        return row.response
+
+    def _flush_touched(self, conn):
+        """Write the hits recorded since the last flush, in one batch on conn"""
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        if touched:
+            conn.execute(text("""
+                UPDATE llm_responses SET hits = hits + :hits, last_used_at = MAX(last_used_at, :last_used)
+                WHERE key = :key
+            """), [{"key": key, "hits": hits, "last_used": last_used} for key, (hits, last_used) in touched.items()])
+
+    def put(self, key: str, endpoint: str, model: str, data_version: str, response: str,
+            ttl: float = LLM_CACHE_TTL_SECONDS):
+        now = datetime.now()
+        with engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO llm_responses
+                    (key, endpoint, model, data_version, response, size, hits, created_at, expires_at, last_used_at)
+                VALUES (:key, :endpoint, :model, :data_version, :response, :size, 0, :now, :expires_at, :now)
+                ON CONFLICT(key) DO UPDATE SET
+                    response = excluded.response,
+                    size = excluded.size,
+                    created_at = excluded.created_at,
+                    expires_at = excluded.expires_at,
+                    last_used_at = excluded.last_used_at
+            """), {
+                "key": key, "endpoint": endpoint, "model": model, "data_version": data_version,
+                "response": response, "size": len(response.encode("utf-8")), "now": now,
+                "expires_at": now + timedelta(seconds=ttl) if ttl else None,
+            })
+            self._flush_touched(conn)
+        self._count(endpoint, "stores")
+        if time.monotonic() - self._last_evicted >= self.evict_interval:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then the least recently used until the size limit holds"""
+        self._last_evicted = time.monotonic()
+        with engine.begin() as conn:
+            self._flush_touched(conn)
+            expired = conn.execute(
+                text("DELETE FROM llm_responses WHERE expires_at < :now"), {"now": datetime.now()}
+            ).rowcount
+            total = conn.execute(text("SELECT COALESCE(SUM(size), 0) FROM llm_responses")).scalar()
+            evicted = 0
+            if total > self.max_bytes:
+                # Walk entries from the least recently used, summing until enough is freed
+                rows = conn.execute(text("SELECT key, size FROM llm_responses ORDER BY last_used_at")).fetchall()
+                keys = []
+                for row in rows:
+                    if total <= self.max_bytes:
+                        break
+                    keys.append({"key": row.key})
+                    total -= row.size
+                conn.execute(text("DELETE FROM llm_responses WHERE key = :key"), keys)
+                evicted = len(keys)
+        with self._lock:
+            self.expirations += max(expired, 0)
+            self.evictions += evicted
+
+    def clear(self):
+        with self._lock:
+            self._touched.clear()
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM llm_responses"))
+
+    def stats(self) -> dict:
+        with read_engine.connect() as conn:
+            row = conn.execute(text(
+                "SELECT COUNT(*) AS entries, COALESCE(SUM(size), 0) AS size, COALESCE(SUM(hits), 0) AS hits FROM llm_responses"
+            )).fetchone()
+        with self._lock:
+            endpoints = {}
+            for endpoint, counters in self._counters.items():
+                lookups = counters["hits"] + counters["misses"]
+                endpoints[endpoint] = {
+                    **counters,
+                    "hit_rate": round(counters["hits"] / lookups, 3) if lookups else 0.0,
+                }
+            hits = sum(c["hits"] for c in self._counters.values())
+            lookups = hits + sum(c["misses"] for c in self._counters.values())
+            return {
+                "entries": row.entries,
+                "size_bytes": row.size,
+                "max_bytes": self.max_bytes,
+                "stored_hits": row.hits,  # Across all workers since each entry was stored, as of the last flush
+                "pending_hits": sum(hits for hits, _ in self._touched.values()),
+                "hits": hits,
+                "misses": lookups - hits,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "endpoints": endpoints,
+            }
+
+
+_cache = LLMResponseCache()
+
+
+def get_llm_cache() -> LLMResponseCache:
+    """Get the process-wide LLM response cache"""
+    return _cache
+
+
+async def cached_chat(endpoint: str, prompt: str, scopes=(), ttl: float = LLM_CACHE_TTL_SECONDS,
+                      cacheable=None, **chat_kwargs) -> str:
+    """
+    LLMClient.chat through the persistent response cache.
+
+    Args:
+        endpoint: Name the entries and hit rates are grouped under
+        prompt: The user message
+        scopes: Data scopes the prompt was built from; a new version of any
+            of them makes the stored response unreachable
+        ttl: Seconds a stored response stays valid
+        cacheable: Optional check of the reply; replies it rejects are returned but not stored
+        chat_kwargs: Passed on to LLMClient.chat (model, temperature, max_tokens, ...)
+
+    Returns:
+        str: The reply text
+    """
+    model = chat_kwargs.get("model") or LLM_MODEL
+    params = {name: value for name, value in chat_kwargs.items() if name not in ("model", "timeout")}
+    data_version = json.dumps(dict(zip(scopes, get_data_version(*scopes)))) if scopes else "{}"
+    key = response_key(endpoint, model, prompt, data_version, params)
+
+    # The cache queries run in a thread so they never hold up the event loop
+    reply = await asyncio.to_thread(_cache.get, key, endpoint)
+    if reply is not None:
+        return reply
+    reply = await get_llm_client().chat(prompt, **chat_kwargs)
+    if reply and (cacheable is None or cacheable(reply)):
+        await asyncio.to_thread(_cache.put, key, endpoint, model, data_version, reply, ttl)
+    return reply
@@ -0,0 +1,209 @@
+"""
+Async OpenAI client shared by every endpoint.
+
+All LLM calls go through one AsyncOpenAI client on one pooled httpx
+connection pool, so they never block the event loop and reuse warm
+connections. Each call has its own timeout, and a process-wide semaphore
+caps the number of calls in flight so a traffic spike queues here instead
+of piling up on the API.
+"""
+import asyncio
+import os
+import time
+import httpx
+from openai import AsyncOpenAI, APITimeoutError
+
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+LLM_IMAGE_MODEL = os.getenv("LLM_IMAGE_MODEL", "dall-e-3")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 16))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 32))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", 30))
+LLM_IMAGE_TIMEOUT_SECONDS = float(os.getenv("LLM_IMAGE_TIMEOUT_SECONDS", 120))
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", 5))
+
+
+class LLMClient:
+    """
+    Async chat and image calls with a shared connection pool, per-call
+    timeouts and a global concurrency limit.
+
+    The underlying clients are created on first use, so the API key can be
+    loaded from .env after this module is imported.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client = None
+        self._http = None
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.in_flight = 0
+        self.waiting = 0
+        self.total_seconds = 0.0
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        if self._client is None:
+            self._http = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_CONNECTIONS
+                ),
+                timeout=httpx.Timeout(LLM_TIMEOUT_SECONDS, connect=LLM_CONNECT_TIMEOUT_SECONDS)
+            )
+            self._client = AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                http_client=self._http,
+                max_retries=LLM_MAX_RETRIES
+            )
+        return self._client
+
+    async def _call(self, create, **kwargs):
+        """Run one API call under the concurrency limit and record its outcome"""
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.calls += 1
+        started = time.perf_counter()
+        try:
+            return await create(**kwargs)
+        except (APITimeoutError, asyncio.TimeoutError):
+            self.timeouts += 1
+            self.errors += 1
+            raise
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.total_seconds += time.perf_counter() - started
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    async def chat(self, prompt: str, model: str = None, temperature: float = 0.7, max_tokens: int = None,
+                   response_format: dict = None, timeout: float = LLM_TIMEOUT_SECONDS) -> str:
+        """
+        Send one user message and return the reply text.
+
+        Args:
+            prompt: The user message
+            model: Chat model, defaults to LLM_MODEL
+            temperature: Sampling temperature
+            max_tokens: Reply token limit
+            response_format: e.g. {"type": "json_object"}
+            timeout: Seconds before the call is abandoned
+        """
+        kwargs = {
+            "model": model or LLM_MODEL,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": temperature,
+            "timeout": timeout,
+        }
+        if max_tokens is not None:
+            kwargs["max_tokens"] = max_tokens
+        if response_format is not None:
+            kwargs["response_format"] = response_format
+        response = await self._call(self.client.chat.completions.create, **kwargs)
+        return response.choices[0].message.content
+
+    async def stream_chat(self, prompt: str, model: str = None, temperature: float = 0.7, max_tokens: int = None,
+                          timeout: float = LLM_TIMEOUT_SECONDS):
+        """
+        Send one user message and yield the reply text piece by piece as it arrives.
+
+        The call holds its concurrency slot until the stream ends. Closing the
+        generator early (e.g. when the client disconnects) closes the upstream
+        response, so the API stops generating.
+        """
+        kwargs = {
+            "model": model or LLM_MODEL,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": temperature,
+            "timeout": timeout,
+            "stream": True,
+        }
+        if max_tokens is not None:
+            kwargs["max_tokens"] = max_tokens
+
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.calls += 1
+        started = time.perf_counter()
+        stream = None
+        try:
+            stream = await self.client.chat.completions.create(**kwargs)
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except (APITimeoutError, asyncio.TimeoutError):
+            self.timeouts += 1
+            self.errors += 1
+            raise
+        except (GeneratorExit, asyncio.CancelledError):
+            self.cancelled += 1
+            raise
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            if stream is not None:
+                await stream.close()
+            self.total_seconds += time.perf_counter() - started
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    async def image(self, prompt: str, size: str = "1024x1024", model: str = None,
+                    timeout: float = LLM_IMAGE_TIMEOUT_SECONDS):
+        """
+        Generate one image.
+
+        Returns:
+            tuple: (base64 image data, image URL or None)
+        """
+        response = await self._call(
+            self.client.images.generate,
+            model=model or LLM_IMAGE_MODEL,
+            prompt=prompt,
+            size=size,
+            quality="standard",
+            n=1,
+            response_format="b64_json",
+            timeout=timeout
+        )
+        image = response.data[0]
+        return image.b64_json, getattr(image, "url", None)
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+        self._client = self._http = None
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "cancelled": self.cancelled,
+            "avg_seconds": round(self.total_seconds / self.calls, 3) if self.calls else 0.0,
+        }
+
+
+_client = LLMClient()
+
+
+def get_llm_client() -> LLMClient:
+    """Get the process-wide LLM client"""
+    return _client
@@ -1,38 +1,77 @@
-from fastapi import FastAPI, Depends
-from pydantic import BaseModel
+from fastapi import FastAPI, Depends, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
 from dotenv import load_dotenv
 import os
 import json
 from datetime import datetime
-from openai import OpenAI
 from sqlalchemy.orm import Session
-from functools import lru_cache
 import asyncio
 from typing import List
 import base64
 from insights import get_category_distribution
 
 # Import our modules
-from rag import get_merchant_summary
+from rag import get_merchant_summary, get_summary_sections, fit_summary, summary_token_budget
+from retrieval import retrieve_summary_context
 from forecast import load_merchant_sales_series, forecast_sales, forecast_to_summary
 from ingredient import load_all_ingredients, predict_stock_and_restock
-from database import get_db, import_csv_to_db, Ingredient
+from database import get_db, import_csv_to_db, import_parquet_snapshot, export_parquet_snapshot, get_pool_stats, bump_data_version, Ingredient
+from cache import get_cache_stats
 from sales import get_merchant_today_summary, get_merchant_period_summary
 from item_service import get_items_by_merchant, get_frequently_bought_together, get_merchant_name_by_id
 from sales_trends import get_sales_trend
 from top_items import get_top_selling_items, get_best_seller
+from item_funnel import get_item_funnel, recommend_items
+from transaction_store import get_transaction_store
+from merchant_profiles import get_profile_refresher
+from llm_client import get_llm_client
+from llm_cache import cached_chat, get_llm_cache
+from precompute import get_precomputer
+from singleflight import singleflight, get_singleflight_stats
 
 
 # Load API key from .env
 load_dotenv()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-# Create OpenAI client
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Shared async OpenAI client (connection pool, timeouts, concurrency limit)
+llm = get_llm_client()
+
+# Background refresh of the LLM-backed results (stale-while-revalidate)
+precomputer = get_precomputer()
+
+# Seconds a forecast request waits for the model fit
+FORECAST_TIMEOUT_SECONDS = float(os.getenv("FORECAST_TIMEOUT_SECONDS", 60))
+
+# Data scopes the merchant summaries and sales figures in the prompts are built from
+SUMMARY_SCOPES = ("transactions", "catalog", "keywords", "merchants")
+
+def is_json_reply(content: str) -> bool:
+    """Only JSON replies that parse are stored in the LLM response cache"""
+    try:
+        json.loads(content)
+        return True
+    except ValueError:
+        return False
 
 # Create FastAPI app
 app = FastAPI()
 
+@app.on_event("startup")
+def refresh_stale_profiles():
+    """Bring merchant profiles up to date with data imported while the server was down"""
+    get_profile_refresher().request()
+
+@app.on_event("startup")
+async def start_precomputer():
+    """Start the workers that refresh advice, insights and bundles in the background"""
+    precomputer.start()
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    await precomputer.stop()
+    await llm.aclose()
+
 # Define input model
 class ChatRequest(BaseModel):
     merchant_id: str
@@ -55,16 +94,11 @@ class ImageRequest(BaseModel):
     size: str = "1024x1024"
 
 
-@lru_cache(maxsize=100)
-def get_cached_merchant_summary(merchant_id: str) -> str:
-    return get_merchant_summary(merchant_id)
-    
-@lru_cache(maxsize=20)
-def get_cached_bundle_suggestions(merchant_id: str):
-    """Cache bundle suggestions to avoid repeated API calls and generation"""
+async def get_cached_bundle_suggestions(merchant_id: str):
+    """Bundle suggestions of a merchant; the precomputer stores and coalesces them"""
     try:
         # Get frequently bought together items and generate bundle suggestions
-        result = generate_bundle_suggestions(merchant_id)
+        result = await generate_bundle_suggestions(merchant_id)
         return result
     except Exception as e:
         print(f"Error in cache function for bundle suggestions: {str(e)}")
@@ -73,10 +107,12 @@ def get_cached_bundle_suggestions(merchant_id: str):
             "message": f"Failed to cache bundle suggestions: {str(e)}"
         }
 
+precomputer.register("bundles", ("transactions", "catalog"), get_cached_bundle_suggestions)
+
 @app.get("/merchant/{merchant_id}/bundle-suggestions")
 async def get_bundle_suggestions(merchant_id: str):
-    """Get cached bundle promotion suggestions"""
-    return get_cached_bundle_suggestions(merchant_id)
+    """Get precomputed bundle promotion suggestions"""
+    return await precomputer.get("bundles", merchant_id)
 
 @app.get("/merchant/{merchant_id}/category-distribution")
 async def merchant_category_distribution(merchant_id: str):
@@ -84,7 +120,7 @@ async def merchant_category_distribution(merchant_id: str):
     result = get_category_distribution(merchant_id)
     return result
 
-def generate_bundle_suggestions(merchant_id: str):
+async def generate_bundle_suggestions(merchant_id: str):
     """Generate bundle promotion suggestions based on frequently bought together items"""
     try:
         # Get frequently bought together items
@@ -158,15 +194,12 @@ def generate_bundle_suggestions(merchant_id: str):
         """
         
         # Call OpenAI API
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            response_format={"type": "json_object"}
+        result_content = await cached_chat(
+            "bundles", prompt, scopes=("transactions", "catalog"),
+            cacheable=is_json_reply, response_format={"type": "json_object"}
         )
         
         # Parse the response
-        result_content = response.choices[0].message.content
         result_json = json.loads(result_content)
         
         # Extract suggestions
@@ -210,19 +243,8 @@ def generate_bundle_suggestions(merchant_id: str):
 async def generate_image(request: ImageRequest):
     """Generate an image using OpenAI DALL-E 3"""
     try:
-        # Call OpenAI's DALL-E API to generate the image
-        response = client.images.generate(
-            model="dall-e-3",  # Use DALL-E 3 model
-            prompt=request.prompt,
-            size=request.size,
-            quality="standard",
-            n=1,  # Generate 1 image
-            response_format="b64_json"  # Get base64 encoded image
-        )
-        
-        # Extract the base64 image data
-        image_data = response.data[0].b64_json
-        image_url = response.data[0].url if hasattr(response.data[0], 'url') else None
+        # Call OpenAI's DALL-E API to generate the image (base64 encoded)
+        image_data, image_url = await llm.image(request.prompt, request.size)
         
         # Return both base64 and URL (if available)
         return {
@@ -248,11 +270,16 @@ async def get_merchant_name(merchant_id : str):
         return {"merchant_id": merchant_id, "name": "Unknown", "error": str(e)}
 
 
+@singleflight("merchant_summary")
+async def load_merchant_summary(merchant_id: str) -> str:
+    """Render a merchant summary off the event loop; concurrent requests share one rendering"""
+    return await asyncio.to_thread(get_merchant_summary, merchant_id)
+
 @app.get("/merchant/{merchant_id}/summary")
 async def get_merchant_summary_endpoint(merchant_id: str):
     """Get cached merchant summary for a specific merchant"""
     try:
-        summary = get_cached_merchant_summary(merchant_id)
+        summary = await load_merchant_summary(merchant_id)
         return {
             "merchant_id": merchant_id,
             "summary": summary,
@@ -266,15 +293,14 @@ async def get_merchant_summary_endpoint(merchant_id: str):
         }
     
 # POST endpoint
-@app.post("/ask")
-async def ask_advice(request: ChatRequest, db: Session = Depends(get_db)):
-    
-    # Step 1: Get summary for merchant
-    summary = get_cached_merchant_summary(request.merchant_id)
-    print("Summary:", summary)
-
-    # Step 2: Build prompt
-    prompt = f"""
+async def build_ask_prompt(request: ChatRequest) -> str:
+    """Prompt answering a merchant's question from the relevant summary sections"""
+    # Get summary for merchant, keeping only the sections relevant to the question
+    summary = await load_merchant_summary(request.merchant_id)
+    context = retrieve_summary_context(summary, request.question)
+    print("Context:", context)
+
+    return f"""
     Answer the question based on the question language.
 
     You are a helpful assistant for Southeast Asian food merchants.
@@ -283,31 +309,92 @@ async def ask_advice(request: ChatRequest, db: Session = Depends(get_db)):
 
 Be friendly, practical, and concise.
 
-{summary} 
+{context} 
 
 Question: {request.question}
 
 Suggestions:
 """
 
-    # Step 3: Send to OpenAI
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.7
+def sse_event(data: dict, event: str = None) -> str:
+    """Format one server-sent event"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+def stream_reply(http_request: Request, prompt: str) -> StreamingResponse:
+    """
+    Stream the LLM's reply to prompt as server-sent events.
+
+    Each piece of text is sent as data: {"delta": ...} as soon as it arrives,
+    followed by a "done" event (or an "error" event). If the client goes away
+    the upstream completion is closed instead of being read to the end.
+    """
+    async def events():
+        chunks = llm.stream_chat(prompt)
+        try:
+            async for delta in chunks:
+                if await http_request.is_disconnected():
+                    print("Client disconnected, closing the LLM stream")
+                    break
+                yield sse_event({"delta": delta})
+            else:
+                yield sse_event({}, "done")
+        except Exception as e:
+            print(f"Error streaming reply: {str(e)}")
+            yield sse_event({"error": str(e)}, "error")
+        finally:
+            await chunks.aclose()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
+@app.post("/ask")
+async def ask_advice(request: ChatRequest, db: Session = Depends(get_db)):
+    
+    # Step 1 and 2: Get the relevant summary and build prompt
+    prompt = await build_ask_prompt(request)
+
+    # Step 3: Send to OpenAI
+    reply = await llm.chat(prompt)
+
     # Step 4: Return LLM's response
     return {
-        "reply": response.choices[0].message.content
+        "reply": reply
     }
 
+@app.post("/ask/stream")
+async def ask_advice_stream(request: ChatRequest, http_request: Request):
+    """Same as /ask, but the reply is streamed as server-sent events"""
+    return stream_reply(http_request, await build_ask_prompt(request))
+
+# Summary sections the advice draws on, most important first
+ADVICE_SECTIONS = ["sales", "loyalty", "products", "basket", "scale", "delivery", "city", "location", "timing"]
+
 # POST endpoint
 @app.post("/advice")
 async def personalized_advice(request: AdviceRequest, db: Session = Depends(get_db)):
+    """Last good advice for the merchant at once, refreshed in the background when the data changed"""
+    return await precomputer.get("advice", request.merchant_id)
 
-    # Step 1: Get summary for merchant
-    summary =  get_cached_merchant_summary(request.merchant_id)
+async def compute_advice(merchant_id: str) -> dict:
+    """Personalized advice for a merchant, or an error result the precomputer does not store"""
+    try:
+        return await generate_advice(merchant_id)
+    except Exception as e:
+        print(f"Error generating advice: {str(e)}")
+        return {
+            "status": "error",
+            "message": f"Failed to generate advice: {str(e)}"
+        }
+
+async def generate_advice(merchant_id: str) -> dict:
+    """Generate personalized advice for a merchant"""
+
+    # Step 1: Get summary for merchant, limited to the sections the advice draws on
+    summary = await asyncio.to_thread(get_merchant_summary, merchant_id, ADVICE_SECTIONS, summary_token_budget("advice"))
     print("Summary:", summary)
 
     # Step 2: Build prompt
@@ -353,42 +440,45 @@ async def personalized_advice(request: AdviceRequest, db: Session = Depends(get_
     {summary}
     """
 
-    # Step 3: Send to OpenAI
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.7
-    )
+    # Step 3: Send to OpenAI, unless the same prompt was answered for the current data
+    content = await cached_chat("advice", prompt, scopes=SUMMARY_SCOPES, cacheable=is_json_reply)
 
     # Step 4: Return LLM's response
-
-    content = response.choices[0].message.content
     advice_list = json.loads(content)["advice"]
     return {
         "advice": advice_list
     }
 
+precomputer.register("advice", SUMMARY_SCOPES, compute_advice)
 
-@app.get("/forecast/{merchant_id}")
-async def get_forecast(merchant_id: str, days: int = 7, db: Session = Depends(get_db)):
-    try:
-        # Load merchant sales data
-        df = load_merchant_sales_series(merchant_id)
-        if df.empty:
-            return {"error": "No sales data available for this merchant."}
 
-        # Run forecasting
-        forecast_df = forecast_sales(df, periods=days)
-        summary = forecast_to_summary(forecast_df)
+def build_forecast(merchant_id: str, days: int) -> dict:
+    # Load merchant sales data
+    df = load_merchant_sales_series(merchant_id)
+    if df.empty:
+        return {"error": "No sales data available for this merchant."}
 
-        # Return forecast values + summary
-        return {
-            "merchant_id": merchant_id,
-            "days": days,
-            "forecast": forecast_df.to_dict(orient="records"),
-            "summary": summary
-        }
+    # Run forecasting
+    forecast_df = forecast_sales(df, periods=days)
+    summary = forecast_to_summary(forecast_df)
+
+    # Return forecast values + summary
+    return {
+        "merchant_id": merchant_id,
+        "days": days,
+        "forecast": forecast_df.to_dict(orient="records"),
+        "summary": summary
+    }
+
+@singleflight("forecast", timeout=FORECAST_TIMEOUT_SECONDS)
+async def run_forecast(merchant_id: str, days: int) -> dict:
+    """Fit the forecast in a worker thread; concurrent requests for it share one fit"""
+    return await asyncio.to_thread(build_forecast, merchant_id, days)
 
+@app.get("/forecast/{merchant_id}")
+async def get_forecast(merchant_id: str, days: int = 7, db: Session = Depends(get_db)):
+    try:
+        return await run_forecast(merchant_id, days)
     except Exception as e:
         return {"error": str(e)}
     
@@ -396,25 +486,74 @@ async def get_forecast(merchant_id: str, days: int = 7, db: Session = Depends(ge
 async def ask_advice(request: PromptRequest):
     prompt = f"""{request.prompt}"""
 
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.7
-    )
-
     return {
-        "reply": response.choices[0].message.content
+        "reply": await llm.chat(prompt)
     }
 
+@app.post("/generate-content/stream")
+async def generate_content_stream(request: PromptRequest, http_request: Request):
+    """Same as /generate-content, but the reply is streamed as server-sent events"""
+    return stream_reply(http_request, f"""{request.prompt}""")
+
 @app.post("/initialize-db")
-async def initialize_database():
-    """Initialize the database by importing CSV files"""
+async def initialize_database(full_refresh: bool = False, from_snapshot: bool = False):
+    """
+    Import new CSV rows into the database (or everything again with full_refresh).
+    With from_snapshot the tables are reloaded from the Parquet snapshot instead.
+    """
+    try:
+        # The import runs in a worker thread so reads keep being served meanwhile
+        if from_snapshot:
+            stats = await asyncio.to_thread(import_parquet_snapshot)
+        else:
+            stats = await asyncio.to_thread(import_csv_to_db, full_refresh=full_refresh)
+        get_transaction_store().invalidate()
+        # Recompute the merchant profiles the import made stale
+        get_profile_refresher().request()
+        precomputer.refresh_active()
+        return {"message": "Database initialized successfully", "tables": stats}
+    except Exception as e:
+        return {"error": str(e)}
+    
+@app.post("/db/snapshot")
+async def create_snapshot():
+    """Export the database to a Parquet snapshot partitioned by merchant and month"""
     try:
-        import_csv_to_db()
-        return {"message": "Database initialized successfully"}
+        tables = await asyncio.to_thread(export_parquet_snapshot)
+        return {"message": "Snapshot created successfully", "tables": tables}
     except Exception as e:
         return {"error": str(e)}
     
+@app.get("/db/stats")
+async def database_stats():
+    """Connection pool and busy-wait statistics of the database engines"""
+    return get_pool_stats()
+    
+@app.get("/llm/stats")
+async def llm_stats():
+    """Concurrency and outcome counters of the shared LLM client"""
+    return llm.stats()
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Size, hit/miss and eviction counters of every result cache"""
+    return get_cache_stats()
+
+@app.get("/singleflight/stats")
+async def singleflight_stats():
+    """Calls, executions and coalesced callers of every single-flight group"""
+    return get_singleflight_stats()
+
+@app.get("/precompute/stats")
+async def precompute_stats():
+    """Queue, worker and freshness counters of the precompute scheduler"""
+    return precomputer.stats()
+
+@app.get("/llm/cache/stats")
+async def llm_cache_stats():
+    """Entries, size, hit rates and evictions of the persistent LLM response cache"""
+    return get_llm_cache().stats()
+    
 @app.get("/ingredients")
 async def get_ingredients(db: Session = Depends(get_db)):
     try:
@@ -434,8 +573,10 @@ class InventoryUpdateRequest(BaseModel):
     stock_left: int
     last_restock: str
 
+# Plain def: FastAPI runs it in its threadpool, so waiting for the writer
+# connection does not hold up the event loop
 @app.patch("/ingredients/{ingredient_id}")
-async def update_ingredient(ingredient_id: int, update_data: InventoryUpdateRequest, db: Session = Depends(get_db)):
+def update_ingredient(ingredient_id: int, update_data: InventoryUpdateRequest, db: Session = Depends(get_db)):
     """Update an ingredient's stock level and restock date"""
     try:
         # Get the ingredient from the database
@@ -453,6 +594,7 @@ async def update_ingredient(ingredient_id: int, update_data: InventoryUpdateRequ
         
         # Commit the changes
         db.commit()
+        bump_data_version("ingredients")
         
         return {
             "status": "success",
@@ -492,99 +634,170 @@ async def get_merchant_sales_trend(merchant_id: str, period: str):
     return get_sales_trend(merchant_id, period)
 
   
-@app.get("/insights/{merchant_id}/{period}")
-async def get_insights(merchant_id: str, period: str, db: Session = Depends(get_db)):
-    """Generate AI-powered insights specific to a time period"""
-    
-    if period not in ["daily", "weekly", "monthly"]:
-        return {"error": "Period must be 'daily', 'weekly', or 'monthly'"}
-    
+# Summary sections behind each insight prompt, most important first
+INSIGHT_SECTIONS = {
+    "time": ["timing", "sales", "scale"],
+    "menu": ["products", "basket", "loyalty"],
+    "opportunity": ["sales", "loyalty", "products", "city", "basket", "delivery"],
+}
+
+# What each insight is about: (subject, task, rule 3, rule 4)
+INSIGHT_INSTRUCTIONS = {
+    "time": (
+        "their business performance",
+        "give ONE clear insight about the merchant's best selling time",
+        "Contain one specific, data-backed observation",
+        "Include a clear action the merchant should take",
+    ),
+    "menu": (
+        "their menu performance",
+        "give ONE clear insight about the merchant's menu items",
+        "Refer to a specific menu item or category",
+        "Include a clear action the merchant should take",
+    ),
+    "opportunity": (
+        "a business opportunity",
+        "identify ONE clear business opportunity",
+        "Highlight one specific growth opportunity",
+        "Include a clear, actionable recommendation",
+    ),
+}
+
+# Response keys and card titles of the insights
+INSIGHT_CARDS = {
+    "time": ("best_selling_time", "Best Selling Time"),
+    "menu": ("menu_performance", "Menu Performance"),
+    "opportunity": ("opportunity", "Opportunity"),
+}
+
+# Ask for all three insights in one JSON request instead of one request each
+INSIGHTS_COMBINED = os.getenv("INSIGHTS_COMBINED", "1") != "0"
+
+class InsightSet(BaseModel):
+    """Schema of the combined insights response"""
+    best_selling_time: str = Field(min_length=1)
+    menu_performance: str = Field(min_length=1)
+    opportunity: str = Field(min_length=1)
+
+def is_insight_set(content: str) -> bool:
+    """Only combined replies matching the schema are stored in the LLM response cache"""
     try:
-        # Step 1: Get merchant summary and sales data for the period
-        summary = get_cached_merchant_summary(merchant_id)
-        
-        # Get period-specific data
-        if period == "daily":
-            sales_data = get_merchant_today_summary(merchant_id)
-        else:
-            sales_data = get_merchant_period_summary(merchant_id, period.replace("ly", ""))
-            
-        # Get trend data for the period
-        trend_data = get_sales_trend(merchant_id, period)
-        
-        # Convert json data to strings first to avoid backslash issues in f-strings
-        sales_data_json = json.dumps(sales_data)
-        trend_data_json = json.dumps(trend_data)
-        
-        # Build improved prompts specific to each insight type
-        time_prompt = f"""
-        You are providing a direct insight to a food merchant about their business performance.
+        InsightSet.model_validate_json(content)
+        return True
+    except ValidationError:
+        return False
+
+def build_insight_prompt(kind: str, period: str, sales_data_json: str, trend_data_json: str, summary: str) -> str:
+    """Prompt asking for a single insight of the given kind"""
+    subject, task, focus, action = INSIGHT_INSTRUCTIONS[kind]
+    return f"""
+        You are providing a direct insight to a food merchant about {subject}.
         This insight will be displayed in an app under the section key insight. The merchant will be able to see when he click in, keep it simple but meaningful!
-        Analyze this {period} sales data and give ONE clear insight about the merchant's best selling time.
+        Analyze this {period} sales data and {task}.
         
         Your response must:
         1. Speak directly to the merchant using "you" and "your", no need to mention about the name of merchant.
         2. Be extremely concise (15-25 words)
-        3. Contain one specific, data-backed observation
-        4. Include a clear action the merchant should take
+        3. {focus}
+        4. {action}
         
         Sales data: {sales_data_json}
         Trend data: {trend_data_json}
         Merchant summary: {summary}
         """
+
+def build_combined_insight_prompt(period: str, sales_data_json: str, trend_data_json: str, summary: str) -> str:
+    """Prompt asking for every insight at once, sharing the data between them"""
+    tasks = "\n".join(
+        f"        - \"{INSIGHT_CARDS[kind][0]}\": about {subject}; {task}. {focus}. {action}."
+        for kind, (subject, task, focus, action) in INSIGHT_INSTRUCTIONS.items()
+    )
+    return f"""
+        You are providing direct insights to a food merchant about their business.
+        These insights will be displayed in an app under the section key insight. The merchant will be able to see when he click in, keep it simple but meaningful!
+        Analyze this {period} sales data and write one insight for each of these keys:
+{tasks}
         
-        menu_prompt = f"""
-        You are providing a direct insight to a food merchant about their menu performance.
-        This insight will be displayed in an app under the section key insight. The merchant will be able to see when he click in, keep it simple but meaningful!
-        Analyze this {period} sales data and give ONE clear insight about the merchant's menu items.
-        
-        Your response must:
+        Every insight must:
         1. Speak directly to the merchant using "you" and "your", no need to mention about the name of merchant.
         2. Be extremely concise (15-25 words)
-        3. Refer to a specific menu item or category
-        4. Include a clear action the merchant should take
         
         Sales data: {sales_data_json}
         Trend data: {trend_data_json}
         Merchant summary: {summary}
-        """
         
-        opportunity_prompt = f"""
-        You are providing a direct insight to a food merchant about a business opportunity.
-        This insight will be displayed in an app under the section key insight. The merchant will be able to see when he click in, keep it simple but meaningful!
-        Analyze this {period} sales data and identify ONE clear business opportunity.
-        
-        Your response must:
-        1. Speak directly to the merchant using "you" and "your", no need to mention about the name of merchant.
-        2. Be extremely concise (15-25 words)
-        3. Highlight one specific growth opportunity
-        4. Include a clear, actionable recommendation
-        
-        Sales data: {sales_data_json}
-        Trend data: {trend_data_json}
-        Merchant summary: {summary}
+        Return only a JSON object of the form
+        {{"best_selling_time": "...", "menu_performance": "...", "opportunity": "..."}}
         """
+
+@app.get("/insights/{merchant_id}/{period}")
+async def get_insights(merchant_id: str, period: str, combined: bool = INSIGHTS_COMBINED, db: Session = Depends(get_db)):
+    """
+    Generate AI-powered insights specific to a time period
+
+    With combined (the default) the shared data is sent once and all insights
+    come back as one JSON object; if that response does not match the schema
+    each insight is requested separately. Insights of both modes are
+    precomputed: the last good ones are returned at once and refreshed in the
+    background when the data changed.
+    """
+    
+    if period not in ["daily", "weekly", "monthly"]:
+        return {"error": "Period must be 'daily', 'weekly', or 'monthly'"}
+    
+    # The mode is part of the job, stored as a string like every job argument
+    mode = "combined" if combined else "separate"
+    return await precomputer.get("insights", merchant_id, period, mode)
+
+def load_insight_data(merchant_id: str, period: str):
+    """
+    Summary sections, sales data and trend data the insights of a period are built from.
+
+    These are plain database queries, so the precompute workers run this in a thread.
+    """
+    sections = get_summary_sections(merchant_id, {name for names in INSIGHT_SECTIONS.values() for name in names})
+
+    # Get period-specific data
+    if period == "daily":
+        sales_data = get_merchant_today_summary(merchant_id)
+    else:
+        sales_data = get_merchant_period_summary(merchant_id, period.replace("ly", ""))
+
+    # Get trend data for the period
+    trend_data = get_sales_trend(merchant_id, period)
+    return sections, sales_data, trend_data
+
+async def compute_insights(merchant_id: str, period: str, mode: str = None) -> dict:
+    """
+    Generate the insight cards of a merchant for a period
+
+    Args:
+        merchant_id: Merchant to generate the insights for
+        period: daily, weekly or monthly
+        mode: "combined" or "separate", defaults to INSIGHTS_COMBINED
+
+    Returns:
+        dict: The insight cards, or {"error": ...} if any insight could not be generated
+    """
+    combined = INSIGHTS_COMBINED if mode is None else mode == "combined"
+    try:
+        # Step 1: Get the summary sections each insight needs and sales data for the period
+        sections, sales_data, trend_data = await asyncio.to_thread(load_insight_data, merchant_id, period)
+        budget = summary_token_budget("insights")
         
-        # Generate insights using OpenAI in parallel
-        responses = await asyncio.gather(
-            generate_insight(time_prompt),
-            generate_insight(menu_prompt),
-            generate_insight(opportunity_prompt)
-        )
+        # Convert json data to strings first to avoid backslash issues in f-strings
+        sales_data_json = json.dumps(sales_data)
+        trend_data_json = json.dumps(trend_data)
+        
+        descriptions = None
+        if combined:
+            descriptions = await generate_combined_insights(period, sales_data_json, trend_data_json, sections, budget)
+        if descriptions is None:
+            descriptions = await generate_separate_insights(period, sales_data_json, trend_data_json, sections, budget)
         
         return {
-            "best_selling_time": {
-                "title": "Best Selling Time",
-                "description": responses[0]
-            },
-            "menu_performance": {
-                "title": "Menu Performance",
-                "description": responses[1]
-            },
-            "opportunity": {
-                "title": "Opportunity",
-                "description": responses[2]
-            }
+            key: {"title": title, "description": descriptions[key]}
+            for key, title in INSIGHT_CARDS.values()
         }
         
     except Exception as e:
@@ -593,19 +806,58 @@ async def get_insights(merchant_id: str, period: str, db: Session = Depends(get_
             "error": f"Failed to generate insights: {str(e)}"
         }
 
-async def generate_insight(prompt: str) -> str:
-    """Generate a single insight using OpenAI"""
+precomputer.register("insights", SUMMARY_SCOPES, compute_insights)
+
+def insight_summary(sections, kinds, budget: int) -> str:
+    """Merchant summary covering the sections of the given insight kinds"""
+    if sections is None:
+        return "No data available for this merchant."
+    # Sections in the order of the insights' priorities, without repeats
+    priority = list(dict.fromkeys(name for kind in kinds for name in INSIGHT_SECTIONS[kind]))
+    return fit_summary(sections, priority, budget)
+
+async def generate_combined_insights(period: str, sales_data_json: str, trend_data_json: str, sections, budget: int):
+    """
+    Generate every insight with one JSON request.
+
+    Returns:
+        dict: {response key: description}, or None if the reply does not match InsightSet
+    """
+    summary = insight_summary(sections, list(INSIGHT_SECTIONS), budget)
+    prompt = build_combined_insight_prompt(period, sales_data_json, trend_data_json, summary)
     try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            max_tokens=100
+        content = await cached_chat(
+            "insights", prompt, scopes=SUMMARY_SCOPES, cacheable=is_insight_set,
+            max_tokens=400, response_format={"type": "json_object"}
         )
-        return response.choices[0].message.content.strip()
+        insights = InsightSet.model_validate_json(content)
     except Exception as e:
-        print(f"Error in generate_insight: {str(e)}")
-        return "Could not generate insight at this time."
+        print(f"Combined insights failed, requesting them separately: {str(e)}")
+        return None
+    return {key: value.strip() for key, value in insights.model_dump().items()}
+
+async def generate_separate_insights(period: str, sales_data_json: str, trend_data_json: str, sections, budget: int) -> dict:
+    """Generate each insight with its own request, in parallel"""
+    kinds = list(INSIGHT_INSTRUCTIONS)
+    responses = await asyncio.gather(*[
+        generate_insight(build_insight_prompt(
+            kind, period, sales_data_json, trend_data_json, insight_summary(sections, [kind], budget)
+        ))
+        for kind in kinds
+    ])
+    return {INSIGHT_CARDS[kind][0]: response for kind, response in zip(kinds, responses)}
+
+async def generate_insight(prompt: str) -> str:
+    """
+    Generate a single insight using OpenAI
+
+    Errors and empty replies raise, so a failed insight set is reported as an
+    error and the precomputer keeps the last good one.
+    """
+    reply = await cached_chat("insight", prompt, scopes=SUMMARY_SCOPES, max_tokens=100)
+    if not reply or not reply.strip():
+        raise ValueError("Empty insight reply")
+    return reply.strip()
 
 @app.get("/merchant-items/{merchant_id}", response_model=List[Item])
 async def get_merchant_items(merchant_id: str):
@@ -623,6 +875,16 @@ async def get_merchant_top_items(merchant_id: str):
 async def get_best_seller_item(merchant_id:str):
     return get_best_seller(merchant_id)
 
+@app.get("/merchant/{merchant_id}/item-funnel")
+async def get_merchant_item_funnel(merchant_id: str):
+    """Keyword views, purchases and conversion of the merchant's items"""
+    return get_item_funnel(merchant_id)
+
+@app.get("/items/recommend")
+async def recommend_items_for_keywords(q: str, merchant_id: str = None, limit: int = 5):
+    """Recommend items for search keywords, optionally from one merchant only"""
+    return recommend_items(q, merchant_id, limit)
+
 
 @app.get("/ingredients/predict")
 async def predict_ingredient_stock():
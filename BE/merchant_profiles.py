@@ -0,0 +1,561 @@
+"""
+Materialized merchant profiles.
+
+A profile holds every value the merchant summary shows (business scale,
+customer loyalty, sales, peak hours, products, basket, delivery), grouped by
+section and stored as JSON in the merchant_profiles table together with the
+data version of every section. A section depends on a few data scopes only,
+so an import recomputes just the sections whose scopes changed: new keyword
+rows refresh the products section and leave the others as they are. A
+background refresher recomputes the stale sections after each ingest and
+requests just read one row.
+
+Figures that depend on "today" (weekly revenue, maturity, average daily
+orders) are anchored on the merchant's latest sales day, like the trends,
+so a stored section stays correct until the merchant's data changes.
+"""
+import json
+import threading
+import pandas as pd
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from database import engine, query_to_dataframe, get_data_version, DATA_SCOPES
+from rollups import get_latest_sales_date
+from city_benchmarks import get_city_benchmark
+from analytics_engine import item_pair_counts
+from customer_analytics import customer_loyalty
+from item_funnel import low_conversion_items
+from singleflight import singleflight
+
+PROFILE_ROW_QUERY = """
+SELECT data_version, profile FROM merchant_profiles WHERE merchant_id = :merchant_id
+"""
+
+PROFILE_VERSIONS_QUERY = """
+SELECT merchant_id, data_version FROM merchant_profiles
+"""
+
+# Merchant-scoped queries behind the profile. Every query is restricted to
+# one merchant's rows (or one city's merchants) and does its grouping in SQL,
+# so computing a profile only reads that merchant's data.
+PROFILE_HAS_DATA_QUERY = """
+SELECT EXISTS (SELECT 1 FROM merchants WHERE merchant_id = :merchant_id)
+   AND EXISTS (SELECT 1 FROM transactions WHERE merchant_id = :merchant_id) AS has_data
+"""
+
+PROFILE_MERCHANT_QUERY = """
+SELECT merchant_name, join_date, city_id
+FROM merchants
+WHERE merchant_id = :merchant_id
+"""
+
+PROFILE_ORDER_STATS_QUERY = """
+SELECT
+    COUNT(*) AS tx_count,
+    SUM(order_value) AS total_revenue,
+    MIN(order_time) AS first_order_time,
+    SUM(CASE WHEN order_time >= :week_start THEN order_value ELSE 0 END) AS weekly_revenue,
+    AVG((julianday(delivery_time) - julianday(order_time)) * 1440) AS avg_delivery_mins
+FROM transactions
+WHERE merchant_id = :merchant_id
+"""
+
+PROFILE_PEAK_HOURS_QUERY = """
+SELECT CAST(strftime('%H', order_time) AS INTEGER) AS hour, COUNT(*) AS orders
+FROM transactions
+WHERE merchant_id = :merchant_id AND order_time IS NOT NULL
+GROUP BY hour
+ORDER BY orders DESC, hour
+LIMIT 2
+"""
+
+PROFILE_MENU_QUERY = """
+SELECT item_id, item_name, cuisine_tag
+FROM items
+WHERE merchant_id = :merchant_id
+ORDER BY id
+"""
+
+# Sales of every item in the merchant's orders, including items of other
+# merchants that ended up in the same orders
+PROFILE_ITEM_SALES_QUERY = """
+SELECT ti.item_id, COUNT(*) AS sold
+FROM transactions t
+JOIN transaction_items ti ON ti.order_id = t.order_id
+WHERE t.merchant_id = :merchant_id
+GROUP BY ti.item_id
+ORDER BY sold DESC, ti.item_id
+"""
+
+PROFILE_RETURNING_ITEMS_QUERY = """
+SELECT ti.item_id, COUNT(*) AS sold
+FROM transactions t
+JOIN transaction_items ti ON ti.order_id = t.order_id
+WHERE t.merchant_id = :merchant_id
+  AND t.eater_id IN (
+      SELECT eater_id FROM merchant_customers
+      WHERE merchant_id = :merchant_id AND orders > 1
+  )
+GROUP BY ti.item_id
+ORDER BY sold DESC, ti.item_id
+LIMIT 2
+"""
+
+PROFILE_BASKET_QUERY = """
+SELECT CAST(COUNT(*) AS FLOAT) / COUNT(DISTINCT ti.order_id) AS avg_basket_size
+FROM transactions t
+JOIN transaction_items ti ON ti.order_id = t.order_id
+JOIN items i ON i.item_id = ti.item_id AND i.merchant_id = :merchant_id
+WHERE t.merchant_id = :merchant_id
+"""
+
+def _item_names(item_ids) -> list:
+    """Look up item names for a few item IDs, in items table order"""
+    item_ids = list(item_ids)
+    if not item_ids:
+        return []
+    params = {f"item_{i}": item_id for i, item_id in enumerate(item_ids)}
+    placeholders = ", ".join(f":{name}" for name in params)
+    df = query_to_dataframe(
+        f"SELECT item_id, item_name FROM items WHERE item_id IN ({placeholders}) ORDER BY id", params
+    )
+    return df["item_name"].tolist()
+
+def _nan_if_none(value):
+    return float("nan") if value is None else value
+
+
+def current_section_versions() -> dict:
+    """Current data version of every profile section, as stored with the profile"""
+    versions = dict(zip(DATA_SCOPES, get_data_version()))
+    return {
+        section: json.dumps([versions[scope] for scope in scopes])
+        for section, (scopes, _) in PROFILE_SECTIONS.items()
+    }
+
+def current_profile_version() -> str:
+    return json.dumps(current_section_versions())
+
+def _stored_section_versions(data_version: str) -> dict:
+    # Rows written before sections were versioned hold one version list for
+    # the whole profile; those are treated as stale
+    try:
+        versions = json.loads(data_version)
+    except (TypeError, ValueError):
+        return {}
+    return versions if isinstance(versions, dict) else {}
+
+# Base figures in each group _ProfileInputs loads with one query
+MERCHANT_FIELDS = ("merchant_name", "join_date", "city_id")
+ORDER_STATS_FIELDS = ("tx_count", "total_revenue", "first_order_time", "weekly_revenue", "avg_delivery_mins")
+
+def load_profile_base(merchant_id: str):
+    """
+    Load the merchant-level figures of a profile: merchant info, latest
+    sales day, order totals, customer loyalty and peak hours.
+    
+    Returns:
+        dict: Base figures, or None if the merchant does not exist or has no transactions
+    """
+    inputs = _ProfileInputs(merchant_id)
+    if inputs.merchant is None or int(inputs.order_stats["tx_count"]) == 0:
+        return None
+    return {
+        **inputs.merchant,
+        "latest_date": inputs.latest_date,
+        **inputs.order_stats,
+        "customers": inputs.customers,
+        "peak_hours": inputs.peak_hours,
+    }
+
+class _ProfileInputs:
+    """
+    Query results behind one profile computation. Each group of figures is
+    loaded the first time a section needs it, so recomputing a few sections
+    only runs their queries: the merchant section reads the merchants row and
+    the watermark without scanning the merchant's transactions.
+    
+    A base from load_profile_base or the batch pass supplies every group up front.
+    """
+    
+    def __init__(self, merchant_id: str, base: dict = None):
+        self.merchant_id = merchant_id
+        self.params = {"merchant_id": merchant_id}
+        self._base = dict(base) if base else {}
+        self._frames = {}
+    
+    def _figure(self, name: str, load):
+        """A base figure, loading its group with load() the first time"""
+        if name not in self._base:
+            self._base.update(load())
+        return self._base[name]
+    
+    def frame(self, query: str) -> pd.DataFrame:
+        if query not in self._frames:
+            self._frames[query] = query_to_dataframe(query, self.params)
+        return self._frames[query]
+    
+    @property
+    def menu(self) -> pd.DataFrame:
+        return self.frame(PROFILE_MENU_QUERY)
+    
+    @property
+    def merchant(self) -> dict:
+        """merchant_name, join_date and city_id, or None if the merchant does not exist"""
+        if self._figure("merchant_name", self._load_merchant) is None:
+            return None
+        return {name: self._base[name] for name in MERCHANT_FIELDS}
+    
+    def _load_merchant(self) -> dict:
+        merchant_df = query_to_dataframe(PROFILE_MERCHANT_QUERY, self.params)
+        if merchant_df.empty:
+            return dict.fromkeys(MERCHANT_FIELDS)
+        merchant = merchant_df.iloc[0][["merchant_name", "join_date"]].to_dict()
+        merchant["city_id"] = merchant_df["city_id"].tolist()[0]  # Native Python value so it can be bound as a parameter
+        return merchant
+    
+    @property
+    def latest_date(self) -> str:
+        """The merchant's latest sales day from the watermark, as YYYY-MM-DD"""
+        def load():
+            latest_date = get_latest_sales_date(self.merchant_id)
+            return {"latest_date": str(latest_date) if latest_date else None}
+        return self._figure("latest_date", load)
+    
+    @property
+    def order_stats(self) -> dict:
+        """Order count, revenue, first order time, weekly revenue and delivery time"""
+        def load():
+            # The last 7 days end on the merchant's latest sales day, as in the sales summary
+            latest_date = self.latest_date
+            week_start = str(pd.to_datetime(latest_date).date() - timedelta(days=6)) if latest_date else None
+            return query_to_dataframe(PROFILE_ORDER_STATS_QUERY, {
+                "merchant_id": self.merchant_id, "week_start": week_start
+            }).iloc[0].to_dict()
+        self._figure("tx_count", load)
+        return {name: self._base[name] for name in ORDER_STATS_FIELDS}
+    
+    @property
+    def customers(self) -> dict:
+        return self._figure("customers", lambda: {"customers": customer_loyalty(self.merchant_id)})
+    
+    @property
+    def peak_hours(self) -> list:
+        def load():
+            peak = query_to_dataframe(PROFILE_PEAK_HOURS_QUERY, self.params)
+            return {"peak_hours": peak["hour"].tolist()}
+        return self._figure("peak_hours", load)
+
+def _anchor(latest_date: str) -> pd.Timestamp:
+    """End of the merchant's latest sales day, which stands in for "now" in the profile"""
+    return pd.to_datetime(latest_date) + timedelta(days=1)
+
+def _merchant_section(inputs: _ProfileInputs) -> dict:
+    merchant = inputs.merchant
+    join_date = pd.to_datetime(merchant["join_date"], format="%d%m%Y", errors="coerce")
+    business_duration = (_anchor(inputs.latest_date) - join_date).days // 30  # in months
+    business_years = business_duration / 12  # Convert months to years
+
+    if business_years < 2:
+        maturity = f"Established (1-2 years)"
+    elif business_years < 5:
+        maturity = f"Maturing ({business_years:.1f} years)"
+    elif business_years < 10:
+        maturity = f"Seasoned (5-10 years)"
+    else:
+        maturity = f"Veteran (10+ years)"
+    
+    return {
+        "merchant_id": inputs.merchant_id,
+        "merchant_name": str(merchant["merchant_name"]),
+        "city_id": merchant["city_id"],
+        "maturity": maturity,
+    }
+
+def _scale_section(inputs: _ProfileInputs) -> dict:
+    order_stats = inputs.order_stats
+    tx_count = int(order_stats["tx_count"])
+    first_order_time = pd.to_datetime(order_stats["first_order_time"])
+    avg_daily_orders = tx_count / ((_anchor(inputs.latest_date) - first_order_time).days or 1)
+    
+    if tx_count < 500 or avg_daily_orders < 5:
+        business_scale = "Small (Street vendor/Family shop)"
+    elif tx_count < 5000 or avg_daily_orders < 50:
+        business_scale = "Medium (Full restaurant)"
+    else:
+        business_scale = "Large (Chain/Multi-location)"
+    
+    return {
+        "business_scale": business_scale,
+        "tx_count": tx_count,
+        "avg_daily_orders": float(avg_daily_orders),
+        "item_variety": len(inputs.menu),
+    }
+
+def _customers_section(inputs: _ProfileInputs) -> dict:
+    returning_items = inputs.frame(PROFILE_RETURNING_ITEMS_QUERY)
+    return {
+        **inputs.customers,
+        "top_returning_items": _item_names(returning_items["item_id"]),
+    }
+
+def _sales_section(inputs: _ProfileInputs) -> dict:
+    order_stats = inputs.order_stats
+    tx_count = int(order_stats["tx_count"])
+    total_revenue = float(order_stats["total_revenue"])
+    benchmark = get_city_benchmark(inputs.merchant["city_id"])
+    city_avg_order_value = benchmark["avg_order_value"] if benchmark else None
+    return {
+        "total_revenue": total_revenue,
+        "weekly_revenue": float(order_stats["weekly_revenue"]),
+        "total_orders": tx_count,
+        "avg_order_value": total_revenue / tx_count,
+        "city_avg_order_value": _nan_if_none(city_avg_order_value),
+    }
+
+def _timing_section(inputs: _ProfileInputs) -> dict:
+    peak_hours = inputs.peak_hours
+    return {
+        "peak_range": f"{min(peak_hours)}:00–{max(peak_hours)+1}:00",
+    }
+
+def _products_section(inputs: _ProfileInputs) -> dict:
+    df_menu = inputs.menu
+    item_sales = inputs.frame(PROFILE_ITEM_SALES_QUERY)
+    
+    # Sales of the merchant's own items
+    merchant_item_ids = set(df_menu["item_id"].tolist())
+    merchant_sales = item_sales[item_sales["item_id"].isin(merchant_item_ids)]
+    
+    # Top selling items for this merchant, listed in menu order
+    top_item_ids = merchant_sales["item_id"].head(3).tolist()
+    top_items = df_menu[df_menu["item_id"].isin(top_item_ids)]["item_name"].tolist()
+    
+    # Top category - number of the merchant's items sold at least once per tag
+    category_counts = df_menu[df_menu["item_id"].isin(merchant_sales["item_id"])]["cuisine_tag"].value_counts()
+    
+    return {
+        "top_items": top_items,
+        "top_category": category_counts.idxmax() if not category_counts.empty else "Unknown",
+        "top_category_count": int(category_counts.max()) if not category_counts.empty else 0,
+        # View vs Purchase analysis - items converting under 10% of their views
+        "underperforming_items": low_conversion_items(inputs.merchant_id),
+    }
+
+def _basket_section(inputs: _ProfileInputs) -> dict:
+    basket = inputs.frame(PROFILE_BASKET_QUERY)
+    df_pairs = item_pair_counts(inputs.merchant_id, 3)
+    item_names = dict(zip(inputs.menu["item_id"], inputs.menu["item_name"]))
+    return {
+        "avg_basket_size": float(_nan_if_none(basket["avg_basket_size"].iloc[0])),
+        "pairs": [
+            f"{item_names[row.item1]} + {item_names[row.item2]} ({row.count} times)"
+            for row in df_pairs.itertuples(index=False)
+        ],
+    }
+
+def _delivery_section(inputs: _ProfileInputs) -> dict:
+    return {
+        "avg_delivery_mins": float(_nan_if_none(inputs.order_stats["avg_delivery_mins"])),
+    }
+
+# Profile sections: the data scopes each one is computed from and its builder.
+# A section is only recomputed when one of its own scopes changed.
+PROFILE_SECTIONS = {
+    "merchant": (("merchants", "transactions"), _merchant_section),
+    "scale": (("transactions", "catalog"), _scale_section),
+    "customers": (("transactions", "catalog"), _customers_section),
+    "sales": (("transactions", "merchants"), _sales_section),
+    "timing": (("transactions",), _timing_section),
+    "products": (("transactions", "catalog", "keywords"), _products_section),
+    "basket": (("transactions", "catalog"), _basket_section),
+    "delivery": (("transactions",), _delivery_section),
+}
+
+def compute_merchant_profile(merchant_id: str, base: dict = None, sections=None):
+    """
+    Compute a merchant's profile from the database.
+    
+    Args:
+        merchant_id: The ID of the merchant
+        base: Figures from load_profile_base, loaded here when a section needs them
+        sections: Names of the sections to compute, all sections when None
+    
+    Returns:
+        dict: Profile grouped by section, or None if the merchant does not
+        exist or has no transactions
+    """
+    if base is None:
+        has_data = query_to_dataframe(PROFILE_HAS_DATA_QUERY, {"merchant_id": merchant_id})
+        if not has_data["has_data"].iloc[0]:
+            return None
+    
+    inputs = _ProfileInputs(merchant_id, base)
+    return {
+        section: PROFILE_SECTIONS[section][1](inputs)
+        for section in (sections or PROFILE_SECTIONS)
+    }
+
+def save_merchant_profiles(profiles: dict, data_version: str):
+    """
+    Store several profiles in one transaction.
+    
+    Args:
+        profiles: {merchant_id: profile}
+        data_version: Data versions the profiles were computed from
+    """
+    if not profiles:
+        return
+    computed_at = datetime.now()
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO merchant_profiles (merchant_id, data_version, profile, computed_at)
+            VALUES (:merchant_id, :data_version, :profile, :computed_at)
+            ON CONFLICT(merchant_id) DO UPDATE SET
+                data_version = excluded.data_version,
+                profile = excluded.profile,
+                computed_at = excluded.computed_at
+        """), [
+            {
+                "merchant_id": merchant_id,
+                "data_version": data_version,
+                "profile": json.dumps(profile),
+                "computed_at": computed_at
+            }
+            for merchant_id, profile in profiles.items()
+        ])
+
+def save_merchant_profile(merchant_id: str, profile: dict, data_version: str):
+    save_merchant_profiles({merchant_id: profile}, data_version)
+
+def _update_profile(merchant_id: str, row, versions: dict, sections) -> dict:
+    """
+    Recompute the stale sections among sections on top of a stored profile
+    row (None when there is none) and store the result.
+    
+    Returns:
+        dict: The merged profile, or None if there is no data
+    """
+    profile, stored_versions = {}, {}
+    if row is not None:
+        profile = json.loads(row["profile"])
+        stored_versions = _stored_section_versions(row["data_version"])
+    stale = [s for s in sections if s not in profile or stored_versions.get(s) != versions[s]]
+    if not stale:
+        return profile
+    
+    fresh = compute_merchant_profile(merchant_id, sections=stale)
+    if fresh is None:
+        return None
+    profile.update(fresh)
+    stored_versions.update({s: versions[s] for s in stale})
+    save_merchant_profile(merchant_id, profile, json.dumps(stored_versions))
+    return profile
+
+def _stored_row(merchant_id: str):
+    row = query_to_dataframe(PROFILE_ROW_QUERY, {"merchant_id": merchant_id})
+    return None if row.empty else row.iloc[0]
+
+@singleflight("merchant_profile", key=lambda merchant_id, sections=None: (merchant_id, tuple(sorted(sections or ()))))
+def get_merchant_profile(merchant_id: str, sections=None):
+    """
+    Get a merchant's profile, first recomputing and storing the requested
+    sections that are missing or older than their data.
+    
+    Args:
+        merchant_id: The ID of the merchant
+        sections: Names of the sections to return, all sections when None
+    
+    Returns:
+        dict: Profile grouped by section, or None if there is no data
+    """
+    sections = list(sections or PROFILE_SECTIONS)
+    profile = _update_profile(merchant_id, _stored_row(merchant_id), current_section_versions(), sections)
+    if profile is None:
+        return None
+    return {section: profile[section] for section in sections}
+
+def refresh_merchant_profiles(merchant_ids=None) -> dict:
+    """
+    Recompute the stale sections of every profile.
+    
+    Args:
+        merchant_ids: Merchants to refresh, all merchants when None
+        
+    Returns:
+        dict: refreshed, skipped, failed and seconds
+    """
+    started = datetime.now()
+    versions = current_section_versions()
+    if merchant_ids is None:
+        merchant_ids = query_to_dataframe("SELECT merchant_id FROM merchants")["merchant_id"].tolist()
+    stored = query_to_dataframe(PROFILE_VERSIONS_QUERY)
+    stored = dict(zip(stored["merchant_id"], stored["data_version"]))
+    
+    refreshed = skipped = failed = 0
+    for merchant_id in merchant_ids:
+        if _stored_section_versions(stored.get(merchant_id)) == versions:
+            skipped += 1
+            continue
+        try:
+            _update_profile(merchant_id, _stored_row(merchant_id), versions, list(PROFILE_SECTIONS))
+            refreshed += 1
+        except Exception as e:
+            failed += 1
+            print(f"Error refreshing profile of {merchant_id}: {str(e)}")
+    
+    seconds = (datetime.now() - started).total_seconds()
+    print(f"Merchant profiles: {refreshed} refreshed, {skipped} up to date, {failed} failed in {seconds:.2f}s")
+    return {"refreshed": refreshed, "skipped": skipped, "failed": failed, "seconds": round(seconds, 3)}
+
+
+class ProfileRefresher:
+    """
+    Background thread that refreshes stale profiles when asked to.
+    
+    Requests made while a refresh is running are merged into one follow-up run.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pending = False
+        self._merchant_ids = set()
+        self.last_result = None
+    
+    def request(self, merchant_ids=None):
+        """Queue a refresh of some merchants, or of every merchant when None"""
+        with self._lock:
+            if merchant_ids is None:
+                self._merchant_ids = None
+            elif self._merchant_ids is not None:
+                self._merchant_ids.update(merchant_ids)
+            self._pending = True
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="profile-refresher", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+    
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            with self._lock:
+                self._wakeup.clear()
+                if not self._pending:
+                    continue
+                merchant_ids = None if self._merchant_ids is None else sorted(self._merchant_ids)
+                self._pending = False
+                self._merchant_ids = set()
+            try:
+                self.last_result = refresh_merchant_profiles(merchant_ids)
+            except Exception as e:
+                print(f"Error in profile refresher: {str(e)}")
+
+
+_refresher = ProfileRefresher()
+
+
+def get_profile_refresher() -> ProfileRefresher:
+    """Get the process-wide profile refresher"""
+    return _refresher
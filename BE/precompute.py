@@ -0,0 +1,275 @@
+"""
+Stale-while-revalidate precomputation of LLM-backed merchant results.
+
+Jobs such as advice, insights and bundle suggestions register the data
+scopes they read and a coroutine that computes them for one merchant. The
+last good result of every (job, merchant) is kept in the
+precomputed_results table together with the data version it was computed
+from. A request gets the stored result at once; if the data has changed
+since, the result is refreshed in the background. Only a merchant's very
+first request waits for the computation.
+
+Refreshes run on a bounded pool of worker tasks, ordered by how active
+each merchant has been recently. A watcher also queues the refreshes of all
+recently active merchants whenever a data version changes, so results are
+usually fresh before the app asks for them.
+"""
+import os
+import json
+import time
+import asyncio
+import itertools
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from database import engine, read_engine, get_data_version
+from singleflight import SingleFlight
+
+PRECOMPUTE_WORKERS = int(os.getenv("PRECOMPUTE_WORKERS", 4))
+PRECOMPUTE_POLL_SECONDS = float(os.getenv("PRECOMPUTE_POLL_SECONDS", 60))
+
+# Merchants who requested a job within this many hours are kept up to date
+PRECOMPUTE_ACTIVE_HOURS = float(os.getenv("PRECOMPUTE_ACTIVE_HOURS", 24))
+
+# A request counts half as much towards a merchant's priority after this long
+ACTIVITY_HALF_LIFE_SECONDS = 3600
+
+LOAD_RESULT_QUERY = """
+SELECT data_version, result FROM precomputed_results
+WHERE job = :job AND merchant_id = :merchant_id
+"""
+
+RECENT_RESULTS_QUERY = """
+SELECT job, merchant_id FROM precomputed_results
+WHERE computed_at >= :since
+"""
+
+
+def _is_good(result) -> bool:
+    """Error results are returned to the caller but never replace the last good one"""
+    return not (isinstance(result, dict) and ("error" in result or result.get("status") in ("error", "loading")))
+
+
+def _job_key(name: str, args: tuple) -> str:
+    return ":".join((name,) + tuple(str(arg) for arg in args))
+
+
+class Precomputer:
+    """
+    Serves the last good result of each registered job and keeps it fresh.
+
+    Jobs are identified by name plus extra string arguments (e.g. the
+    insights period), stored as "name:arg".
+    """
+
+    def __init__(self, workers: int = PRECOMPUTE_WORKERS):
+        self.workers = workers
+        self._jobs = {}  # name -> (scopes, compute)
+        self._activity = {}  # merchant_id -> (score, last request time)
+        self._requested = {}  # merchant_id -> {(name, args)}
+        self._queue = None
+        self._queued = set()
+        self._flight = SingleFlight("precompute")  # Coalesces computations by (name, merchant_id, args)
+        self._tasks = []
+        self._sequence = itertools.count()
+        self._versions = None
+        self.served_fresh = 0
+        self.served_stale = 0
+        self.computed_inline = 0
+        self.refreshed = 0
+        self.refresh_errors = 0
+
+    def register(self, name: str, scopes, compute):
+        """
+        Register a job.
+
+        Args:
+            name: Job name
+            scopes: Data scopes the job's result depends on
+            compute: Coroutine function compute(merchant_id, *args) returning a JSON-serializable result
+        """
+        self._jobs[name] = (tuple(scopes), compute)
+
+    def _version(self, name: str) -> str:
+        scopes = self._jobs[name][0]
+        return json.dumps(dict(zip(scopes, get_data_version(*scopes))))
+
+    def _load(self, name: str, merchant_id: str, args: tuple):
+        with read_engine.connect() as conn:
+            row = conn.execute(text(LOAD_RESULT_QUERY), {
+                "job": _job_key(name, args), "merchant_id": merchant_id
+            }).fetchone()
+        if row is None:
+            return None
+        return row.data_version, json.loads(row.result)
+
+    def _lookup(self, name: str, merchant_id: str, args: tuple):
+        """Current data version of a job and its stored (version, result), or None"""
+        return self._version(name), self._load(name, merchant_id, args)
+
+    def _store(self, name: str, merchant_id: str, args: tuple, version: str, result):
+        with engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO precomputed_results (job, merchant_id, data_version, result, computed_at)
+                VALUES (:job, :merchant_id, :data_version, :result, :computed_at)
+                ON CONFLICT(job, merchant_id) DO UPDATE SET
+                    data_version = excluded.data_version,
+                    result = excluded.result,
+                    computed_at = excluded.computed_at
+            """), {
+                "job": _job_key(name, args), "merchant_id": merchant_id, "data_version": version,
+                "result": json.dumps(result, default=str), "computed_at": datetime.now()
+            })
+
+    def _touch(self, merchant_id: str, name: str, args: tuple):
+        """Record a request: the merchant's activity score decays with ACTIVITY_HALF_LIFE_SECONDS"""
+        now = time.time()
+        score, last_seen = self._activity.get(merchant_id, (0.0, now))
+        score = score * 0.5 ** ((now - last_seen) / ACTIVITY_HALF_LIFE_SECONDS) + 1
+        self._activity[merchant_id] = (score, now)
+        self._requested.setdefault(merchant_id, set()).add((name, args))
+
+    def _priority(self, merchant_id: str) -> float:
+        score, last_seen = self._activity.get(merchant_id, (0.0, time.time()))
+        return score * 0.5 ** ((time.time() - last_seen) / ACTIVITY_HALF_LIFE_SECONDS)
+
+    async def get(self, name: str, merchant_id: str, *args):
+        """
+        Return the last good result of a job, refreshing it in the background if stale.
+
+        Without a stored result the job is computed before returning.
+        """
+        self._touch(merchant_id, name, args)
+        # SQLite reads and writes run in a thread so they never hold up the event loop
+        version, stored = await asyncio.to_thread(self._lookup, name, merchant_id, args)
+        if stored is not None:
+            stored_version, result = stored
+            if stored_version == version:
+                self.served_fresh += 1
+            else:
+                self.served_stale += 1
+                self._schedule(name, merchant_id, args)
+            return result
+        self.computed_inline += 1
+        return await self._compute(name, merchant_id, args, version)
+
+    async def _compute(self, name: str, merchant_id: str, args: tuple, version: str):
+        """Compute a job and store a good result; concurrent calls for one job share the computation"""
+        return await self._flight.do_async((name, merchant_id, args), self._run, name, merchant_id, args, version)
+
+    async def _run(self, name: str, merchant_id: str, args: tuple, version: str):
+        result = await self._jobs[name][1](merchant_id, *args)
+        if _is_good(result):
+            await asyncio.to_thread(self._store, name, merchant_id, args, version, result)
+        return result
+
+    def _schedule(self, name: str, merchant_id: str, args: tuple):
+        """Queue a background refresh, most active merchants first"""
+        key = (name, merchant_id, args)
+        # Only refreshes still waiting in the queue are deduplicated here; a
+        # worker that picks one up while the job is computing joins that
+        # computation through the SingleFlight
+        if key in self._queued:
+            return
+        self.start()
+        self._queued.add(key)
+        self._queue.put_nowait((-self._priority(merchant_id), next(self._sequence), key))
+
+    async def _worker(self):
+        while True:
+            _, _, key = await self._queue.get()
+            self._queued.discard(key)
+            name, merchant_id, args = key
+            try:
+                version, stored = await asyncio.to_thread(self._lookup, name, merchant_id, args)
+                if stored is None or stored[0] != version:
+                    result = await self._compute(name, merchant_id, args, version)
+                    if _is_good(result):
+                        self.refreshed += 1
+                    else:
+                        self.refresh_errors += 1
+            except Exception as e:
+                self.refresh_errors += 1
+                print(f"Error precomputing {_job_key(name, args)} for merchant {merchant_id}: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(PRECOMPUTE_POLL_SECONDS)
+            try:
+                self.refresh_active()
+            except Exception as e:
+                print(f"Error in precompute watcher: {str(e)}")
+
+    def refresh_active(self):
+        """
+        Queue the jobs of every recently active merchant if any data version
+        changed since the last check. Jobs that are already fresh are skipped
+        by the workers.
+        """
+        versions = get_data_version()
+        if versions == self._versions:
+            return
+        self._versions = versions
+        cutoff = time.time() - PRECOMPUTE_ACTIVE_HOURS * 3600
+        for merchant_id, (_, last_seen) in list(self._activity.items()):
+            if last_seen < cutoff:
+                del self._activity[merchant_id]
+                self._requested.pop(merchant_id, None)
+        for merchant_id in sorted(self._requested, key=self._priority, reverse=True):
+            for name, args in self._requested[merchant_id]:
+                if name in self._jobs:
+                    self._schedule(name, merchant_id, args)
+
+    def _seed_from_store(self):
+        """After a restart, treat merchants with recently computed results as active"""
+        since = datetime.now() - timedelta(hours=PRECOMPUTE_ACTIVE_HOURS)
+        with read_engine.connect() as conn:
+            rows = conn.execute(text(RECENT_RESULTS_QUERY), {"since": since}).fetchall()
+        now = time.time()
+        for row in rows:
+            name, *args = row.job.split(":")
+            self._activity.setdefault(row.merchant_id, (0.0, now))
+            self._requested.setdefault(row.merchant_id, set()).add((name, tuple(args)))
+
+    def start(self):
+        """Start the worker pool and the data version watcher (from inside the event loop)"""
+        if self._tasks:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._watch()))
+        self._versions = get_data_version()
+        try:
+            self._seed_from_store()
+        except Exception as e:
+            print(f"Error loading precomputed results: {str(e)}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queued.clear()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": bool(self._tasks),
+            "queued": len(self._queued),
+            "in_progress": self._flight.stats()["in_flight"],
+            "active_merchants": len(self._requested),
+            "served_fresh": self.served_fresh,
+            "served_stale": self.served_stale,
+            "computed_inline": self.computed_inline,
+            "refreshed": self.refreshed,
+            "refresh_errors": self.refresh_errors,
+        }
+
+
+_precomputer = Precomputer()
+
+
+def get_precomputer() -> Precomputer:
+    """Get the process-wide precomputer"""
+    return _precomputer
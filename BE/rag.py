@@ -1,363 +1,297 @@
+import os
 import pandas as pd
-from datetime import datetime, timedelta
-from collections import Counter
+from datetime import datetime
 from database import query_to_dataframe  # Import the database function
-from itertools import combinations
+from cache import cached
+from transaction_store import get_transaction_store
+from city_benchmarks import get_city_benchmark, sketch_stats, quantile, percentile_rank
+from merchant_profiles import get_merchant_profile
 
-def get_city_comparison(merchant_id: str) -> str:
-    """Generate comparison metrics against city peers"""
-    try:
-        # Get merchant info from database
-        merchant_query = """
-        SELECT * FROM merchants
-        WHERE merchant_id = :merchant_id
-        """
-        merchant_df = query_to_dataframe(merchant_query, {"merchant_id": merchant_id})
-        
-        if merchant_df.empty:
-            return "\n⚠️ Could not generate city comparison: Merchant not found"
-            
-        merchant = merchant_df.iloc[0]
-        city_id = merchant["city_id"]  # Adjust field name if different in your schema
-        
-        # Get all merchants in same city from database
-        city_merchants_query = """
-        SELECT * FROM merchants
-        WHERE city_id = :city_id
-        """
-        city_merchants = query_to_dataframe(city_merchants_query, {"city_id": city_id})
-        city_merchant_ids = city_merchants["merchant_id"].tolist()
-        
-        # Create placeholders for SQL IN clause
-        merchant_ids_str = "', '".join(city_merchant_ids)
-        
-        # Get city transactions from database
-        city_transactions_query = f"""
-        SELECT * FROM transactions
-        WHERE merchant_id IN ('{merchant_ids_str}')
-        """
-        city_transactions = query_to_dataframe(city_transactions_query)
-        
-        # Get merchant transactions from database
-        merchant_transactions_query = """
-        SELECT * FROM transactions
-        WHERE merchant_id = :merchant_id
-        """
-        merchant_transactions = query_to_dataframe(merchant_transactions_query, {"merchant_id": merchant_id})
-        
-        # Calculate comparison metrics
-        metrics = {
-            # Revenue metrics
-            "total_revenue": {
-                "merchant": merchant_transactions["order_value"].sum(),
-                "city_avg": city_transactions.groupby("merchant_id")["order_value"].sum().mean(),
-                "city_top_25": city_transactions.groupby("merchant_id")["order_value"].sum().quantile(0.75)
-            },
-            # Order volume
-            "order_count": {
-                "merchant": len(merchant_transactions),
-                "city_avg": city_transactions.groupby("merchant_id").size().mean(),
-                "city_top_25": city_transactions.groupby("merchant_id").size().quantile(0.75)
-            }
+@cached(("transactions", "merchants"))
+def _city_comparison_text(merchant_id: str) -> str:
+    """Comparison metrics against city peers, raising LookupError when they cannot be computed"""
+    # Get merchant info from database
+    merchant_query = """
+    SELECT * FROM merchants
+    WHERE merchant_id = :merchant_id
+    """
+    merchant_df = query_to_dataframe(merchant_query, {"merchant_id": merchant_id})
+    
+    if merchant_df.empty:
+        raise LookupError("Merchant not found")
+    
+    merchant = merchant_df.iloc[0]
+    city_id = merchant_df["city_id"].tolist()[0]  # Native Python value so it can be bound as a parameter
+    
+    # City statistics are precomputed once per data version
+    benchmark = get_city_benchmark(city_id)
+    if benchmark is None:
+        raise LookupError("No city benchmark available")
+    
+    # The merchant's own totals are O(1) reads from the store
+    merchant_totals = get_transaction_store().merchant_totals([merchant_id])
+    revenue = float(merchant_totals["revenue"].sum())
+    orders = int(merchant_totals["orders"].sum())
+    
+    # Calculate comparison metrics
+    metrics = {
+        # Revenue metrics
+        "total_revenue": {
+            "merchant": revenue,
+            "city_avg": benchmark["revenue_avg"],
+            "city_top_25": quantile(benchmark["revenue_quantiles"], 0.75),
+            "percentile": percentile_rank(benchmark["revenue_quantiles"], revenue)
+        },
+        # Order volume
+        "order_count": {
+            "merchant": orders,
+            "city_avg": benchmark["orders_avg"],
+            "city_top_25": quantile(benchmark["orders_quantiles"], 0.75),
+            "percentile": percentile_rank(benchmark["orders_quantiles"], orders)
+        }
+    }
+    
+    # Add delivery speed metrics if delivery times are known
+    if "delivery_count" in merchant_totals.columns and benchmark["delivery_avg_mins"] is not None:
+        metrics["delivery_speed"] = {
+            "merchant": merchant_totals["delivery_mins_sum"].sum() / merchant_totals["delivery_count"].sum(),
+            "city_avg": benchmark["delivery_avg_mins"]
+        }
+    
+    # Add business age metrics if the column exists
+    if "join_date" in merchant.keys() and benchmark["business_age_avg"] is not None:
+        metrics["business_age"] = {
+            "merchant": (datetime.now() - pd.to_datetime(merchant["join_date"], format="%d%m%Y", errors="coerce")).days / 365,
+            "city_avg": benchmark["business_age_avg"]
         }
-        
-        # Add delivery speed metrics if columns exist
-        if "delivery_time" in merchant_transactions.columns and "order_time" in merchant_transactions.columns:
-            metrics["delivery_speed"] = {
-                "merchant": (pd.to_datetime(merchant_transactions["delivery_time"]) - 
-                            pd.to_datetime(merchant_transactions["order_time"])).dt.total_seconds().mean() / 60,
-                "city_avg": (pd.to_datetime(city_transactions["delivery_time"]) - 
-                            pd.to_datetime(city_transactions["order_time"])).dt.total_seconds().mean() / 60
-            }
-        
-        # Add business age metrics if the column exists
-        if "join_date" in merchant.keys():
-            metrics["business_age"] = {
-                "merchant": (datetime.now() - pd.to_datetime(merchant["join_date"])).days / 365,
-                "city_avg": (datetime.now() - pd.to_datetime(city_merchants["join_date"])).dt.days.mean() / 365
-            }
-        
-        # Generate comparison text
-        comparison_text = f"""
+    
+    # Generate comparison text
+    comparison_text = f"""
 🏙️ City Comparison Metrics (City ID: {city_id}):
 
 💰 Revenue:
 - Yours: ${metrics['total_revenue']['merchant']:,.2f}
 - City Avg: ${metrics['total_revenue']['city_avg']:,.2f}
 - Top 25%: ${metrics['total_revenue']['city_top_25']:,.2f}
+- Your Percentile: {metrics['total_revenue']['percentile']:.0f}
 
 📦 Order Volume:
 - Yours: {metrics['order_count']['merchant']} orders
 - City Avg: {metrics['order_count']['city_avg']:.1f} orders
 - Top 25%: {metrics['order_count']['city_top_25']:.1f} orders
+- Your Percentile: {metrics['order_count']['percentile']:.0f}
 """
 
-        # Add delivery speed if available
-        if "delivery_speed" in metrics:
-            comparison_text += f"""
+    # Order values and distinct customers are approximate, read from sketches
+    merchant_sketch = sketch_stats("merchant", merchant_id)
+    city_sketch = sketch_stats("city", city_id)
+    if merchant_sketch and city_sketch and city_sketch["order_value_quantiles"]:
+        comparison_text += f"""
+🧾 Order Value (approx.):
+- Your Median: ${quantile(merchant_sketch['order_value_quantiles'], 0.5):,.2f}
+- City Median: ${quantile(city_sketch['order_value_quantiles'], 0.5):,.2f}
+- City Top 25%: ${quantile(city_sketch['order_value_quantiles'], 0.75):,.2f}
+
+👥 Unique Customers (approx.):
+- Yours: {merchant_sketch['distinct_eaters']:,}
+- City: {city_sketch['distinct_eaters']:,}
+"""
+
+    # Add delivery speed if available
+    if "delivery_speed" in metrics:
+        comparison_text += f"""
 ⏱️ Delivery Speed:
 - Yours: {metrics['delivery_speed']['merchant']:.1f} mins
 - City Avg: {metrics['delivery_speed']['city_avg']:.1f} mins
 """
 
-        # Add business age if available
-        if "business_age" in metrics:
-            comparison_text += f"""
+    # Add business age if available
+    if "business_age" in metrics:
+        comparison_text += f"""
 🏢 Business Longevity:
 - Yours: {metrics['business_age']['merchant']:.1f} years
 - City Avg: {metrics['business_age']['city_avg']:.1f} years
 """
-        return comparison_text
-        
-    except Exception as e:
-        return f"\n⚠️ Could not generate city comparison: {str(e)}"
+    return comparison_text
 
-def get_merchant_summary(merchant_id: str) -> str:
+def get_city_comparison(merchant_id: str) -> str:
+    """Generate comparison metrics against city peers"""
     try:
-        # Load all datasets from database
-        merchants_query = """SELECT * FROM merchants"""
-        df_merchants = query_to_dataframe(merchants_query)
-        
-        tx_query = """SELECT * FROM transactions"""
-        df_tx = query_to_dataframe(tx_query)
-        
-        items_query = """SELECT * FROM items"""
-        df_items = query_to_dataframe(items_query)
-        
-        tx_items_query = """SELECT * FROM transaction_items"""
-        df_tx_items = query_to_dataframe(tx_items_query)
-        
-        keywords_query = """SELECT * FROM keywords"""
-        df_keywords = query_to_dataframe(keywords_query)
-        
-        # Convert date columns
-        df_tx["order_time"] = pd.to_datetime(df_tx["order_time"])
-        df_merchants["join_date"] = pd.to_datetime(df_merchants["join_date"], format="%d%m%Y", errors="coerce")
+        return _city_comparison_text(merchant_id)
     except Exception as e:
-        return f"Error loading data: {e}"
-    
-    # Get merchant info
-    merchant_info = df_merchants[df_merchants["merchant_id"] == merchant_id].iloc[0]
-    merchant_name = merchant_info["merchant_name"]  # Adjust field name if different
-    join_date = merchant_info["join_date"]
-    city_id = merchant_info["city_id"]  # Adjust field name if different
-    business_duration = (datetime.now() - join_date).days // 30  # in months
-    
-    # Filter merchant transactions
-    df_merchant_tx = df_tx[df_tx["merchant_id"] == merchant_id]
-    if df_merchant_tx.empty:
-        return "No data available for this merchant."
-    
-    # --- Business Scale Analysis ---
-    tx_count = len(df_merchant_tx)
-    avg_daily_orders = tx_count / ((datetime.now() - df_merchant_tx["order_time"].min()).days or 1)
-    item_variety = len(df_items[df_items["merchant_id"] == merchant_id])
-    
-    if tx_count < 500 or avg_daily_orders < 5:
-        business_scale = "Small (Street vendor/Family shop)"
-    elif tx_count < 5000 or avg_daily_orders < 50:
-        business_scale = "Medium (Full restaurant)"
-    else:
-        business_scale = "Large (Chain/Multi-location)"
-    
-    # Create joined DataFrame
-    df_joined = df_tx_items.merge(
-        df_merchant_tx[["order_id", "eater_id"]],  # Include both columns
-        on="order_id"
-    )
+        return f"\n⚠️ Could not generate city comparison: {str(e)}"
 
-    # --- Sales Performance ---
-    total_revenue = df_merchant_tx["order_value"].sum()
-    total_orders = len(df_merchant_tx)
-    avg_order_value = total_revenue / total_orders
-    
-    # Weekly revenue
-    last_week = datetime.now() - timedelta(days=7)
-    weekly_revenue = df_merchant_tx[df_merchant_tx["order_time"] >= last_week]["order_value"].sum()
-    
-    # --- Customer Analysis ---
-    # Returning customers
-    customer_orders = df_merchant_tx["eater_id"].value_counts()
-    returning_customers = len(customer_orders[customer_orders > 1])
-    total_customers = len(customer_orders)
-    retention_rate = round((returning_customers / total_customers) * 100, 1) if total_customers else 0
-    
-    # Get top items for returning customers
-    returning_eater_ids = customer_orders[customer_orders > 1].index.tolist()
-    df_returning_cust_orders = df_joined[df_joined["eater_id"].isin(returning_eater_ids)]
-    
-    # Check if df_items has 'item_name' or 'name' for the item name
-    item_name_col = "item_name" if "item_name" in df_items.columns else "name"
-    cuisine_tag_col = "cuisine_tag" if "cuisine_tag" in df_items.columns else "category"
-    
-    top_returning_items = df_items[df_items["item_id"].isin(
-        df_returning_cust_orders["item_id"].value_counts().head(2).index
-    )][item_name_col].tolist()
+def _render_header(merchant_id: str, profile: dict) -> str:
+    return f"Merchant Profile: {profile['merchant']['merchant_name']} ({merchant_id})"
 
-    # Inactive returning customers (last order >30 days ago)
-    last_order_dates = df_merchant_tx.groupby("eater_id")["order_time"].max()
-    inactive_returning = len([
-        eid for eid in returning_eater_ids 
-        if (datetime.now() - last_order_dates[eid]).days > 30
-    ])
-    
-    # --- Order Timing ---
-    df_merchant_tx = df_merchant_tx.copy()  # Create an explicit copy
-    df_merchant_tx.loc[:, "order_hour"] = df_merchant_tx["order_time"].dt.hour
-    peak_hours = df_merchant_tx["order_hour"].value_counts().sort_values(ascending=False).head(2).index.tolist()
-    peak_range = f"{min(peak_hours)}:00–{max(peak_hours)+1}:00"
-    
-    # --- Product Analysis ---
-    df_joined = df_tx_items.merge(df_merchant_tx[["order_id"]], on="order_id")
-    
-    # Top items - modified to filter by merchant_id
-    # First, get the item_ids from transactions for this specific merchant
-    merchant_items_df = df_items[df_items["merchant_id"] == merchant_id]
-    merchant_item_ids = set(merchant_items_df["item_id"].tolist())
-    
-    # Now filter transaction items to only include those belonging to this merchant
-    merchant_tx_items = df_joined[df_joined["item_id"].isin(merchant_item_ids)]
-    
-    # Get top selling items for this merchant
-    top_item_ids = merchant_tx_items["item_id"].value_counts().head(3).index.tolist()
-    df_top_items = df_items[df_items["item_id"].isin(top_item_ids)]
-    top_items_str = ", ".join(df_top_items[item_name_col].values.tolist())
-    
-    # Top category - also modified to consider only merchant's items
-    category_counts = df_items[
-        (df_items["merchant_id"] == merchant_id) & 
-        (df_items["item_id"].isin(merchant_tx_items["item_id"]))
-    ][cuisine_tag_col].value_counts()
-    
-    top_category = category_counts.idxmax() if not category_counts.empty else "Unknown"
-    top_category_count = category_counts.max() if not category_counts.empty else 0
-    
-    # View vs Purchase analysis (if keywords data is available)
-    view_to_purchase_ratio = ""
-    if not df_keywords.empty and "view" in df_keywords.columns:
-        viewed_items = df_keywords["view"].value_counts() 
-        purchased_items = df_joined["item_id"].value_counts()
-        
-        # Items with high views but low purchases
-        common_items = set(viewed_items.index).intersection(set(purchased_items.index))
-        underperforming_items = []
-        for item in common_items:
-            ratio = purchased_items.get(item, 0) / viewed_items.get(item, 1)
-            if ratio < 0.1:  # Only 10% of views convert to purchases
-                item_name = df_items[df_items["item_id"] == item][item_name_col].values[0]
-                underperforming_items.append(item_name)
-        
-        if underperforming_items:
-            view_to_purchase_ratio = "\n🚨 Underperforming Items (High Views, Low Purchases):\n- " + "\n- ".join(underperforming_items)
-    
-    # --- Basket Analysis ---
-    avg_basket_size = merchant_tx_items.groupby("order_id").size().mean()
+def _render_scale(merchant_id: str, profile: dict) -> str:
+    scale = profile["scale"]
+    return f"""📊 Business Scale: {scale['business_scale']}
+- Total Orders: {scale['tx_count']}
+- Avg Daily Orders: {scale['avg_daily_orders']:.1f}
+- Menu Items: {scale['item_variety']}"""
 
-    # Build a list of all item combinations per order, but only for this merchant's items
-    # First ensure we're only considering orders with this merchant's items
-    merchant_orders = merchant_tx_items.groupby("order_id")["item_id"].apply(list)
+def _render_loyalty(merchant_id: str, profile: dict) -> str:
+    customers = profile["customers"]
+    return f"""📊 Customer Loyalty:
+- Returning Customers: {customers['returning_customers']}/{customers['total_customers']} ({customers['retention_rate']}%)
+- Most Loyal Customer: {customers['most_loyal_orders']} orders
+- Top Returning Customer Choices: {", ".join(customers['top_returning_items'])}
+- Inactive Returners: {customers['inactive_returning']} (30+ days since last order)"""
 
-    pair_counter = Counter()
+def _render_location(merchant_id: str, profile: dict) -> str:
+    merchant = profile["merchant"]
+    return f"📍 Location: City {merchant['city_id']} | 🏢 Business Age: {merchant['maturity']}"
 
-    for items in merchant_orders:
-        unique_items = list(set(items))  # Avoid duplicate items in the same order
-        if len(unique_items) > 1:
-            pairs = combinations(sorted(unique_items), 2)
-            pair_counter.update(pairs)
+def _render_sales(merchant_id: str, profile: dict) -> str:
+    sales = profile["sales"]
+    return f"""📈 Sales Performance:
+- Total Revenue: ${sales['total_revenue']:.2f}
+- Last 7 Days Revenue: ${sales['weekly_revenue']:.2f}
+- Total Orders: {sales['total_orders']}
+- Avg. Order Value: ${sales['avg_order_value']:.2f} (City Avg: ${sales['city_avg_order_value']:.2f})
+- Returning Customers: {profile['customers']['returning_customers']}"""
 
-    # Get top 3 most common item pairs
-    top_pairs = pair_counter.most_common(3)
+def _render_timing(merchant_id: str, profile: dict) -> str:
+    return f"""🕒 Peak Order Timing:
+- Most orders happen between {profile['timing']['peak_range']}"""
 
-    # Convert item IDs to item names, ensuring they belong to this merchant
-    pair_names = []
-    for (item1, item2), count in top_pairs:
-        # Verify these items belong to the merchant
-        if item1 in merchant_item_ids and item2 in merchant_item_ids:
-            name1 = df_items[df_items["item_id"] == item1][item_name_col].values[0]
-            name2 = df_items[df_items["item_id"] == item2][item_name_col].values[0]
-            pair_names.append(f"{name1} + {name2} ({count} times)")
-    
+def _render_products(merchant_id: str, profile: dict) -> str:
+    products = profile["products"]
+    view_to_purchase_ratio = ""
+    if products["underperforming_items"]:
+        view_to_purchase_ratio = "\n🚨 Underperforming Items (High Views, Low Purchases):\n- " + "\n- ".join(products["underperforming_items"])
+    return f"""🍽️ Product Performance:
+- Top-Selling Items: {", ".join(products['top_items'])}
+- Best Category: {products['top_category']} ({products['top_category_count']} items sold)
+{view_to_purchase_ratio}"""
+
+def _render_basket(merchant_id: str, profile: dict) -> str:
+    basket = profile["basket"]
+    pair_names = list(basket["pairs"])
     # Handle the case when we don't have enough item pairs
     while len(pair_names) < 3:
         pair_names.append("No other frequent combinations")
+    return f"""🛍️ Customer Behavior:
+- Avg. Basket Size: {basket['avg_basket_size']:.2f} items per order
+- Frequently Bought Together: 
+  - {pair_names[0]}
+  - {pair_names[1]}
+  - {pair_names[2]}"""
 
-    # --- Delivery Performance ---
-    if "delivery_time" in df_merchant_tx.columns:
-        df_merchant_tx["delivery_time"] = pd.to_datetime(df_merchant_tx["delivery_time"])
-        df_merchant_tx["delivery_duration_mins"] = (df_merchant_tx["delivery_time"] - df_merchant_tx["order_time"]).dt.total_seconds() / 60
-        avg_delivery_time = df_merchant_tx["delivery_duration_mins"].mean()
-    else:
-        avg_delivery_time = "N/A"
-    
-    # --- Competitor Analysis ---
-    city_merchants = df_merchants[df_merchants["city_id"] == city_id]["merchant_id"].tolist()
-    city_avg_order_value = df_tx[df_tx["merchant_id"].isin(city_merchants)]["order_value"].mean()
-    
-    # --- Business Maturity ---
-    business_years = business_duration / 12  # Convert months to years
+def _render_delivery(merchant_id: str, profile: dict) -> str:
+    avg_delivery_time = profile["delivery"]["avg_delivery_mins"]
+    return f"""🚚 Delivery Metrics:
+- Avg. Delivery Time: {avg_delivery_time if isinstance(avg_delivery_time, str) else f"{avg_delivery_time:.1f} minutes"}"""
 
-    if business_years < 2:
-        maturity = f"Established (1-2 years)"
-    elif business_years < 5:
-        maturity = f"Maturing ({business_years:.1f} years)"
-    elif business_years < 10:
-        maturity = f"Seasoned (5-10 years)"
-    else:
-        maturity = f"Veteran (10+ years)"
-        
-    # Add city comparison
-    city_merchants = df_merchants[df_merchants["city_id"] == city_id]
-    city_ages = (datetime.now() - pd.to_datetime(city_merchants["join_date"], format="%d%m%Y")).dt.days / 365
-    city_avg = city_ages.mean()
-    
-    # --- City Comparison ---
-    city_comparison = get_city_comparison(merchant_id)
-
-    comparison = ""
-    if not pd.isna(city_avg):
-        percentile = (city_ages < business_years).mean() * 100
-        comparison = f"\n🏙️ Compared to city average of {city_avg:.1f} years (older than {percentile:.0f}% of peers)"
-    
-    return f"""
-Merchant Profile: {merchant_name} ({merchant_id})
+def _render_city(merchant_id: str, profile: dict) -> str:
+    return get_city_comparison(merchant_id)
 
-📊 Business Scale: {business_scale}
-- Total Orders: {tx_count}
-- Avg Daily Orders: {avg_daily_orders:.1f}
-- Menu Items: {item_variety}
+# Summary sections in display order: the profile sections each one is
+# rendered from and its renderer. The header is part of every summary.
+SUMMARY_SECTIONS = {
+    "header": (("merchant",), _render_header),
+    "scale": (("scale",), _render_scale),
+    "loyalty": (("customers",), _render_loyalty),
+    "location": (("merchant",), _render_location),
+    "sales": (("sales", "customers"), _render_sales),
+    "timing": (("timing",), _render_timing),
+    "products": (("products",), _render_products),
+    "basket": (("basket",), _render_basket),
+    "delivery": (("delivery",), _render_delivery),
+    "city": ((), _render_city),
+}
 
-📊 Customer Loyalty:
-- Returning Customers: {returning_customers}/{total_customers} ({retention_rate}%)
-- Most Loyal Customer: {customer_orders.max()} orders
-- Top Returning Customer Choices: {", ".join(top_returning_items)}
-- Inactive Returners: {inactive_returning} (30+ days since last order)
+# Prompt token budget of the summary, per endpoint with SUMMARY_TOKEN_BUDGET_<ENDPOINT>
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", 1500))
 
-📍 Location: City {city_id} | 🏢 Business Age: {maturity}
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
 
-📈 Sales Performance:
-- Total Revenue: ${total_revenue:.2f}
-- Last 7 Days Revenue: ${weekly_revenue:.2f}
-- Total Orders: {total_orders}
-- Avg. Order Value: ${avg_order_value:.2f} (City Avg: ${city_avg_order_value:.2f})
-- Returning Customers: {returning_customers}
+def count_tokens(text: str) -> int:
+    """Tokens in a text, estimated at 4 characters per token without tiktoken"""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return -(-len(text) // 4)
 
-🕒 Peak Order Timing:
-- Most orders happen between {peak_range}
+def summary_token_budget(endpoint: str) -> int:
+    """Summary token budget of an endpoint: SUMMARY_TOKEN_BUDGET_<ENDPOINT>, then SUMMARY_TOKEN_BUDGET"""
+    return int(os.getenv(f"SUMMARY_TOKEN_BUDGET_{endpoint.upper()}") or SUMMARY_TOKEN_BUDGET)
 
-🍽️ Product Performance:
-- Top-Selling Items: {top_items_str}
-- Best Category: {top_category} ({top_category_count} items sold)
-{view_to_purchase_ratio}
+def get_summary_sections(merchant_id: str, sections=None):
+    """
+    Render summary sections of a merchant, reading only the profile
+    sections they need.
+    
+    Args:
+        merchant_id: The ID of the merchant
+        sections: Names from SUMMARY_SECTIONS, all sections when None
+    
+    Returns:
+        dict: {section: text} in display order, header included, or None if
+        the merchant has no data
+    """
+    names = ["header"] + [name for name in (sections or SUMMARY_SECTIONS) if name != "header"]
+    unknown = [name for name in names if name not in SUMMARY_SECTIONS]
+    if unknown:
+        raise ValueError(f"Unknown summary sections {unknown}, expected some of {list(SUMMARY_SECTIONS)}")
+    
+    needed = {part for name in names for part in SUMMARY_SECTIONS[name][0]}
+    profile = get_merchant_profile(merchant_id, sorted(needed))
+    if profile is None:
+        return None
+    return {
+        name: render(merchant_id, profile)
+        for name, (_, render) in SUMMARY_SECTIONS.items()
+        if name in names
+    }
 
-🛍️ Customer Behavior:
-- Avg. Basket Size: {avg_basket_size:.2f} items per order
-- Frequently Bought Together: 
-  - {pair_names[0]}
-  - {pair_names[1]}
-  - {pair_names[2]}
+def fit_summary(sections: dict, priority=None, max_tokens: int = None) -> str:
+    """
+    Join rendered sections into one summary that fits a token budget.
+    
+    Args:
+        sections: {section: text} from get_summary_sections
+        priority: Section names, most important first; the sections that do
+            not fit are dropped from the end. Defaults to display order.
+        max_tokens: Token budget, no limit when None
+    
+    Returns:
+        str: The header plus the sections that fit, in display order
+    """
+    priority = [name for name in (priority or sections) if name in sections and name != "header"]
+    kept = {"header"} if "header" in sections else set()
+    if max_tokens is None:
+        kept.update(priority)
+    else:
+        used = sum(count_tokens(sections[name]) for name in kept)
+        for name in priority:
+            tokens = count_tokens(sections[name])
+            if used + tokens <= max_tokens:
+                kept.add(name)
+                used += tokens
+    return "\n\n".join(text for name, text in sections.items() if name in kept).strip()
 
-🚚 Delivery Metrics:
-- Avg. Delivery Time: {avg_delivery_time if isinstance(avg_delivery_time, str) else f"{avg_delivery_time:.1f} minutes"}
+def get_merchant_summary(merchant_id: str, sections=None, max_tokens: int = None) -> str:
+    """
+    Render the merchant summary from the materialized merchant profile.
+    
+    Args:
+        merchant_id: The ID of the merchant
+        sections: Section names to include, most important first; all when None
+        max_tokens: Token budget of the summary, no limit when None
+    """
+    try:
+        rendered = get_summary_sections(merchant_id, sections)
+    except Exception as e:
+        return f"Error loading data: {e}"
+    if rendered is None:
+        return "No data available for this merchant."
+    return fit_summary(rendered, sections, max_tokens)
 
-{city_comparison}
-""".strip()
\ No newline at end of file
+def render_merchant_summary(merchant_id: str, profile: dict) -> str:
+    """Render the full summary text of a merchant profile"""
+    return "\n\n".join(render(merchant_id, profile) for _, render in SUMMARY_SECTIONS.values()).strip()
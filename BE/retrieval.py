@@ -0,0 +1,131 @@
+"""
+Question-aware retrieval over a merchant summary.
+
+The summary is split into its sections (one chunk per blank-line separated
+block) and ranked against the question with Okapi BM25. Only the header and
+the top-k sections go into the prompt. When nothing in the question matches
+any section (for example a question in another language), the whole summary
+is used so the answer never loses context.
+"""
+import math
+import os
+import re
+from collections import Counter
+
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 4))
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+# Extra terms for each section so everyday wording finds it: a question about
+# "money" should reach the revenue section even though the word never appears
+SECTION_ALIASES = {
+    "business scale": "size big small orders daily menu items",
+    "customer loyalty": "customers loyal loyalty retention repeat returning regulars inactive churn lost",
+    "location": "city area age maturity years old",
+    "sales performance": "sales revenue money income earn earnings profit order value aov week weekly",
+    "peak order timing": "peak busy time hour hours rush when staff staffing",
+    "product performance": "products items menu dish dishes best top selling category cuisine popular views",
+    "underperforming items": "underperforming views conversion low purchases menu",
+    "customer behavior": "basket bundle bundles combo combos together pairs upsell",
+    "delivery metrics": "delivery speed fast faster slow slower late minutes driver time",
+    "city comparison": "city compare comparison competitors competition peers average rank percentile",
+}
+
+# The city comparison is one section made of several blank-line separated blocks
+CITY_COMPARISON_HEADING = "🏙️ City Comparison"
+
+
+def _stem(token: str) -> str:
+    """Fold plurals so "deliveries" matches "delivery" and "items" matches "item" """
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> list:
+    return [_stem(token.lower()) for token in _TOKEN.findall(text)]
+
+
+def split_summary(summary: str) -> list:
+    """Split a summary into its sections, one per blank-line separated block"""
+    chunks = []
+    in_city_comparison = False
+    for chunk in re.split(r"\n\s*\n", summary):
+        chunk = chunk.strip()
+        if not chunk:
+            continue
+        if in_city_comparison:
+            chunks[-1] += "\n\n" + chunk
+            continue
+        in_city_comparison = chunk.startswith(CITY_COMPARISON_HEADING)
+        chunks.append(chunk)
+    return chunks
+
+
+def _aliases(chunk: str) -> str:
+    heading = chunk.splitlines()[0].lower()
+    return " ".join(terms for section, terms in SECTION_ALIASES.items() if section in heading)
+
+
+class BM25Index:
+    """Okapi BM25 over a small list of text chunks"""
+
+    def __init__(self, chunks: list, extra_terms: list = None):
+        self.chunks = chunks
+        extra_terms = extra_terms or [""] * len(chunks)
+        self.docs = [Counter(tokenize(chunk + " " + extra)) for chunk, extra in zip(chunks, extra_terms)]
+        self.lengths = [sum(doc.values()) for doc in self.docs]
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0
+        document_frequency = Counter(term for doc in self.docs for term in doc)
+        n = len(self.docs)
+        self.idf = {
+            term: math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for term, df in document_frequency.items()
+        }
+
+    def scores(self, query: str) -> list:
+        terms = tokenize(query)
+        result = []
+        for doc, length in zip(self.docs, self.lengths):
+            score = 0.0
+            for term in terms:
+                tf = doc.get(term)
+                if not tf:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length / self.avg_length)
+                score += self.idf[term] * tf * (BM25_K1 + 1) / (tf + norm)
+            result.append(score)
+        return result
+
+
+def retrieve_summary_context(summary: str, question: str, top_k: int = RETRIEVAL_TOP_K) -> str:
+    """
+    Pick the sections of a merchant summary that are relevant to a question.
+
+    Args:
+        summary: Full merchant summary text
+        question: The merchant's question
+        top_k: Maximum number of sections besides the header
+
+    Returns:
+        str: The header plus the top_k best matching sections in their
+        original order, or the whole summary when nothing matches
+    """
+    chunks = split_summary(summary)
+    if len(chunks) <= top_k + 1:
+        return summary
+
+    # The first chunk names the merchant and is always kept
+    header, sections = chunks[0], chunks[1:]
+    index = BM25Index(sections, [_aliases(section) for section in sections])
+    scores = index.scores(question)
+    ranked = sorted(range(len(sections)), key=lambda i: scores[i], reverse=True)
+    selected = sorted(i for i in ranked[:top_k] if scores[i] > 0)
+    if not selected:
+        return summary
+    return "\n\n".join([header] + [sections[i] for i in selected])
@@ -0,0 +1,83 @@
+import pandas as pd
+from datetime import date
+from database import query_to_dataframe
+from watermarks import get_watermarks
+
+DAILY_SALES_QUERY = """
+SELECT date, revenue, orders
+FROM merchant_daily_sales
+WHERE merchant_id = :merchant_id AND date BETWEEN :start_date AND :end_date
+ORDER BY date
+"""
+
+HOURLY_SALES_QUERY = """
+SELECT date, hour, revenue, orders
+FROM merchant_hourly_sales
+WHERE merchant_id = :merchant_id AND date BETWEEN :start_date AND :end_date
+ORDER BY date, hour
+"""
+
+
+def _to_date_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Turn the YYYY-MM-DD date strings of a rollup query into datetime.date objects"""
+    if not df.empty:
+        df["date"] = pd.to_datetime(df["date"]).dt.date
+    return df
+
+
+def get_latest_sales_date(merchant_id: str):
+    """
+    Get the latest date on which a merchant has sales.
+
+    Args:
+        merchant_id: The ID of the merchant
+
+    Returns:
+        datetime.date or None if the merchant has no transactions
+    """
+    return get_watermarks().latest_date(merchant_id)
+
+
+def get_daily_sales(merchant_id: str, start_date: date, end_date: date) -> pd.DataFrame:
+    """
+    Get a merchant's per-day revenue and order count between two dates (inclusive).
+    Days without orders have no row.
+
+    Returns:
+        pd.DataFrame: date, revenue, orders
+    """
+    df = query_to_dataframe(DAILY_SALES_QUERY, {
+        "merchant_id": merchant_id,
+        "start_date": str(start_date),
+        "end_date": str(end_date)
+    })
+    return _to_date_frame(df)
+
+
+def get_hourly_sales(merchant_id: str, start_date: date, end_date: date) -> pd.DataFrame:
+    """
+    Get a merchant's per-hour revenue and order count between two dates (inclusive).
+    Hours without orders have no row.
+
+    Returns:
+        pd.DataFrame: date, hour, revenue, orders
+    """
+    df = query_to_dataframe(HOURLY_SALES_QUERY, {
+        "merchant_id": merchant_id,
+        "start_date": str(start_date),
+        "end_date": str(end_date)
+    })
+    return _to_date_frame(df)
+
+
+def sum_sales(daily: pd.DataFrame, start_date: date, end_date: date):
+    """
+    Sum revenue and orders of the rollup rows between two dates (inclusive).
+
+    Returns:
+        tuple: (revenue, orders)
+    """
+    if daily.empty:
+        return 0.0, 0
+    window = daily[(daily["date"] >= start_date) & (daily["date"] <= end_date)]
+    return float(window["revenue"].sum()), int(window["orders"].sum())
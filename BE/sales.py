@@ -1,6 +1,5 @@
-import pandas as pd
 from datetime import datetime, timedelta
-from database import query_to_dataframe
+from rollups import get_latest_sales_date, get_daily_sales, sum_sales
 
 def get_merchant_today_summary(merchant_id: str) -> dict:
     """
@@ -14,16 +13,10 @@ def get_merchant_today_summary(merchant_id: str) -> dict:
         dict: Dictionary containing total_sales and total_orders for today
     """
     try:
-        # Get all transactions for the merchant
-        query = """
-        SELECT order_time, order_value 
-        FROM transactions 
-        WHERE merchant_id = :merchant_id
-        """
-        
-        df = query_to_dataframe(query, {"merchant_id": merchant_id})
+        # Find the latest date in the data (representing "today")
+        latest_date = get_latest_sales_date(merchant_id)
         
-        if df.empty:
+        if latest_date is None:
             return {
                 "total_sales": 0,
                 "total_sales_formatted": "RM0",
@@ -38,29 +31,19 @@ def get_merchant_today_summary(merchant_id: str) -> dict:
                 "status": "No transactions found for this merchant"
             }
 
-        # Convert order_time to datetime and create date column
-        df["order_time"] = pd.to_datetime(df["order_time"], errors="coerce")
-        df["order_date"] = df["order_time"].dt.date
-        
-        # Find the latest date in the data (representing "today")
-        latest_date = df["order_date"].max()
         yesterday_date = latest_date - timedelta(days=1)
         
-        # Filter for today's transactions
-        today_df = df[df["order_date"] == latest_date]
-        
-        # Filter for yesterday's transactions
-        yesterday_df = df[df["order_date"] == yesterday_date]
+        # Only the two daily rollup rows are needed
+        daily = get_daily_sales(merchant_id, yesterday_date, latest_date)
         
         # Calculate totals for today
-        total_sales = today_df["order_value"].sum()
-        total_orders = len(today_df)
+        total_sales, total_orders = sum_sales(daily, latest_date, latest_date)
         
         # Calculate average order value
         avg_order = total_sales / total_orders if total_orders > 0 else 0
         
         # Calculate totals for yesterday
-        yesterday_sales = yesterday_df["order_value"].sum()
+        yesterday_sales, yesterday_orders = sum_sales(daily, yesterday_date, yesterday_date)
         
         # Calculate percentage change
         if yesterday_sales > 0:
@@ -69,7 +52,7 @@ def get_merchant_today_summary(merchant_id: str) -> dict:
             percentage_change = 0 if total_sales == 0 else 100  # If previous was 0, and current > 0, that's 100% increase
         
         # Calculate average order value change
-        yesterday_avg_order = yesterday_sales / len(yesterday_df) if len(yesterday_df) > 0 else 0
+        yesterday_avg_order = yesterday_sales / yesterday_orders if yesterday_orders > 0 else 0
         
         if yesterday_avg_order > 0:
             avg_order_percentage_change = ((avg_order - yesterday_avg_order) / yesterday_avg_order) * 100
@@ -121,16 +104,10 @@ def get_merchant_period_summary(merchant_id: str, period: str = "week") -> dict:
         dict: Dictionary containing total_sales and total_orders for the period
     """
     try:
-        # Get all transactions for the merchant
-        query = """
-        SELECT order_time, order_value 
-        FROM transactions 
-        WHERE merchant_id = :merchant_id
-        """
-        
-        df = query_to_dataframe(query, {"merchant_id": merchant_id})
+        # Find the latest date in the data (representing "today")
+        latest_date = get_latest_sales_date(merchant_id)
         
-        if df.empty:
+        if latest_date is None:
             return {
                 "total_sales": 0,
                 "total_sales_formatted": "RM0",
@@ -147,13 +124,6 @@ def get_merchant_period_summary(merchant_id: str, period: str = "week") -> dict:
                 "status": "No transactions found for this merchant"
             }
 
-        # Convert order_time to datetime and create date column
-        df["order_time"] = pd.to_datetime(df["order_time"], errors="coerce")
-        df["order_date"] = df["order_time"].dt.date
-        
-        # Find the latest date in the data (representing "today")
-        latest_date = df["order_date"].max()
-        
         # Determine the start date based on the period
         if period == "week":
             # Current period: Last 7 days including today
@@ -174,19 +144,14 @@ def get_merchant_period_summary(merchant_id: str, period: str = "week") -> dict:
         else:
             raise ValueError("Period must be 'week' or 'month'")
             
-        # Filter for the current period's transactions
-        current_period_df = df[(df["order_date"] >= current_period_start) & (df["order_date"] <= current_period_end)]
-        
-        # Filter for the previous period's transactions
-        previous_period_df = df[(df["order_date"] >= previous_period_start) & (df["order_date"] <= previous_period_end)]
+        # Daily rollup rows covering both periods
+        daily = get_daily_sales(merchant_id, previous_period_start, current_period_end)
         
         # Calculate current period totals
-        current_total_sales = current_period_df["order_value"].sum()
-        current_total_orders = len(current_period_df)
+        current_total_sales, current_total_orders = sum_sales(daily, current_period_start, current_period_end)
         
         # Calculate previous period totals
-        previous_total_sales = previous_period_df["order_value"].sum()
-        previous_total_orders = len(previous_period_df)
+        previous_total_sales, previous_total_orders = sum_sales(daily, previous_period_start, previous_period_end)
         
         # Calculate percentage changes
         if previous_total_sales > 0:
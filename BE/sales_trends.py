@@ -1,7 +1,6 @@
 import pandas as pd
 from datetime import datetime, timedelta
-from database import query_to_dataframe
-from date_utils import get_latest_transaction_date
+from rollups import get_latest_sales_date, get_daily_sales, get_hourly_sales
 import math
 
 # Add this helper function to sanitize numerical values
@@ -26,34 +25,22 @@ def get_daily_sales_trend(merchant_id: str):
         dict: Dictionary containing labels (2-hour intervals) and datasets for chart visualization
     """
     try:
-        query = """
-        SELECT order_time, order_value 
-        FROM transactions 
-        WHERE merchant_id = :merchant_id
-        """
-        
-        df = query_to_dataframe(query, {"merchant_id": merchant_id})
-        
-        if df.empty:
+        # "Today" is the merchant's latest sales date, as for the today summary.
+        # A merchant without any rollup rows has no transactions at all.
+        latest_date = get_latest_sales_date(merchant_id)
+        if latest_date is None:
             return default_daily_sales_trend()
-
-        # Convert order_time to datetime
-        df["order_time"] = pd.to_datetime(df["order_time"], errors="coerce")
-        
-        # Find the latest date using the shared function
-        latest_date = get_latest_transaction_date()
-        
-        # Filter today's transactions
-        df["date"] = df["order_time"].dt.date
-        today_df = df[df["date"] == latest_date]
         
         # Get yesterday's date for comparison
         yesterday_date = latest_date - timedelta(days=1)
-        yesterday_df = df[df["date"] == yesterday_date]
         
-        # Extract hour and aggregate sales by hour
-        today_df["hour"] = today_df["order_time"].dt.hour
-        today_df["two_hour_block"] = (today_df["hour"] // 2) * 2  # Group into 2-hour blocks
+        # Hourly rollup rows for yesterday and today
+        hourly = get_hourly_sales(merchant_id, yesterday_date, latest_date)
+        hourly["two_hour_block"] = (hourly["hour"] // 2) * 2  # Group into 2-hour blocks
+        hourly = hourly.rename(columns={"revenue": "order_value"})
+        
+        # Aggregate today's sales by 2-hour block
+        today_df = hourly[hourly["date"] == latest_date]
         today_hourly = today_df.groupby("two_hour_block")["order_value"].sum().reset_index()
         
         # Create 2-hour blocks from 8AM to 10PM (typical business hours)
@@ -76,8 +63,7 @@ def get_daily_sales_trend(merchant_id: str):
             sales_data.append(safe_float(block_sales))
         
         # Get previous day comparison data with the same 2-hour blocks
-        yesterday_df["hour"] = yesterday_df["order_time"].dt.hour
-        yesterday_df["two_hour_block"] = (yesterday_df["hour"] // 2) * 2
+        yesterday_df = hourly[hourly["date"] == yesterday_date]
         yesterday_hourly = yesterday_df.groupby("two_hour_block")["order_value"].sum().reset_index()
         
         prev_sales_data = []
@@ -120,23 +106,15 @@ def get_weekly_sales_trend(merchant_id: str):
         dict: Dictionary containing labels (days) and datasets for chart visualization
     """
     try:
-        query = """
-        SELECT order_time, order_value 
-        FROM transactions 
-        WHERE merchant_id = :merchant_id
-        """
-        
-        df = query_to_dataframe(query, {"merchant_id": merchant_id})
+        # Find the latest date in the data
+        latest_date = get_latest_sales_date(merchant_id)
         
-        if df.empty:
+        if latest_date is None:
             return default_weekly_sales_trend()
 
-        # Convert order_time to datetime
-        df["order_time"] = pd.to_datetime(df["order_time"], errors="coerce")
-        df["date"] = df["order_time"].dt.date
-        
-        # Find the latest date in the data
-        latest_date = df["date"].max()
+        # Daily rollup rows for this week and the previous one
+        df = get_daily_sales(merchant_id, latest_date - timedelta(days=13), latest_date)
+        df = df.rename(columns={"revenue": "order_value"})
         
         # Calculate the start of the current week (last 7 days including today)
         week_start = latest_date - timedelta(days=6)
@@ -221,23 +199,15 @@ def get_monthly_sales_trend(merchant_id: str):
         dict: Dictionary containing labels (weeks) and datasets for chart visualization
     """
     try:
-        query = """
-        SELECT order_time, order_value 
-        FROM transactions 
-        WHERE merchant_id = :merchant_id
-        """
-        
-        df = query_to_dataframe(query, {"merchant_id": merchant_id})
+        # Find the latest date in the data
+        latest_date = get_latest_sales_date(merchant_id)
         
-        if df.empty:
+        if latest_date is None:
             return default_monthly_sales_trend()
 
-        # Convert order_time to datetime
-        df["order_time"] = pd.to_datetime(df["order_time"], errors="coerce")
-        df["date"] = df["order_time"].dt.date
-        
-        # Find the latest date in the data
-        latest_date = df["date"].max()
+        # Daily rollup rows for this month and the previous one
+        df = get_daily_sales(merchant_id, latest_date - timedelta(days=59), latest_date)
+        df = df.rename(columns={"revenue": "order_value"})
         
         # Calculate the start of the current month (last 30 days including today)
         month_start = latest_date - timedelta(days=29)
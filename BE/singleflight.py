@@ -0,0 +1,183 @@
+"""
+Single-flight request coalescing.
+
+While a call for a key is in flight, further calls with the same key do not
+start their own computation: they wait for the one in flight and all get
+its result, or its exception. This keeps a burst of requests for one cold
+merchant (several devices opening at once, a push notification) down to a
+single query or LLM call. Waiters can give up after a timeout without
+cancelling the computation for the others.
+"""
+import time
+import asyncio
+import inspect
+import threading
+import functools
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+# Every group created through this module, by name, for the stats endpoint
+_groups = {}
+
+
+class SingleFlight:
+    """In-flight calls by key, with counters of how many callers were coalesced"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._async_calls = {}  # key -> asyncio.Task
+        self._sync_calls = {}  # key -> concurrent.futures.Future
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.total_seconds = 0.0
+        _groups[name] = self
+
+    def _timed_out(self, timeout: float) -> TimeoutError:
+        with self._lock:
+            self.timeouts += 1
+        return TimeoutError(f"{self.name} did not finish within {timeout}s")
+
+    async def do_async(self, key, func, *args, timeout: float = None, **kwargs):
+        """
+        Await func(*args, **kwargs), or the call already in flight for key.
+
+        Args:
+            key: Hashable key; calls with equal keys share one execution
+            func: Coroutine function
+            timeout: Seconds this caller waits before TimeoutError; the call
+                keeps running for the other callers
+
+        Returns:
+            The result of the shared call. Its exception is raised in every caller.
+        """
+        with self._lock:
+            self.calls += 1
+            task = self._async_calls.get(key)
+            if task is None:
+                self.executions += 1
+                task = asyncio.ensure_future(self._run_async(key, func, args, kwargs))
+                # Every caller may have given up, so mark its exception as retrieved
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+                self._async_calls[key] = task
+            else:
+                self.coalesced += 1
+        try:
+            # shield: a caller that is cancelled or times out leaves the call running for the others
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            raise self._timed_out(timeout)
+
+    async def _run_async(self, key, func, args, kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                self.total_seconds += time.perf_counter() - started
+                self._async_calls.pop(key, None)
+
+    def do(self, key, func, *args, timeout: float = None, **kwargs):
+        """
+        Call func(*args, **kwargs), or wait for the call already in flight for
+        key in another thread.
+
+        The first caller runs func in its own thread; timeout only applies to
+        the callers waiting for it.
+        """
+        with self._lock:
+            self.calls += 1
+            future = self._sync_calls.get(key)
+            leader = future is None
+            if leader:
+                self.executions += 1
+                future = Future()
+                self._sync_calls[key] = future
+            else:
+                self.coalesced += 1
+        if not leader:
+            try:
+                return future.result(timeout)
+            except FutureTimeoutError:
+                # Only an alias of the builtin TimeoutError from Python 3.11
+                if future.done():
+                    raise  # The shared call itself raised TimeoutError
+                raise self._timed_out(timeout)
+
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            with self._lock:
+                self.errors += 1
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self.total_seconds += time.perf_counter() - started
+                self._sync_calls.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._async_calls) + len(self._sync_calls),
+                "calls": self.calls,
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "coalesced_rate": round(self.coalesced / self.calls, 3) if self.calls else 0.0,
+                "errors": self.errors,
+                "timeouts": self.timeouts,
+                "avg_seconds": round(self.total_seconds / self.executions, 3) if self.executions else 0.0,
+            }
+
+
+def singleflight(name: str = None, key=None, timeout: float = None):
+    """
+    Coalesce concurrent calls of a function with the same arguments.
+
+    Args:
+        name: Group name in the stats, defaults to the function's module.name
+        key: Function of the call's arguments returning the coalescing key,
+            defaults to the arguments themselves (which must be hashable)
+        timeout: Seconds a caller waits before TimeoutError (for plain
+            functions only callers waiting on another thread's call time out)
+
+    Coroutine functions are coalesced within the event loop, plain functions
+    across threads. The wrapped function gets a flight attribute holding its
+    SingleFlight.
+    """
+    def decorator(func):
+        flight = SingleFlight(name or f"{func.__module__}.{func.__name__}")
+
+        def call_key(args, kwargs):
+            if key is not None:
+                return key(*args, **kwargs)
+            return (args, tuple(sorted(kwargs.items())))
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                return await flight.do_async(call_key(args, kwargs), func, *args, timeout=timeout, **kwargs)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                return flight.do(call_key(args, kwargs), func, *args, timeout=timeout, **kwargs)
+
+        wrapper.flight = flight
+        return wrapper
+
+    return decorator
+
+
+def get_singleflight_stats() -> dict:
+    """Counters of every single-flight group"""
+    return {name: group.stats() for name, group in sorted(_groups.items())}
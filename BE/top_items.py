@@ -3,12 +3,40 @@ import numpy as np
 from datetime import datetime, timedelta
 from database import query_to_dataframe
 from date_utils import get_latest_transaction_date
+from rollups import get_latest_sales_date
+from transaction_store import get_transaction_store
+from cache import cached
 import math
 import traceback
 
-# Simple in-memory cache
-merchant_cache = {}
+MERCHANT_ITEMS_QUERY = """
+SELECT item_id, item_name, item_price
+FROM items
+WHERE merchant_id = :merchant_id
+"""
 
+def _count_merchant_items(merchant_id: str, start_date, end_date, order_items=None) -> pd.DataFrame:
+    """
+    Count how often each of the merchant's own items was sold between
+    start_date and end_date (both inclusive), most sold first.
+
+    Returns:
+        pd.DataFrame: item_id, item_name, item_price and item_count
+    """
+    if order_items is None:
+        order_items = get_transaction_store().order_items(
+            merchant_id, start=start_date, end=end_date + timedelta(days=1)
+        )
+
+    items_df = query_to_dataframe(MERCHANT_ITEMS_QUERY, {"merchant_id": merchant_id})
+    items_df["item_id"] = items_df["item_id"].astype(str)
+
+    counts = order_items["item_id"].value_counts()
+    counts = counts[counts.index.isin(items_df["item_id"])]
+    counts = counts.rename("item_count").rename_axis("item_id").reset_index()
+    return counts.merge(items_df, on="item_id")[["item_id", "item_name", "item_price", "item_count"]]
+
+@cached(("transactions", "catalog"))
 def get_top_selling_items(merchant_id: str, limit: int = 5):
     """
     Get top selling items for a merchant for the last 30 days.
@@ -21,39 +49,13 @@ def get_top_selling_items(merchant_id: str, limit: int = 5):
         dict: Dictionary containing chart data for top selling items
     """
     try:
-        # Check if cached
-        if merchant_id in merchant_cache:
-            return merchant_cache[merchant_id]
-        
-        # Last 30 days
-        end_date = get_latest_transaction_date()
+        # Last 30 days up to the merchant's latest sales date
+        end_date = get_latest_sales_date(merchant_id) or get_latest_transaction_date()
         start_date = end_date - timedelta(days=30)
 
-        # Optimized join query
-        query = """
-        SELECT 
-            ti.item_id, 
-            i.item_name, 
-            i.item_price,
-            COUNT(*) as item_count
-        FROM transaction_items ti
-        JOIN items i ON ti.item_id = i.item_id
-        JOIN transactions t ON t.order_id = ti.order_id
-        WHERE 
-            i.merchant_id = :merchant_id AND 
-            t.merchant_id = :merchant_id AND 
-            DATE(t.order_time) BETWEEN :start_date AND :end_date
-        GROUP BY ti.item_id
-        ORDER BY item_count DESC
-        LIMIT :limit
-        """
-        
-        df = query_to_dataframe(query, {
-            "merchant_id": merchant_id,
-            "start_date": str(start_date),
-            "end_date": str(end_date),
-            "limit": limit
-        })
+        # Count the merchant's items sold in the window from the in-memory store
+        item_counts = _count_merchant_items(merchant_id, start_date, end_date)
+        df = item_counts.head(limit).reset_index(drop=True)
 
         if df.empty:
             return {
@@ -88,9 +90,6 @@ def get_top_selling_items(merchant_id: str, limit: int = 5):
             "best_seller_percent": int(df.iloc[0]["percentage"])
         }
 
-        # Cache result
-        merchant_cache[merchant_id] = result
-
         return result
 
     except Exception as e:
@@ -101,10 +100,11 @@ def get_top_selling_items(merchant_id: str, limit: int = 5):
             "message": "Internal server error while fetching top items."
         }
 
+@cached(("transactions", "catalog"))
 def get_best_seller(merchant_id: str) -> dict:
     """
     Get only the best selling item and its percentage for a merchant.
-    Returns cached data if available to avoid reprocessing.
+    Results are cached until transactions or items change.
     
     Args:
         merchant_id: The ID of the merchant
@@ -113,54 +113,16 @@ def get_best_seller(merchant_id: str) -> dict:
         dict: {'name': str, 'percentage': int} or empty dict if no data
     """
     try:
-        # First try to get from cache
-        if merchant_id in merchant_cache:
-            cached = merchant_cache[merchant_id]
-            return {
-                'name': cached['best_seller'],
-                'percentage': cached['best_seller_percent']
-            }
-        
-        # If not cached, use a simplified query
-        end_date = get_latest_transaction_date()
+        end_date = get_latest_sales_date(merchant_id) or get_latest_transaction_date()
         start_date = end_date - timedelta(days=30)
 
-        query = """
-        SELECT 
-            i.item_name,
-            COUNT(*) as item_count
-        FROM transaction_items ti
-        JOIN items i ON ti.item_id = i.item_id
-        JOIN transactions t ON t.order_id = ti.order_id
-        WHERE 
-            i.merchant_id = :merchant_id AND 
-            t.merchant_id = :merchant_id AND 
-            DATE(t.order_time) BETWEEN :start_date AND :end_date
-        GROUP BY i.item_name
-        ORDER BY item_count DESC
-        LIMIT 1
-        """
-        
-        result = query_to_dataframe(query, {
-            "merchant_id": merchant_id,
-            "start_date": str(start_date),
-            "end_date": str(end_date)
-        })
+        store = get_transaction_store()
+        order_items = store.order_items(merchant_id, start=start_date, end=end_date + timedelta(days=1))
+        by_name = _count_merchant_items(merchant_id, start_date, end_date, order_items)
+        result = by_name.groupby("item_name", sort=False)["item_count"].sum().sort_values(ascending=False).reset_index()
 
         if not result.empty:
-            total_query = """
-            SELECT COUNT(*) as total
-            FROM transaction_items ti
-            JOIN transactions t ON t.order_id = ti.order_id
-            WHERE 
-                t.merchant_id = :merchant_id AND 
-                DATE(t.order_time) BETWEEN :start_date AND :end_date
-            """
-            total = query_to_dataframe(total_query, {
-                "merchant_id": merchant_id,
-                "start_date": str(start_date),
-                "end_date": str(end_date)
-            }).iloc[0]['total']
+            total = len(order_items)
             
             percentage = round((result.iloc[0]['item_count'] / total * 100))
             
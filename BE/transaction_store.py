@@ -0,0 +1,227 @@
+import threading
+import numpy as np
+import pandas as pd
+from database import query_to_dataframe, read_snapshot, snapshot_is_current, get_data_version
+
+# int64 value of NaT in the epoch-nanosecond columns
+NAT = np.iinfo(np.int64).min
+
+TRANSACTION_COLUMNS = ["order_id", "merchant_id", "eater_id", "order_time", "delivery_time", "order_value"]
+
+TRANSACTIONS_QUERY = f"SELECT {', '.join(TRANSACTION_COLUMNS)} FROM transactions"
+
+TRANSACTION_ITEMS_QUERY = "SELECT order_id, item_id FROM transaction_items"
+
+
+class _Snapshot:
+    """
+    Immutable columnar copy of the transactions and transaction_items tables.
+
+    Transactions are sorted by (merchant, order_time) so every merchant owns one
+    contiguous slice [tx_offsets[code], tx_offsets[code + 1]). Order times are
+    stored as int64 epoch nanoseconds and all IDs as categorical codes.
+    """
+
+    def __init__(self, tx: pd.DataFrame, tx_items: pd.DataFrame):
+        merchant_cat = pd.Categorical(tx["merchant_id"].astype(str))
+        order_time = pd.to_datetime(tx["order_time"], errors="coerce")
+        order_ns = order_time.to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+        # Sort by merchant first, then by time inside each merchant partition
+        order = np.lexsort((order_ns, merchant_cat.codes))
+
+        self.merchants = merchant_cat.categories
+        self.merchant_codes = merchant_cat.codes[order]
+        self.order_time = order_ns[order]
+        self.order_value = tx["order_value"].to_numpy(dtype=np.float64)[order]
+        self.order_ids = tx["order_id"].astype(str).to_numpy()[order]
+
+        eater_cat = pd.Categorical(tx["eater_id"].astype(str))
+        self.eaters = eater_cat.categories
+        self.eater_codes = eater_cat.codes[order]
+
+        # Prefix sums make per-merchant totals O(1) per merchant. Missing
+        # order values count as 0 (as in Series.sum) instead of turning every
+        # later prefix sum into NaN.
+        self.cum_value = np.concatenate(([0.0], np.cumsum(np.nan_to_num(self.order_value, nan=0.0))))
+
+        if "delivery_time" in tx.columns:
+            delivery = pd.to_datetime(tx["delivery_time"], errors="coerce")
+            self.delivery_time = delivery.to_numpy(dtype="datetime64[ns]").view(np.int64)[order]
+            minutes = (self.delivery_time - self.order_time) / 6e10
+            valid = (self.delivery_time != NAT) & (self.order_time != NAT)
+            self.cum_delivery_mins = np.concatenate(([0.0], np.cumsum(np.where(valid, minutes, 0.0))))
+            self.cum_delivery_count = np.concatenate(([0], np.cumsum(valid)))
+        else:
+            self.delivery_time = None
+
+        self.tx_offsets = np.searchsorted(
+            self.merchant_codes, np.arange(len(self.merchants) + 1)
+        )
+
+        # Attach every transaction item to the position of its order, then
+        # partition the items by the merchant of that order
+        order_pos = pd.Index(self.order_ids).get_indexer(tx_items["order_id"].astype(str))
+        valid = order_pos >= 0
+        order_pos = order_pos[valid]
+        item_cat = pd.Categorical(tx_items["item_id"].astype(str).to_numpy()[valid])
+
+        item_order = np.argsort(order_pos, kind="stable")
+        self.items = item_cat.categories
+        self.item_codes = item_cat.codes[item_order]
+        self.item_order_pos = order_pos[item_order]
+
+        self.merchant_index = {m: i for i, m in enumerate(self.merchants)}
+
+
+class TransactionStore:
+    """
+    Process-wide, merchant-partitioned in-memory view of the transactions.
+
+    The tables are loaded lazily on first use and reloaded whenever the
+    "transactions" data version changes, so imports made by another worker,
+    a CLI run or a snapshot reload are picked up too. Every query is a slice
+    of pre-sorted NumPy columns instead of a SQL scan plus a datetime parse.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._version = None
+
+    def _get(self) -> _Snapshot:
+        version = get_data_version("transactions")
+        snapshot = self._snapshot
+        if snapshot is None or self._version != version:
+            with self._lock:
+                if self._snapshot is None or self._version != version:
+                    self._snapshot = self._load()
+                    self._version = version
+                snapshot = self._snapshot
+        return snapshot
+
+    def _load(self) -> _Snapshot:
+        # A Parquet snapshot taken after the last ingest is read memory-mapped,
+        # limited to the columns the store keeps
+        if snapshot_is_current("transactions") and snapshot_is_current("transaction_items"):
+            tx = read_snapshot("transactions", columns=TRANSACTION_COLUMNS)
+            tx_items = read_snapshot("transaction_items", columns=["order_id", "item_id"])
+            return _Snapshot(tx, tx_items)
+        
+        tx = query_to_dataframe(
+            TRANSACTIONS_QUERY,
+            dtypes={"order_value": "float64"},
+            parse_dates=["order_time", "delivery_time"],
+        )
+        tx_items = query_to_dataframe(TRANSACTION_ITEMS_QUERY)
+        return _Snapshot(tx, tx_items)
+
+    def invalidate(self):
+        """Drop the loaded snapshot so the next query reloads from the database"""
+        with self._lock:
+            self._snapshot = None
+            self._version = None
+
+    def _time_slice(self, snapshot: _Snapshot, merchant_id: str, start=None, end=None):
+        code = snapshot.merchant_index.get(str(merchant_id))
+        if code is None:
+            return 0, 0
+        lo, hi = snapshot.tx_offsets[code], snapshot.tx_offsets[code + 1]
+        times = snapshot.order_time[lo:hi]
+        if start is not None:
+            lo += np.searchsorted(times, pd.Timestamp(start).value, side="left")
+        if end is not None:
+            hi = snapshot.tx_offsets[code] + np.searchsorted(times, pd.Timestamp(end).value, side="left")
+        return lo, max(lo, hi)
+
+    def transactions(self, merchant_id: str, start=None, end=None) -> pd.DataFrame:
+        """
+        Get a merchant's transactions, optionally limited to [start, end).
+
+        Args:
+            merchant_id: The ID of the merchant
+            start: Inclusive lower bound on order_time
+            end: Exclusive upper bound on order_time
+
+        Returns:
+            pd.DataFrame: order_id, eater_id, order_time, order_value and,
+            when available, delivery_time - sorted by order_time
+        """
+        snapshot = self._get()
+        lo, hi = self._time_slice(snapshot, merchant_id, start, end)
+        df = pd.DataFrame({
+            "order_id": snapshot.order_ids[lo:hi],
+            "merchant_id": str(merchant_id),
+            "eater_id": snapshot.eaters.take(snapshot.eater_codes[lo:hi]),
+            "order_time": snapshot.order_time[lo:hi].view("datetime64[ns]"),
+            "order_value": snapshot.order_value[lo:hi],
+        })
+        if snapshot.delivery_time is not None:
+            df["delivery_time"] = snapshot.delivery_time[lo:hi].view("datetime64[ns]")
+        return df
+
+    def order_items(self, merchant_id: str, start=None, end=None) -> pd.DataFrame:
+        """
+        Get the transaction items of a merchant's orders, optionally limited to
+        orders placed in [start, end).
+
+        Returns:
+            pd.DataFrame: order_id, item_id and eater_id for every item row
+        """
+        snapshot = self._get()
+        lo, hi = self._time_slice(snapshot, merchant_id, start, end)
+        item_lo = np.searchsorted(snapshot.item_order_pos, lo, side="left")
+        item_hi = np.searchsorted(snapshot.item_order_pos, hi, side="left")
+        order_pos = snapshot.item_order_pos[item_lo:item_hi]
+        return pd.DataFrame({
+            "order_id": snapshot.order_ids[order_pos],
+            "item_id": snapshot.items.take(snapshot.item_codes[item_lo:item_hi]),
+            "eater_id": snapshot.eaters.take(snapshot.eater_codes[order_pos]),
+        })
+
+    def merchant_totals(self, merchant_ids) -> pd.DataFrame:
+        """
+        Get revenue, order count and summed delivery minutes per merchant.
+
+        Args:
+            merchant_ids: Iterable of merchant IDs
+
+        Returns:
+            pd.DataFrame: One row per merchant that has transactions. The
+            delivery_mins_sum / delivery_count columns are only present when
+            the transactions carry a delivery_time.
+        """
+        snapshot = self._get()
+        codes = [snapshot.merchant_index[m] for m in map(str, merchant_ids) if m in snapshot.merchant_index]
+        codes = np.array(sorted(codes), dtype=np.int64)
+        if len(codes) == 0:
+            return pd.DataFrame(columns=["merchant_id", "revenue", "orders"])
+
+        starts = snapshot.tx_offsets[codes]
+        ends = snapshot.tx_offsets[codes + 1]
+        result = pd.DataFrame({
+            "merchant_id": snapshot.merchants.take(codes),
+            "revenue": snapshot.cum_value[ends] - snapshot.cum_value[starts],
+            "orders": ends - starts,
+        })
+        if snapshot.delivery_time is not None:
+            result["delivery_mins_sum"] = snapshot.cum_delivery_mins[ends] - snapshot.cum_delivery_mins[starts]
+            result["delivery_count"] = snapshot.cum_delivery_count[ends] - snapshot.cum_delivery_count[starts]
+        return result
+
+    def latest_order_time(self, merchant_id: str = None):
+        """Get the latest order time of a merchant, or of all merchants when None"""
+        snapshot = self._get()
+        if merchant_id is None:
+            times = snapshot.order_time[snapshot.order_time != NAT]
+            return pd.Timestamp(times.max()) if len(times) else None
+        lo, hi = self._time_slice(snapshot, merchant_id)
+        return pd.Timestamp(snapshot.order_time[hi - 1]) if hi > lo else None
+
+
+_store = TransactionStore()
+
+
+def get_transaction_store() -> TransactionStore:
+    """Get the process-wide transaction store"""
+    return _store
@@ -0,0 +1,65 @@
+import threading
+from database import query_to_dataframe, get_data_version, ORDER_WATERMARKS_SELECT
+
+MERCHANT_WATERMARKS_QUERY = """
+SELECT merchant_id, latest_order_time FROM merchant_watermarks
+"""
+
+
+class WatermarkService:
+    """
+    Latest order time per merchant and across all merchants.
+
+    The merchant_watermarks table is maintained by the ingest paths. This
+    service keeps an in-memory copy of it and reloads only when the
+    transactions data version changes. A read costs one data_versions
+    primary-key query plus a dict lookup, not a scan of the transactions.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._by_merchant = {}
+        self._latest = None
+
+    def _load(self):
+        df = query_to_dataframe(MERCHANT_WATERMARKS_QUERY, parse_dates=["latest_order_time"])
+        if df.empty:
+            # Database imported before the watermarks table existed
+            df = query_to_dataframe(ORDER_WATERMARKS_SELECT, parse_dates=["latest_order_time"])
+        df = df.dropna(subset=["latest_order_time"])
+        self._by_merchant = dict(zip(df["merchant_id"].astype(str), df["latest_order_time"]))
+        self._latest = df["latest_order_time"].max() if not df.empty else None
+
+    def _current(self):
+        version = get_data_version("transactions")
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._load()
+                    self._version = version
+
+    def latest_order_time(self, merchant_id: str = None):
+        """
+        Get the latest order time of a merchant, or of all merchants when None.
+
+        Returns:
+            pd.Timestamp or None if there are no transactions
+        """
+        self._current()
+        if merchant_id is None:
+            return self._latest
+        return self._by_merchant.get(str(merchant_id))
+
+    def latest_date(self, merchant_id: str = None):
+        """Same as latest_order_time, as a datetime.date"""
+        latest = self.latest_order_time(merchant_id)
+        return latest.date() if latest is not None else None
+
+
+_service = WatermarkService()
+
+
+def get_watermarks() -> WatermarkService:
+    """Get the process-wide watermark service"""
+    return _service